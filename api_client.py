@@ -1,13 +1,92 @@
 # api_client.py
 # API客户端模块，处理与目标API的通信
 
-import httpx
-import json
 import asyncio
+import httpx
+import fast_json
+import logging
 import random
+import time
+from typing import Optional
 from fastapi import HTTPException
 from fastapi.responses import StreamingResponse
-from random_user_agent.user_agent import UserAgent
+from config import UpstreamConfig, SingleFlightConfig, ResilienceConfig, ChoicesConfig
+from log_utils import get_logger, log_event, should_sample, elapsed_ms
+from sse_parser import SSEDecoder, SSEEvent
+from singleflight import single_flight
+from scheduler import scheduler
+from resilience import resilience, is_retryable
+from upstreams import upstream_pool
+from metrics import observe_upstream_connect, error_class
+from cache import make_cache_key
+from models import DEFAULT_MODEL
+from response_formatter import StreamChunkFramer, STREAM_DONE
+from relay import relay_stream
+from tracing import span, start_span
+from capture import current_capture
+
+logger = get_logger("api_client")
+
+# 应用级共享的上游客户端，由main.py的生命周期负责创建和关闭
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _http2_available() -> bool:
+    """检查是否安装了HTTP/2所需的h2库"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _create_client() -> httpx.AsyncClient:
+    """根据UpstreamConfig创建带连接池的上游客户端"""
+    http2 = UpstreamConfig.HTTP2
+    if http2 and not _http2_available():
+        log_event(logger, logging.WARNING, "http2_unavailable", detail="已启用UPSTREAM_HTTP2但未安装h2，回退到HTTP/1.1")
+        http2 = False
+
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=UpstreamConfig.MAX_CONNECTIONS,
+            max_keepalive_connections=UpstreamConfig.MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=UpstreamConfig.KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            connect=UpstreamConfig.CONNECT_TIMEOUT,
+            read=UpstreamConfig.READ_TIMEOUT,
+            write=UpstreamConfig.WRITE_TIMEOUT,
+            pool=UpstreamConfig.POOL_TIMEOUT,
+        ),
+    )
+
+
+async def init_client():
+    """应用启动时创建共享的上游客户端"""
+    global _client
+    if _client is None:
+        _client = _create_client()
+
+
+async def close_client():
+    """应用关闭时释放共享客户端及其连接池"""
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.aclose()
+
+
+def get_client() -> httpx.AsyncClient:
+    """获取共享的上游客户端
+
+    未经过应用生命周期（例如在脚本中直接调用call_api）时按需创建。
+    """
+    global _client
+    if _client is None:
+        _client = _create_client()
+    return _client
 
 
 def generate_random_user_agent():
@@ -16,7 +95,8 @@ def generate_random_user_agent():
     Returns:
         随机生成的User-Agent字符串
     """
-    # 使用random-user-agent库生成随机User-Agent
+    # 使用random-user-agent库生成随机User-Agent（需要时在此处导入，不拖慢启动）
+    # from random_user_agent.user_agent import UserAgent
     # user_agent_rotator = UserAgent()
     # return user_agent_rotator.get_random_user_agent()
 
@@ -27,138 +107,333 @@ def generate_random_user_agent():
     return user_agent
 
 
-async def call_api(payload, is_stream=False):
-    """调用目标API并处理响应
+def build_upstream_headers(upstream=None):
+    """构造模拟浏览器的上游请求头
+    
+    Args:
+        upstream: 目标上游（upstreams.Upstream），用它的站点替换Origin/Referer并应用其请求头覆盖
+    """
+    # 生成随机User-Agent
+    user_agent = generate_random_user_agent()
+    headers = {
+        #   -H 'accept: */*' \
+        #   -H 'accept-language: zh-CN,zh;q=0.9,en;q=0.8' \
+        #   -H 'content-type: application/json' \
+        #   -H 'origin: https://deepseek.rkui.cn' \
+        #   -H 'priority: u=1, i' \
+        #   -H 'referer: https://deepseek.rkui.cn/' \
+        #   -H 'sec-ch-ua: "Chromium";v="134", "Not:A-Brand";v="24", "Google Chrome";v="134"' \
+        #   -H 'sec-ch-ua-mobile: ?0' \
+        #   -H 'sec-ch-ua-platform: "Windows"' \
+        #   -H 'sec-fetch-dest: empty' \
+        #   -H 'sec-fetch-mode: cors' \
+        #   -H 'sec-fetch-site: same-origin' \
+        # "referrerPolicy": "strict-origin-when-cross-origin",
+        "Accept": "*/*",
+        "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
+        "Content-Type": "application/json",
+        "Origin": "https://deepseek.rkui.cn",
+        "Priority": "u=1, i",
+        "Referer": "https://deepseek.rkui.cn/",
+        "Sec-Ch-Ua": '"Chromium";v="134", "Not:A-Brand";v="24", "Google Chrome";v="134"',
+        "Sec-Ch-Ua-Mobile": "?0",
+        "Sec-Ch-Ua-Platform": '"Windows"',
+        "Sec-Fetch-Dest": "empty",
+        "Sec-Fetch-Mode": "cors",
+        "Sec-Fetch-Site": "same-origin",
+        "Referrer-Policy": "strict-origin-when-cross-origin",
+        "User-Agent": user_agent
+    }
+    if upstream is not None:
+        headers["Origin"] = upstream.origin
+        headers["Referer"] = upstream.origin + "/"
+        headers.update(upstream.header_overrides)
+    return headers
+
+
+async def open_upstream(payload):
+    """发送上游请求，返回上游事件批次的异步迭代器
+    
+    只等待响应头；状态码异常或返回普通JSON时在这里处理，
+    因此错误总是发生在向客户端发送第一个字节之前。
+    发送前先向调度器申请并发名额，名额一直占用到上游流读完或关闭；
+    上游从上游池中选择，首字节前失败会自动换到下一个上游。
     
     Args:
         payload: 请求负载
-        is_stream: 是否为流式请求
         
     Returns:
-        流式响应或完整内容
+        逐批产出SSEEvent列表的异步生成器，关闭时归还上游连接和并发名额
     """
+    # 超过并发上限时排队，队列已满或等待超时则抛出429
+    with span("scheduler.wait"):
+        lease = await scheduler.acquire(payload['model'])
+    
     try:
-        async with httpx.AsyncClient() as client:
-            # 生成随机User-Agent
-            user_agent = generate_random_user_agent()
-            
-            # 打印payload的model
-            print(f"payload的model: {payload['model']}")
-            # 发送请求到目标API
-            response = await client.post(
-                "https://deepseek.rkui.cn/api/chat",
-                json=payload,
-                timeout=60.0,
-                headers={
-                    #   -H 'accept: */*' \
-                    #   -H 'accept-language: zh-CN,zh;q=0.9,en;q=0.8' \
-                    #   -H 'content-type: application/json' \
-                    #   -H 'origin: https://deepseek.rkui.cn' \
-                    #   -H 'priority: u=1, i' \
-                    #   -H 'referer: https://deepseek.rkui.cn/' \
-                    #   -H 'sec-ch-ua: "Chromium";v="134", "Not:A-Brand";v="24", "Google Chrome";v="134"' \
-                    #   -H 'sec-ch-ua-mobile: ?0' \
-                    #   -H 'sec-ch-ua-platform: "Windows"' \
-                    #   -H 'sec-fetch-dest: empty' \
-                    #   -H 'sec-fetch-mode: cors' \
-                    #   -H 'sec-fetch-site: same-origin' \
-                    # "referrerPolicy": "strict-origin-when-cross-origin",
-                    "Accept": "*/*",
-                    "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
-                    "Content-Type": "application/json",
-                    "Origin": "https://deepseek.rkui.cn",
-                    "Priority": "u=1, i",
-                    "Referer": "https://deepseek.rkui.cn/",
-                    "Sec-Ch-Ua": '"Chromium";v="134", "Not:A-Brand";v="24", "Google Chrome";v="134"',
-                    "Sec-Ch-Ua-Mobile": "?0",
-                    "Sec-Ch-Ua-Platform": '"Windows"',
-                    "Sec-Fetch-Dest": "empty",
-                    "Sec-Fetch-Mode": "cors",
-                    "Sec-Fetch-Site": "same-origin",
-                    "Referrer-Policy": "strict-origin-when-cross-origin",
-                    "User-Agent": user_agent
-                }
-            )
+        response, upstream = await _send_with_failover(payload)
+    except BaseException:
+        lease.release()
+        raise
+    
+    def release():
+        upstream_pool.end(upstream)
+        lease.release()
+    
+    try:
+        if "json" in response.headers.get("content-type", ""):
+            # 上游直接返回了普通JSON，转换成一个等价的增量事件
+            await response.aread()
+            capture = current_capture.get()
+            if capture is not None:
+                capture.on_chunk(len(response.content))
+            try:
+                content = fast_json.loads(response.content).get("content", "")
+            except fast_json.JSONDecodeError:
+                raise HTTPException(
+                    status_code=502,
+                    detail=f"Invalid JSON response from API: {response.text[:200]}"
+                )
+            await response.aclose()
+            release()
+            return _single_batch(content)
+    except BaseException:
+        await response.aclose()
+        release()
+        raise
+    
+    return _EventBatches(response, release)
+
+
+async def _send_with_failover(payload):
+    """按上游池的优先级依次发送请求，直到某个上游返回200响应头
+    
+    连接错误、上游5xx和429会记入该上游的健康状态并立即换下一个上游；
+    其他错误直接抛出。
+    
+    Args:
+        payload: 请求负载
+        
+    Returns:
+        (以stream=True发送得到的响应, 对应的上游)，上游的在途计数由调用方负责减少
+    """
+    client = get_client()
+    model = payload['model']
+    error = None
+    for upstream in upstream_pool.candidates(model)[:max(UpstreamConfig.FAILOVER_ATTEMPTS, 1)]:
+        log_event(logger, logging.INFO, "upstream_request", model=model, upstream=upstream.name)
+        upstream_pool.begin(upstream)
+        connect_span = start_span("upstream.connect", upstream=upstream.name)
+        try:
+            # 构造请求并以流式方式发送，只等待响应头
+            request = client.build_request("POST", upstream.url, json=payload, headers=build_upstream_headers(upstream))
+            sent = time.perf_counter()
+            response = await client.send(request, stream=True)
+            elapsed = time.perf_counter() - sent
+            if connect_span is not None:
+                connect_span.end(**{"http.status_code": response.status_code})
             
             if response.status_code != 200:
+                # 错误响应体很小，读取后再关闭连接
+                await response.aread()
+                await response.aclose()
                 raise HTTPException(status_code=response.status_code, detail=response.text)
+        except Exception as e:
+            upstream_pool.end(upstream)
+            if connect_span is not None:
+                connect_span.end(error=type(e).__name__)
+            if not (is_retryable(e) or getattr(e, "status_code", None) == 429):
+                raise
+            upstream_pool.record_failure(upstream)
+            log_event(logger, logging.WARNING, "upstream_failover", model=model, upstream=upstream.name,
+                      error=type(e).__name__, status=getattr(e, "status_code", None))
+            error = e
+            continue
+        except BaseException:
+            upstream_pool.end(upstream)
+            raise
+        
+        observe_upstream_connect(model, elapsed)
+        upstream_pool.record_latency(upstream, elapsed)
+        upstream_pool.record_success(upstream)
+        capture = current_capture.get()
+        if capture is not None:
+            capture.on_response(upstream.name, elapsed)
+        return response, upstream
+    
+    raise error
+
+
+async def _single_batch(content):
+    """把一段完整内容包装成只有一批事件的迭代器"""
+    yield [SSEEvent(fast_json.dumps({"choices": [{"delta": {"content": content}}]}))]
+
+
+class _EventBatches:
+    """上游事件批次的异步迭代器，包装_iter_event_batches
+    
+    异步生成器在第一次迭代之前被关闭时不会执行finally，上游连接和并发名额就不会归还；
+    n>1时已打开但尚未开始读取的分支会遇到这种情况，这里在未开始迭代时直接关闭响应。
+    """
+    
+    __slots__ = ("_response", "_release", "_batches", "_started")
+    
+    def __init__(self, response, release):
+        self._response = response
+        self._release = release
+        self._batches = _iter_event_batches(response, release)
+        self._started = False
+    
+    def __aiter__(self):
+        return self
+    
+    def __anext__(self):
+        self._started = True
+        return self._batches.__anext__()
+    
+    async def aclose(self):
+        if self._started:
+            await self._batches.aclose()
+            return
+        # 只关闭一次：之后再迭代或关闭都视为已结束
+        self._started = True
+        await self._batches.aclose()
+        await self._response.aclose()
+        self._release()
+
+
+async def _iter_event_batches(response, release):
+    """把上游字节流解码为SSE事件，每次上游读取产出一批
+    
+    Args:
+        response: 以stream=True发送得到的API响应对象
+        release: 流结束时调用，归还并发名额和上游在途计数
+        
+    Yields:
+        SSEEvent列表
+    """
+    chunk_count = 0  # 用于跟踪接收到的数据块数量
+    decoder = SSEDecoder()
+    capture = current_capture.get()
+    try:
+        async for chunk in response.aiter_bytes():
+            chunk_count += 1
+            if capture is not None:
+                capture.on_chunk(len(chunk))
+            if should_sample(logger):
+                log_event(logger, logging.DEBUG, "upstream_chunk", seq=chunk_count, size=len(chunk), chunk=chunk[:200])
             
-            # 检查响应内容是否为空
-            if not response.content:
-                raise HTTPException(status_code=502, detail="Empty response from API")
-                
-            # 处理流式响应
-            if is_stream:
-                return handle_stream_response(response)
-            
-            # 处理非流式响应
-            return await handle_non_stream_response(response)
-            
+            events = decoder.feed(chunk)
+            if events:
+                yield events
+        
+        # 处理上游未以空行结尾的最后一个事件
+        tail = decoder.flush()
+        if tail:
+            log_event(logger, logging.WARNING, "stream_unterminated_tail", events=len(tail))
+            yield tail
+    finally:
+        # 无论正常结束还是下游提前关闭，都把上游连接归还连接池
+        await response.aclose()
+        release()
+
+
+async def open_event_stream(payload, hedge=False, shared=True):
+    """打开上游事件流，启用single-flight时与相同的在途请求共享同一个上游流
+    
+    上游请求经过resilience的熔断检查和重试；hedge为True时等待第一批事件，
+    超过阈值未到达则发出对冲请求。
+    
+    Args:
+        payload: 请求负载
+        hedge: 是否使用对冲请求（仅用于非流式请求）
+        shared: 是否允许single-flight合并，n>1的各分支必须各自请求上游
+        
+    Returns:
+        逐批产出SSEEvent列表的异步迭代器，支持aclose()
+    """
+    model = payload['model']
+    
+    def opener():
+        return open_upstream(payload)
+    
+    if hedge:
+        # 对冲请求各自独立，不参与single-flight合并
+        return await resilience.open_hedged(opener, model)
+    if shared and SingleFlightConfig.ENABLED:
+        return await single_flight.subscribe(make_cache_key(payload), lambda: resilience.open(opener, model))
+    return await resilience.open(opener, model)
+
+
+async def _open_batches(payload, is_stream, shared=True):
+    """打开上游事件流，把上游异常统一转换为HTTPException"""
+    try:
+        return await open_event_stream(payload, hedge=not is_stream and ResilienceConfig.HEDGE_ENABLED,
+                                       shared=shared)
+    except HTTPException:
+        raise
+    except httpx.TimeoutException as e:
+        raise HTTPException(status_code=504, detail=f"Upstream timeout: {type(e).__name__}")
+    except httpx.TransportError as e:
+        raise HTTPException(status_code=502, detail=f"Upstream connection error: {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-def handle_stream_response(response):
-    """处理流式响应
+async def call_api(payload, is_stream=False, on_complete=None, tracker=None, usage=None,
+                   send_usage=True, on_finish=None, request=None, shared=True):
+    """调用目标API并处理响应
+    
+    上游请求始终以流式方式发送（httpx.AsyncClient.stream语义），
+    流式请求的连接生命周期交给StreamingResponse的生成器管理，
+    收到第一行SSE数据即可转发给客户端，无需等待上游生成完毕。
+    连接来自应用级共享连接池，请求结束后归还而不是关闭。
     
     Args:
-        response: API响应对象
+        payload: 请求负载
+        is_stream: 是否为流式请求
+        on_complete: 流式响应正常结束后以完整内容await的协程回调（用于写缓存）
+        tracker: 本次请求的metrics.RequestMetrics，流式响应结束时由生成器调用finish
+        usage: 流式请求需要统计用量时传入usage.Usage，补全token随数据块累计
+        send_usage: 流式请求是否在[DONE]之前发送用量数据块
+        on_finish: 流式响应结束后（无论是否成功）await的无参协程回调（用于计入配额）
+        request: 客户端请求，流式响应据此检测客户端断开
+        shared: 是否允许与相同的在途请求合并（single-flight）
         
     Returns:
-        StreamingResponse对象
+        流式响应或完整内容
     """
-    async def generate():
-        buffer = ""
-        chunk_count = 0  # 用于跟踪接收到的数据块数量
-        
-        print("\n===== 开始接收API响应数据 =====\n")
-        
-        # 使用aiter_text处理文本流，确保实时处理
-        async for chunk in response.aiter_text():
-            chunk_count += 1
-            print(f"\n[接收数据块 #{chunk_count}] 原始数据: {chunk!r}\n")
-            
-            # 立即处理接收到的数据块
-            buffer += chunk
-            
-            # 处理缓冲区中的每一行
-            while "\n" in buffer:
-                line, buffer = buffer.split("\n", 1)
-                
-                # 处理完整的SSE行
-                if line.startswith("data: "):
-                    print(f"\n[SSE行] {line}")
-                    
-                    if line == "data: [DONE]":
-                        print("\n===== 接收到完成标记 [DONE] =====\n")
-                        # 确保立即发送完成标记
-                        yield "data: [DONE]\n\n"
-                        # 强制刷新缓冲区
-                        await asyncio.sleep(0)
-                        continue
-                    
-                    try:
-                        # 直接转发SSE行，不尝试解析JSON
-                        # 确保行以data:开头并以\n\n结尾
-                        formatted_response = f"{line}\n\n"
-                        print(f"[直接转发SSE行] {formatted_response!r}")
-                        # 立即发送数据，不等待整个响应完成
-                        yield formatted_response
-                        # 强制刷新缓冲区，确保数据立即发送
-                        await asyncio.sleep(0)
-                        # 添加额外的刷新，确保数据立即发送到客户端
-                        await asyncio.sleep(0.01)
-                    except Exception as e:
-                        print(f"\n[处理行时出错] 错误类型: {type(e).__name__}, 错误信息: {e}\n[问题数据] {line!r}")
-                        continue
-        
-        print("\n===== API响应数据接收完毕 =====\n")
-        if buffer:
-            print(f"[剩余未处理的缓冲区数据] {buffer!r}")
+    batches = await _open_batches(payload, is_stream, shared)
+    
+    # 处理流式响应，上游连接交由生成器负责归还
+    if is_stream:
+        return handle_stream_response(batches, model=payload.get("model"), on_complete=on_complete,
+                                      tracker=tracker, usage=usage, send_usage=send_usage, on_finish=on_finish,
+                                      request=request)
+    
+    # 处理非流式响应
+    try:
+        return await handle_non_stream_response(batches, tracker=tracker)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def sse_response(frames, request=None):
+    """把SSE帧生成器包装为StreamingResponse
+    
+    帧经过relay的有界缓冲转发，客户端断开或读取过慢时立即关闭frames以释放上游连接。
     
+    Args:
+        frames: 产生SSE文本的异步生成器
+        request: 客户端请求，用于检测断开
+        
+    Returns:
+        StreamingResponse对象
+    """
     # 使用headers参数明确设置Content-Type，确保不包含charset=utf-8
     return StreamingResponse(
-        generate(),
+        relay_stream(frames, request),
         media_type="text/event-stream",
         headers={
             "Content-Type": "text/event-stream",
@@ -168,66 +443,328 @@ def handle_stream_response(response):
     )
 
 
-async def handle_non_stream_response(response):
-    """处理非流式响应
+def handle_stream_response(batches, model=None, on_complete=None, tracker=None, usage=None,
+                           send_usage=True, on_finish=None, request=None):
+    """处理流式响应
+    
+    上游事件被重新编码为标准的 chat.completion.chunk 帧：
+    先发送一个声明角色的数据块，随后逐个转发增量内容，
+    最后发送带 finish_reason 的数据块、可选的用量数据块和 [DONE] 标记。
+    同一次上游读取解析出的多个事件合并成一次写出。
     
     Args:
-        response: API响应对象
+        batches: open_event_stream返回的事件批次迭代器
+        model: 响应中填写的模型名称
+        on_complete: 上游正常结束后以完整内容await的协程回调，为None时不累积内容
+        tracker: 本次请求的metrics.RequestMetrics，流结束时记录
+        usage: 不为None时（usage.Usage）逐块累计补全token
+        send_usage: usage不为None时是否在[DONE]之前发送用量数据块
+        on_finish: 流结束后（无论是否成功）await的无参协程回调
+        request: 客户端请求，用于检测断开
         
     Returns:
-        提取的完整内容
+        StreamingResponse对象
     """
-    full_content = ""
-    buffer = ""
-    print("\n===== 开始接收非流式API响应数据 =====\n")
+    framer = StreamChunkFramer(model=model or DEFAULT_MODEL)
+    # 只有需要回调时才累积完整内容
+    parts = [] if on_complete is not None else None
+    
+    async def generate():
+        start = time.perf_counter()
+        event_count = 0
+        state = {"done": False, "finish_reason": None}
+        relay_span = start_span("stream.relay")
+        first_token_span = start_span("upstream.first_token")
+        try:
+            yield framer.role()
+            
+            async for events in batches:
+                event_count += len(events)
+                frames = _reframe(events, framer, state, usage, parts)
+                if tracker is not None:
+                    tracker.on_batch(len(events), len(frames))
+                if frames:
+                    if first_token_span is not None:
+                        first_token_span.end()
+                    yield frames[0] if len(frames) == 1 else "".join(frames)
+                if state["done"]:
+                    break
+            
+            if usage is None or not send_usage:
+                yield framer.finish(state["finish_reason"] or "stop") + STREAM_DONE
+            else:
+                yield framer.finish(state["finish_reason"] or "stop") + framer.usage(usage.as_dict()) + STREAM_DONE
+            
+            if parts:
+                await on_complete("".join(parts))
+        except Exception as e:
+            if tracker is not None:
+                tracker.finish(error_class(e))
+            raise
+        finally:
+            await batches.aclose()
+            if tracker is not None:
+                tracker.finish()
+            if on_finish is not None:
+                await on_finish()
+            if relay_span is not None:
+                relay_span.end(events=event_count)
+            log_event(logger, logging.DEBUG, "stream_finished", events=event_count, duration_ms=elapsed_ms(start))
+    
+    return sse_response(generate(), request)
+
+
+def _reframe(events, framer, state, usage=None, parts=None):
+    """把一批上游事件转换为输出帧
     
-    # 立即处理每个数据块，不等待整个响应完成
-    async for chunk in response.aiter_text():
-        print(f"\n[接收非流式数据块] 原始数据: {chunk!r}\n")
+    Args:
+        events: 一批SSEEvent
+        framer: 该选项的StreamChunkFramer
+        state: 该选项的状态，收到[DONE]时设置done，记录上游的finish_reason
+        usage: 不为None时累计补全token
+        parts: 不为None时累积正文
         
-        # 立即处理接收到的数据块
-        buffer += chunk
+    Returns:
+        SSE帧列表
+    """
+    frames = []
+    for event in events:
+        if event.data == "[DONE]":
+            state["done"] = True
+            break
+        delta = _parse_delta(event.data)
+        if delta is None:
+            continue
+        content, reasoning_content, finish_reason = delta
+        if content or reasoning_content:
+            frames.append(framer.delta(content, reasoning_content))
+            if parts is not None and content:
+                parts.append(content)
+            if usage is not None:
+                usage.add(content)
+                usage.add(reasoning_content)
+        if finish_reason:
+            state["finish_reason"] = finish_reason
+    return frames
+
+
+def _parse_delta(data):
+    """解析一条上游SSE事件数据
+    
+    Args:
+        data: 事件数据（JSON字符串）
         
-        # 处理缓冲区中的每一行
-        while "\n" in buffer:
-            line, buffer = buffer.split("\n", 1)
-            
-            # 处理完整的SSE行
-            if line.startswith("data: "):
-                print(f"\n[非流式SSE行] {line}")
-                
-                if line == "data: [DONE]":
-                    print("\n===== 接收到非流式完成标记 [DONE] =====\n")
-                    # 强制刷新缓冲区
-                    await asyncio.sleep(0)
-                    continue
-                
-                try:
-                    # 提取SSE行中的JSON数据
-                    json_str = line[6:]  # 去掉 "data: " 前缀
-                    data = json.loads(json_str)
-                    if "choices" in data and len(data["choices"]) > 0:
-                        delta = data["choices"][0].get("delta", {})
-                        content = delta.get("content", "")
-                        full_content += content
-                        # 强制刷新缓冲区
-                        await asyncio.sleep(0)
-                except Exception as e:
-                    print(f"\n[处理非流式行时出错] 错误类型: {type(e).__name__}, 错误信息: {e}\n[问题数据] {line!r}")
+    Returns:
+        (content, reasoning_content, finish_reason)，无法解析时返回None
+    """
+    try:
+        return fast_json.extract_delta(data)
+    except Exception as e:
+        log_event(logger, logging.WARNING, "sse_event_error", error=type(e).__name__, message=str(e), data=data[:200])
+        return None
+
+
+async def handle_non_stream_response(batches, tracker=None):
+    """处理非流式响应
+    
+    Args:
+        batches: open_event_stream返回的事件批次迭代器
+        tracker: 本次请求的metrics.RequestMetrics，只记录首字节和吞吐，由调用方finish
+        
+    Returns:
+        提取的完整内容
+    """
+    parts = []
+    read_span = start_span("upstream.read")
+    first_token_span = start_span("upstream.first_token")
+    try:
+        async for events in batches:
+            count = len(parts)
+            for event in events:
+                if event.data == "[DONE]":
                     continue
+                delta = _parse_delta(event.data)
+                if delta is not None and delta[0]:
+                    parts.append(delta[0])
+            if tracker is not None:
+                tracker.on_batch(len(events), len(parts) - count)
+            if parts and first_token_span is not None:
+                first_token_span.end()
+    finally:
+        await batches.aclose()
+        if read_span is not None:
+            read_span.end()
     
-    print("\n===== 非流式API响应数据接收完毕 =====\n")
-    if buffer:
-        print(f"[剩余未处理的缓冲区数据] {buffer!r}")        
-    # 如果没有成功提取内容，尝试直接解析响应
+    full_content = "".join(parts)
     if not full_content:
+        raise HTTPException(status_code=502, detail="Empty response from API")
+    return full_content
+
+
+def parse_choice_count(body):
+    """读取请求中的n（生成的选项数）
+    
+    Raises:
+        HTTPException: n不是 1..CHOICES_MAX_N 之间的整数时返回400
+    """
+    n = body.get("n")
+    if n is None:
+        return 1
+    if isinstance(n, bool) or not isinstance(n, int) or not 1 <= n <= ChoicesConfig.MAX_N:
+        raise HTTPException(status_code=400, detail=f"n must be an integer between 1 and {ChoicesConfig.MAX_N}")
+    return n
+
+
+async def call_api_choices(payload, n, is_stream=False, tracker=None, usage=None, send_usage=True,
+                           on_finish=None, request=None):
+    """并发请求上游n次，生成n个选项（OpenAI的n参数）
+    
+    各分支各自请求上游（不参与single-flight合并），每个请求同时在途的分支不超过 CHOICES_CONCURRENCY 个。
+    非流式时返回n个完整内容；流式时各选项的数据块按到达顺序交错转发，以index区分。
+    任一分支失败时取消其余分支，每个分支都会关闭自己的上游流，连接归还连接池。
+    
+    Args:
+        payload: 请求负载
+        n: 选项数
+        其余参数与call_api相同
+        
+    Returns:
+        流式响应，或按选项顺序排列的完整内容列表
+    """
+    slots = asyncio.Semaphore(max(ChoicesConfig.CONCURRENCY, 1))
+    
+    if not is_stream:
+        async def complete():
+            async with slots:
+                return await call_api(payload, is_stream=False, tracker=tracker, shared=False)
+        
+        tasks = [asyncio.ensure_future(complete()) for _ in range(n)]
+        try:
+            return list(await asyncio.gather(*tasks))
+        finally:
+            # 失败或客户端断开时取消其余分支，并等待它们归还上游连接
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    
+    async def open_branch():
+        await slots.acquire()
         try:
-            data = response.json()
-            full_content = data.get("content", "")
-        except json.JSONDecodeError:
-            raise HTTPException(
-                status_code=502,
-                detail=f"Invalid JSON response from API: {response.text[:200]}"
-            )
+            return await _open_batches(payload, is_stream=True, shared=False)
+        except BaseException:
+            slots.release()
+            raise
+    
+    # 先打开能同时在途的那些分支，响应头之前的错误照常以状态码返回；其余分支在有空位时再打开
+    opening = [asyncio.ensure_future(open_branch()) for _ in range(min(n, max(ChoicesConfig.CONCURRENCY, 1)))]
+    try:
+        opened = list(await asyncio.gather(*opening))
+    except BaseException:
+        for task in opening:
+            task.cancel()
+        for outcome in await asyncio.gather(*opening, return_exceptions=True):
+            if not isinstance(outcome, BaseException):
+                await outcome.aclose()
+        raise
+    
+    return handle_choices_stream_response(opened, open_branch, slots, n, model=payload.get("model"),
+                                          tracker=tracker, usage=usage, send_usage=send_usage,
+                                          on_finish=on_finish, request=request)
+
+
+def handle_choices_stream_response(opened, open_branch, slots, n, model=None, tracker=None, usage=None,
+                                   send_usage=True, on_finish=None, request=None):
+    """把n个上游流交错转发为一个流式响应
+    
+    每个选项一个分支任务，把重新编码的帧放进有界队列，客户端读取慢时各分支随之暂停读取上游。
+    所有选项先各发一个声明角色的数据块，每个选项结束时发送自己的 finish_reason，
+    全部结束后发送可选的用量数据块（所有选项合计）和 [DONE]。
+    
+    Args:
+        opened: 已打开的前几个分支的事件批次迭代器
+        open_branch: 打开其余分支的协程函数，会占用slots中的一个空位
+        slots: 限制同时在途分支数的信号量，已打开的分支各占一个空位
+        n: 选项数
+        其余参数与handle_stream_response相同
+        
+    Returns:
+        StreamingResponse对象
+    """
+    first = StreamChunkFramer(model=model or DEFAULT_MODEL)
+    framers = [first] + [
+        StreamChunkFramer(model=first.model, response_id=first.response_id, created=first.created, index=index)
+        for index in range(1, n)
+    ]
+    # 尚未交给分支任务的上游流，分支开始前被取消时由generate负责关闭
+    pending = dict(enumerate(opened))
+    queue: asyncio.Queue = asyncio.Queue(maxsize=n * 2)
+    
+    async def branch(index):
+        framer = framers[index]
+        state = {"done": False, "finish_reason": None}
+        batches = pending.pop(index, None)
+        try:
+            if batches is None:
+                batches = await open_branch()
+            try:
+                async for events in batches:
+                    frames = _reframe(events, framer, state, usage)
+                    if tracker is not None:
+                        tracker.on_batch(len(events), len(frames))
+                    if frames:
+                        await queue.put(frames[0] if len(frames) == 1 else "".join(frames))
+                    if state["done"]:
+                        break
+            finally:
+                await batches.aclose()
+                slots.release()
+            await queue.put(framer.finish(state["finish_reason"] or "stop"))
+        except Exception as e:
+            await queue.put(e)
+            return
+        # None表示该选项已结束
+        await queue.put(None)
+    
+    async def generate():
+        start = time.perf_counter()
+        relay_span = start_span("stream.relay", choices=n)
+        first_token_span = start_span("upstream.first_token")
+        tasks = [asyncio.create_task(branch(index)) for index in range(n)]
+        try:
+            yield "".join(framer.role() for framer in framers)
             
-    return full_content
+            running = n
+            while running:
+                item = await queue.get()
+                if item is None:
+                    running -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    if first_token_span is not None:
+                        first_token_span.end()
+                    yield item
+            
+            if usage is None or not send_usage:
+                yield STREAM_DONE
+            else:
+                yield first.usage(usage.as_dict()) + STREAM_DONE
+        except Exception as e:
+            if tracker is not None:
+                tracker.finish(error_class(e))
+            raise
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for batches in pending.values():
+                await batches.aclose()
+            if tracker is not None:
+                tracker.finish()
+            if on_finish is not None:
+                await on_finish()
+            if relay_span is not None:
+                relay_span.end()
+            log_event(logger, logging.DEBUG, "stream_finished", choices=n, duration_ms=elapsed_ms(start))
+    
+    return sse_response(generate(), request)
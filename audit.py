@@ -0,0 +1,88 @@
+# audit.py
+# 审计/用量日志：每个请求一条持久化记录（密钥、映射后模型、状态码、首字耗时、总耗时、收发字节数），
+# 请求路径上只放进有界缓冲区，由后台线程批量写入按大小轮转的JSONL文件
+#
+# 每条记录：
+#   {"ts": 请求到达的Unix时间, "request_id", "method", "path", "status", "key": 密钥名称,
+#    "model": 映射后模型, "stream", "ttft_ms": 首字耗时, "duration_ms": 到最后一个字节的耗时,
+#    "bytes_in": 请求体字节数, "bytes_out": 响应体字节数}
+
+import os
+import time
+
+from config import AuditConfig
+from log_utils import request_id_var, elapsed_ms
+from record_writer import RecordWriter
+
+# 全局审计写入器，未启用时为None
+audit_writer = RecordWriter(
+    "audit",
+    AuditConfig.PATH.replace("{pid}", str(os.getpid())),
+    max_records=AuditConfig.BUFFER_SIZE,
+    batch_size=AuditConfig.BATCH_SIZE,
+    flush_interval=AuditConfig.FLUSH_INTERVAL,
+    max_bytes=AuditConfig.MAX_BYTES,
+    backups=AuditConfig.BACKUPS,
+) if AuditConfig.ENABLED else None
+
+
+class AuditMiddleware:
+    """ASGI中间件：统计收发字节数和状态码，响应结束后提交一条审计记录
+
+    密钥、模型和首字时间由路由放在request.state中（api_key、metrics），
+    以响应的最后一个数据块为结束时间，流式响应的转发阶段也包含在内。
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.exclude = AuditConfig.get_exclude_paths()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or audit_writer is None or scope["path"] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+
+        state = scope.setdefault("state", {})
+        started = time.perf_counter()
+        record = {
+            "ts": round(time.time(), 3),
+            "request_id": request_id_var.get(),
+            "method": scope["method"],
+            "path": scope["path"],
+            "status": None,
+            "bytes_in": 0,
+            "bytes_out": 0,
+        }
+
+        async def receive_counted():
+            message = await receive()
+            if message["type"] == "http.request":
+                record["bytes_in"] += len(message.get("body", b""))
+            return message
+
+        async def send_counted(message):
+            if message["type"] == "http.response.start":
+                record["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                record["bytes_out"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_counted, send_counted)
+        finally:
+            self._submit(record, state, started)
+
+    @staticmethod
+    def _submit(record: dict, state: dict, started: float):
+        api_key = state.get("api_key")
+        metrics = state.get("metrics")
+        first_token = metrics.first_token if metrics is not None else None
+        record["key"] = api_key.name if api_key is not None else None
+        record["model"] = metrics.model if metrics is not None else None
+        record["stream"] = metrics.stream == "true" if metrics is not None else None
+        record["ttft_ms"] = round((first_token - started) * 1000, 2) if first_token is not None else None
+        record["duration_ms"] = elapsed_ms(started)
+        if record["status"] is None:
+            # 应用抛出异常且未发送响应头，由外层返回500
+            record["status"] = 500
+        audit_writer.submit(record)
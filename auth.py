@@ -1,49 +1,202 @@
 # auth.py
-# 身份验证中间件，处理API请求的认证
+# 身份验证模块：多密钥存储（只保存SHA-256摘要）、密钥文件热加载，以FastAPI依赖的形式校验请求
+#
+# 生成密钥摘要: python auth.py hash sk-xxxx
+
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, Optional
 
 from fastapi import Request, HTTPException
-from functools import wraps
+
 from config import AuthConfig
+from log_utils import get_logger, log_event
+from tracing import span
+
+logger = get_logger("auth")
+
+_BEARER = "Bearer "
+
+
+def hash_key(token: str) -> str:
+    """计算API密钥的SHA-256十六进制摘要"""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class ApiKey:
+    """一个已配置的API密钥
+
+    Attributes:
+        name: 密钥名称，用于日志、调度公平性和配额
+        digest: 密钥的SHA-256摘要
+        requests: 滑动窗口内的请求数上限，0表示不限制
+        tokens: 滑动窗口内的token数上限，0表示不限制
+        admin: 是否可以访问管理接口
+    """
+
+    __slots__ = ("name", "digest", "requests", "tokens", "admin")
+
+    def __init__(self, name: str, digest: str, requests: int = 0, tokens: int = 0, admin: bool = False):
+        self.name = name
+        self.digest = digest
+        self.requests = requests
+        self.tokens = tokens
+        self.admin = admin
+
+
+_ADMIN_NAMES = frozenset(name.strip() for name in AuthConfig.ADMIN_KEYS.split(",") if name.strip())
+
+
+def _parse_entry(entry: dict, index: int) -> ApiKey:
+    """解析密钥文件中的一项，明文密钥在加载时即转换为摘要"""
+    if "sha256" in entry:
+        digest = str(entry["sha256"]).lower()
+    elif "key" in entry:
+        digest = hash_key(str(entry["key"]))
+    else:
+        raise ValueError(f"key #{index} has neither 'sha256' nor 'key'")
+    name = str(entry.get("name") or f"key{index}")
+    return ApiKey(
+        name=name,
+        digest=digest,
+        requests=int(entry.get("requests", AuthConfig.QUOTA_REQUESTS)),
+        tokens=int(entry.get("tokens", AuthConfig.QUOTA_TOKENS)),
+        admin=bool(entry.get("admin", False)) or name in _ADMIN_NAMES,
+    )
+
+
+def _parse_env_keys(spec: str) -> list:
+    """解析AUTH_KEYS：name=sk-xxx 或 name=sha256:<摘要>，逗号分隔"""
+    entries = []
+    for index, item in enumerate(filter(None, (part.strip() for part in spec.split(",")))):
+        name, sep, value = item.partition("=")
+        if not sep:
+            name, value = f"key{index}", item
+        if value.startswith("sha256:"):
+            entries.append({"name": name.strip(), "sha256": value[7:].strip()})
+        else:
+            entries.append({"name": name.strip(), "key": value.strip()})
+    return entries
+
+
+class KeyStore:
+    """按密钥摘要索引的密钥表
 
-def verify_token(request: Request) -> bool:
-    """验证请求中的Bearer Token
-    
-    Args:
-        request: FastAPI请求对象
-        
-    Returns:
-        bool: 令牌是否有效
+    请求中的令牌先做SHA-256再按摘要查表，查找是O(1)的，进程内不保存明文密钥，
+    查表时比较的是摘要而不是明文密钥，比较耗时不会泄露密钥内容。
+    密钥文件按修改时间热加载，文件内容有误时保留原有密钥并记录警告。
     """
-    auth_header = request.headers.get('Authorization')
-    return AuthConfig.validate_token(auth_header)
 
-def require_auth(func):
-    """要求认证的装饰器
-    
+    def __init__(self, path: str, env_keys: str, reload_interval: float):
+        self.path = path
+        self.env_keys = env_keys
+        self.reload_interval = reload_interval
+        self._keys: Dict[str, ApiKey] = {}
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self.reloads = 0
+        self._load()
+
+    def _read_entries(self) -> list:
+        entries = _parse_env_keys(self.env_keys)
+        if self.path:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            entries.extend(data.get("keys", []) if isinstance(data, dict) else data)
+        if not self.path and not entries:
+            # API_TOKEN对应的密钥名为default，只有列在 AUTH_ADMIN_KEYS 中时才有管理权限
+            entries.append({"name": "default", "key": AuthConfig.API_TOKEN})
+        return entries
+
+    def _load(self):
+        if self.path:
+            self._mtime = os.stat(self.path).st_mtime
+        keys = {}
+        for index, entry in enumerate(self._read_entries()):
+            key = _parse_entry(entry, index)
+            keys[key.digest] = key
+        self._keys = keys
+        self.reloads += 1
+        log_event(logger, logging.INFO, "auth_keys_loaded", keys=len(keys), source=self.path or "env")
+
+    def maybe_reload(self):
+        """距上次检查超过reload_interval时检查密钥文件的修改时间"""
+        if not self.path:
+            return
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        try:
+            if os.stat(self.path).st_mtime != self._mtime:
+                self._load()
+        except (OSError, ValueError, TypeError) as e:
+            log_event(logger, logging.WARNING, "auth_keys_reload_failed", path=self.path, error=str(e))
+
+    def lookup(self, authorization: Optional[str]) -> Optional[ApiKey]:
+        """根据Authorization请求头查找密钥
+
+        Args:
+            authorization: Authorization请求头，可带Bearer前缀
+
+        Returns:
+            匹配的ApiKey，无效或缺失时返回None
+        """
+        if not authorization:
+            return None
+        self.maybe_reload()
+        token = authorization[len(_BEARER):] if authorization.startswith(_BEARER) else authorization
+        digest = hash_key(token)
+        return self._keys.get(digest)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+# 全局密钥表
+key_store = KeyStore(AuthConfig.KEYS_FILE, AuthConfig.KEYS, AuthConfig.RELOAD_INTERVAL)
+
+
+async def authenticate(request: Request) -> ApiKey:
+    """FastAPI依赖：校验Bearer令牌并返回对应的密钥，同时保存在request.state.api_key
+
     用法:
-        @require_auth
-        async def protected_route():
-            ...
+        @router.get("/path", dependencies=[Depends(authenticate)])
+        async def handler(api_key: ApiKey = Depends(authenticate)): ...
+
+    Raises:
+        HTTPException: 令牌无效或缺失时返回401
     """
-    @wraps(func)
-    async def wrapper(*args, **kwargs):
-        request = kwargs.get('request')
-        if not request:
-            for arg in args:
-                if isinstance(arg, Request):
-                    request = arg
-                    break
-        
-        if not request:
-            raise HTTPException(status_code=500, detail="Internal server error")
-            
-        if not verify_token(request):
-            raise HTTPException(
-                status_code=401,
-                detail="Invalid or missing authentication token",
-                headers={"WWW-Authenticate": "Bearer"}
-            )
-            
-        return await func(*args, **kwargs)
-    
-    return wrapper
\ No newline at end of file
+    with span("auth"):
+        key = key_store.lookup(request.headers.get("Authorization"))
+    if key is None:
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid or missing authentication token",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    request.state.api_key = key
+    return key
+
+
+async def require_admin(request: Request) -> ApiKey:
+    """FastAPI依赖：要求管理密钥
+
+    Raises:
+        HTTPException: 令牌无效时返回401，不是管理密钥时返回403
+    """
+    key = await authenticate(request)
+    if not key.admin:
+        raise HTTPException(status_code=403, detail="Admin key required")
+    return key
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "hash":
+        print(hash_key(sys.argv[2]))
+    else:
+        print("usage: python auth.py hash <api-key>")
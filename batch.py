@@ -0,0 +1,192 @@
+# batch.py
+# 批量请求模块：一次提交多条聊天请求（JSONL），以有限并发调用上游，按完成顺序以JSONL流式返回结果
+
+import asyncio
+import hashlib
+import logging
+import re
+import uuid
+from typing import List, Optional
+
+from fastapi import HTTPException
+
+from auth import ApiKey
+from completions import prepare_chat, complete_chat
+from config import BatchConfig
+from fast_json import dumps, loads, JSONDecodeError
+from log_utils import get_logger, log_event
+from state import state_backend
+
+logger = get_logger("batch")
+
+CHAT_URL = "/v1/chat/completions"
+
+_BATCH_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# 校验失败时最多返回的错误条数
+MAX_REPORTED_ERRORS = 20
+
+
+class BatchItem:
+    """批量请求中的一条"""
+
+    __slots__ = ("custom_id", "body")
+
+    def __init__(self, custom_id: str, body: dict):
+        self.custom_id = custom_id
+        self.body = body
+
+
+def _validate_line(line: bytes, number: int):
+    """解析并校验一行，返回(BatchItem或None, 错误信息或None)"""
+    try:
+        entry = loads(line)
+    except JSONDecodeError as e:
+        return None, f"invalid JSON: {e}"
+    if not isinstance(entry, dict):
+        return None, "each line must be a JSON object"
+    # 兼容OpenAI批量格式 {"custom_id", "method", "url", "body"}，也接受直接写请求体
+    body = entry["body"] if "body" in entry else entry
+    if entry.get("url", CHAT_URL) != CHAT_URL:
+        return None, f"unsupported url {entry.get('url')!r}, only {CHAT_URL} is allowed"
+    if not isinstance(body, dict):
+        return None, "body must be a JSON object"
+    messages = body.get("messages")
+    if not isinstance(messages, list) or not messages:
+        return None, "body.messages must be a non-empty list"
+    if not all(isinstance(m, dict) and m.get("role") for m in messages):
+        return None, "every message must be an object with a role"
+    custom_id = entry.get("custom_id", f"line-{number}")
+    if not isinstance(custom_id, str) or not custom_id:
+        return None, "custom_id must be a non-empty string"
+    return BatchItem(custom_id, body), None
+
+
+def parse_batch(data: bytes) -> List[BatchItem]:
+    """解析并校验整个批量请求，任何一行有误时整体拒绝，不发出任何上游请求
+
+    Raises:
+        HTTPException: 400，detail中列出出错的行号和原因
+    """
+    items = []
+    errors = []
+    seen = set()
+    for number, line in enumerate(data.splitlines(), 1):
+        if not line.strip():
+            continue
+        item, error = _validate_line(line, number)
+        if item is not None and item.custom_id in seen:
+            item, error = None, f"duplicate custom_id {item.custom_id!r}"
+        if error is not None:
+            errors.append({"line": number, "message": error})
+            if len(errors) >= MAX_REPORTED_ERRORS:
+                break
+            continue
+        seen.add(item.custom_id)
+        items.append(item)
+        if len(items) > BatchConfig.MAX_ITEMS:
+            raise HTTPException(status_code=400, detail=f"Batch exceeds {BatchConfig.MAX_ITEMS} items")
+    if errors:
+        raise HTTPException(status_code=400, detail={"message": "Invalid batch", "errors": errors})
+    if not items:
+        raise HTTPException(status_code=400, detail="Batch is empty")
+    return items
+
+
+def batch_id_for(data: bytes, requested: Optional[str]) -> str:
+    """批次ID：客户端指定时校验格式，否则取内容摘要，重新提交同一文件即可续传"""
+    if requested:
+        if not _BATCH_ID_RE.match(requested):
+            raise HTTPException(status_code=400, detail="batch_id must match [A-Za-z0-9_-]{1,64}")
+        return requested
+    return "batch_" + hashlib.sha256(data).hexdigest()[:24]
+
+
+async def complete(body: dict, api_key: ApiKey) -> dict:
+    """执行一条非流式聊天请求，与 /v1/chat/completions 共用同一流程（见completions）
+
+    Returns:
+        OpenAI格式的 chat.completion 响应
+    """
+    return await complete_chat(await prepare_chat(body, api_key))
+
+
+def _result_line(custom_id: str, status_code: int, body: dict, error: Optional[dict] = None) -> str:
+    """一条输出结果，格式与OpenAI批量接口的输出文件一致"""
+    return dumps({
+        "id": f"batch_req_{uuid.uuid4().hex[:24]}",
+        "custom_id": custom_id,
+        "response": {"status_code": status_code, "body": body},
+        "error": error,
+    }) + "\n"
+
+
+async def _run_item(item: BatchItem, api_key: ApiKey) -> tuple:
+    """执行一条并生成结果行，返回(结果行, 是否成功)"""
+    try:
+        response = await complete(item.body, api_key)
+        return _result_line(item.custom_id, 200, response), True
+    except HTTPException as e:
+        message = e.detail if isinstance(e.detail, str) else dumps(e.detail)
+        status_code = e.status_code
+    except Exception as e:
+        message = str(e) or type(e).__name__
+        status_code = 500
+    error = {"code": str(status_code), "message": message}
+    return _result_line(item.custom_id, status_code, {"error": error}, error), False
+
+
+async def run_batch(items: List[BatchItem], api_key: ApiKey, batch_id: str, concurrency: int):
+    """按完成顺序产出每条的结果行（JSONL）
+
+    先原样产出检查点中已完成的条目，其余条目由concurrency个工作协程依次领取执行；
+    成功的结果写入检查点，客户端中途断开后重新提交同一批次只会执行剩余条目。
+    生成器被关闭时（客户端断开）取消所有进行中的条目。
+    """
+    prefix = f"batch:{api_key.name}:{batch_id}:"
+    done = await state_backend.call("get_prefix", prefix)
+    resumed = 0
+    for item in items:
+        line = done.get(prefix + item.custom_id)
+        if line is not None:
+            resumed += 1
+            yield line
+
+    pending = iter([item for item in items if prefix + item.custom_id not in done])
+    results: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    counts = {"succeeded": 0, "failed": 0}
+    errors = []
+
+    async def worker():
+        try:
+            for item in pending:
+                line, ok = await _run_item(item, api_key)
+                if ok:
+                    counts["succeeded"] += 1
+                    await state_backend.call("set", prefix + item.custom_id, line, BatchConfig.CHECKPOINT_TTL)
+                else:
+                    counts["failed"] += 1
+                await results.put(line)
+        except Exception as e:
+            errors.append(e)
+        # None表示该工作协程已结束
+        await results.put(None)
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, min(concurrency, len(items) - resumed)))]
+    log_event(logger, logging.INFO, "batch_started", batch_id=batch_id, key=api_key.name, items=len(items),
+              resumed=resumed, concurrency=len(workers))
+    try:
+        running = len(workers)
+        while running:
+            line = await results.get()
+            if line is None:
+                running -= 1
+            else:
+                yield line
+        if errors:
+            raise errors[0]
+    finally:
+        for task in workers:
+            task.cancel()
+        log_event(logger, logging.INFO, "batch_finished", batch_id=batch_id, key=api_key.name,
+                  resumed=resumed, **counts)
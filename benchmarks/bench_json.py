@@ -0,0 +1,61 @@
+# bench_json.py
+# 增量事件解析微基准：对比完整解析与只解码所需字段的lazy模式
+#
+# 用法: python benchmarks/bench_json.py [--events 200000] [--repeat 3]
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fast_json  # noqa: E402
+from config import JsonConfig  # noqa: E402
+
+# 不同形态的上游事件：紧凑/带空格，最小/带较多无关字段
+SHAPES = {
+    "compact": ({"choices": [{"delta": {"content": "你好"}}]}, (",", ":")),
+    "spaced": ({"choices": [{"delta": {"content": "你好"}}]}, (", ", ": ")),
+    "openai": ({
+        "id": "chatcmpl-0123456789", "object": "chat.completion.chunk", "created": 1700000000,
+        "model": "deepseek70b", "system_fingerprint": "fp_0123",
+        "choices": [{"index": 0, "delta": {"content": "你好"}, "logprobs": None, "finish_reason": None}],
+    }, (",", ":")),
+    "logprobs": ({
+        "choices": [{"index": 0, "delta": {"content": "你好"}, "finish_reason": None, "logprobs": {
+            "content": [{"token": f"t{i}", "logprob": -0.1 * i, "top_logprobs": []} for i in range(20)]}}],
+    }, (",", ":")),
+}
+
+
+def bench(events, lazy: bool, repeat: int) -> float:
+    """返回多次运行中的最短耗时（秒）"""
+    JsonConfig.LAZY_DELTA = lazy
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for data in events:
+            fast_json.extract_delta(data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delta extraction micro-benchmark")
+    parser.add_argument("--events", type=int, default=200000, help="每种形态的事件数")
+    parser.add_argument("--repeat", type=int, default=3, help="每组重复次数，取最好成绩")
+    args = parser.parse_args()
+
+    print(f"json backend: {fast_json.BACKEND}")
+    print(f"{'shape':>10} {'full events/s':>16} {'lazy events/s':>16} {'speedup':>8}")
+    for name, (payload, separators) in SHAPES.items():
+        events = [json.dumps(payload, ensure_ascii=False, separators=separators)] * args.events
+        full = bench(events, False, args.repeat)
+        lazy = bench(events, True, args.repeat)
+        print(f"{name:>10} {args.events / full:>16,.0f} {args.events / lazy:>16,.0f} {full / lazy:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
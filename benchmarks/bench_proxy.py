@@ -0,0 +1,247 @@
+# bench_proxy.py
+# 端到端压测：启动本地模拟上游和代理，对比直连上游与经过代理的延迟、吞吐和资源占用
+#
+# 用法: python benchmarks/bench_proxy.py [--requests 500] [--concurrency 50] [--tokens 200]
+#       [--token-rate 100] [--chunk-tokens 1] [--first-byte-delay 0.2] [--error-rate 0.0]
+#
+# 代理以子进程方式运行（uvicorn main:app），通过 /proc 采样其RSS和CPU时间，仅支持Linux。
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = "sk-bench"
+MODEL = "deepseek-r1-70b"
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+class ProcessSampler:
+    """定期读取子进程的RSS和CPU时间"""
+
+    def __init__(self, pid: int, interval: float = 0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self._task = None
+
+    def rss(self) -> int:
+        with open(f"/proc/{self.pid}/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+
+    def cpu_seconds(self) -> float:
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime、stime分别是第14、15个字段，去掉前两个字段后下标为11、12
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+    async def _run(self):
+        while True:
+            self.peak_rss = max(self.peak_rss, self.rss())
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.peak_rss = self.rss()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+def first_content(line: str) -> bool:
+    """判断一行SSE是否携带非空的增量内容"""
+    if not line.startswith("data:") or "[DONE]" in line:
+        return False
+    try:
+        choices = json.loads(line[5:]).get("choices") or [{}]
+    except json.JSONDecodeError:
+        return False
+    return bool((choices[0].get("delta") or {}).get("content"))
+
+
+async def one_request(client: httpx.AsyncClient, url: str, body: dict, stream: bool, headers: dict) -> dict:
+    """发送一个请求，返回首字耗时、总耗时、内容事件数和状态码"""
+    start = time.perf_counter()
+    ttft = None
+    tokens = 0
+    async with client.stream("POST", url, json={**body, "stream": stream}, headers=headers) as response:
+        if response.status_code != 200:
+            await response.aread()
+            return {"status": response.status_code}
+        if stream:
+            async for line in response.aiter_lines():
+                if first_content(line):
+                    tokens += 1
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+        else:
+            await response.aread()
+            ttft = time.perf_counter() - start
+    total = time.perf_counter() - start
+    return {"status": 200, "ttft": ttft if ttft is not None else total, "total": total, "tokens": tokens}
+
+
+async def run_load(url: str, body: dict, stream: bool, requests: int, concurrency: int,
+                   headers: dict, sampler: ProcessSampler = None) -> dict:
+    """以固定并发发送requests个请求，返回汇总结果"""
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=300) as client:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def bounded():
+            async with semaphore:
+                try:
+                    return await one_request(client, url, body, stream, headers)
+                except httpx.HTTPError as e:
+                    return {"status": type(e).__name__}
+
+        cpu_before = sampler.cpu_seconds() if sampler else 0.0
+        if sampler:
+            sampler.start()
+        start = time.perf_counter()
+        results = await asyncio.gather(*(bounded() for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+        if sampler:
+            await sampler.stop()
+        cpu = sampler.cpu_seconds() - cpu_before if sampler else 0.0
+
+    ok = [r for r in results if r["status"] == 200]
+    errors = {}
+    for r in results:
+        if r["status"] != 200:
+            errors[str(r["status"])] = errors.get(str(r["status"]), 0) + 1
+    return {"ok": ok, "errors": errors, "elapsed": elapsed, "cpu": cpu}
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def wait_ready(url: str, timeout: float = 20):
+    """等待子进程的 /health 可用"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} not ready after {timeout}s")
+
+
+def start_processes(args):
+    """启动模拟上游和代理两个子进程"""
+    upstream = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, "benchmarks", "fake_upstream.py"),
+        "--port", str(args.upstream_port),
+        "--tokens", str(args.tokens),
+        "--token-rate", str(args.token_rate),
+        "--chunk-tokens", str(args.chunk_tokens),
+        "--first-byte-delay", str(args.first_byte_delay),
+        "--error-rate", str(args.error_rate),
+    ], cwd=ROOT)
+
+    env = dict(os.environ)
+    env.update({
+        "UPSTREAM_URL": f"http://127.0.0.1:{args.upstream_port}/api/chat",
+        "API_TOKEN": TOKEN,
+        "LOG_LEVEL": "WARNING",
+        # 压测代理本身的开销，调度上限放宽到压测并发以上
+        "SCHED_GLOBAL_CONCURRENCY": str(args.concurrency * 2),
+        "SCHED_MODEL_CONCURRENCY": str(args.concurrency * 2),
+        "SCHED_QUEUE_SIZE": str(args.requests),
+    })
+    proxy = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "main:app",
+        "--host", "127.0.0.1", "--port", str(args.proxy_port), "--log-level", "warning",
+    ], cwd=ROOT, env=env)
+    return upstream, proxy
+
+
+def report(name: str, direct: dict, proxied: dict, idle_rss: int, peak_rss: int, concurrency: int):
+    """输出一组对比结果"""
+    print(f"\n== {name} ==")
+    for label, result in (("direct", direct), ("proxy", proxied)):
+        ok = result["ok"]
+        ttft = [r["ttft"] for r in ok]
+        total = [r["total"] for r in ok]
+        print(f"{label:>7}: ok={len(ok)} errors={result['errors'] or 0} "
+              f"rps={len(ok) / result['elapsed']:.1f} "
+              f"ttft p50/p95/p99={percentile(ttft, .5) * 1000:.1f}/{percentile(ttft, .95) * 1000:.1f}/"
+              f"{percentile(ttft, .99) * 1000:.1f}ms "
+              f"total p50/p95={percentile(total, .5) * 1000:.1f}/{percentile(total, .95) * 1000:.1f}ms")
+
+    added_ttft = percentile([r["ttft"] for r in proxied["ok"]], .5) - percentile([r["ttft"] for r in direct["ok"]], .5)
+    added_total = percentile([r["total"] for r in proxied["ok"]], .5) - percentile([r["total"] for r in direct["ok"]], .5)
+    tokens = sum(r["tokens"] for r in proxied["ok"])
+    print(f"proxy-added latency p50: ttft {added_ttft * 1000:+.1f}ms, total {added_total * 1000:+.1f}ms")
+    if tokens:
+        print(f"throughput: {tokens / proxied['elapsed']:,.0f} tokens/s, "
+              f"proxy CPU {proxied['cpu'] / tokens * 1e6:.1f}us/token")
+    else:
+        print(f"proxy CPU {proxied['cpu'] / max(len(proxied['ok']), 1) * 1000:.2f}ms/request")
+    print(f"proxy memory: idle {idle_rss / 1e6:.1f}MB, peak {peak_rss / 1e6:.1f}MB, "
+          f"{(peak_rss - idle_rss) / concurrency / 1e3:.1f}KB per connection")
+
+
+async def run(args, proxy_pid: int):
+    upstream_url = f"http://127.0.0.1:{args.upstream_port}/api/chat"
+    proxy_url = f"http://127.0.0.1:{args.proxy_port}/v1/chat/completions"
+    headers = {"Authorization": f"Bearer {TOKEN}"}
+    sampler = ProcessSampler(proxy_pid)
+
+    # 预热连接池和代码路径
+    await run_load(proxy_url, {"model": MODEL, "messages": [{"role": "user", "content": "warmup"}]},
+                   True, min(args.concurrency, 10), min(args.concurrency, 10), headers)
+
+    for stream in (True, False):
+        # 每组使用新的消息，避免命中之前的缓存
+        body = {"model": MODEL, "messages": [{"role": "user", "content": f"bench {time.time()}"}]}
+        upstream_body = {"model": "deepseek70b", "messages": body["messages"]}
+        direct = await run_load(upstream_url, upstream_body, stream, args.requests, args.concurrency, {})
+        idle_rss = sampler.rss()
+        proxied = await run_load(proxy_url, body, stream, args.requests, args.concurrency, headers, sampler)
+        report("stream" if stream else "non-stream", direct, proxied, idle_rss, sampler.peak_rss, args.concurrency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end proxy benchmark against a fake rkui upstream")
+    parser.add_argument("--requests", type=int, default=500, help="每组请求总数")
+    parser.add_argument("--concurrency", type=int, default=50, help="并发客户端数")
+    parser.add_argument("--tokens", type=int, default=200, help="每个回答的token数")
+    parser.add_argument("--token-rate", type=float, default=100.0, help="上游每个流每秒的token数，0为不限速")
+    parser.add_argument("--chunk-tokens", type=int, default=1, help="上游每次写出合并的token数")
+    parser.add_argument("--first-byte-delay", type=float, default=0.2, help="上游第一个token前的等待（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="上游注入500错误的比例")
+    parser.add_argument("--upstream-port", type=int, default=9100)
+    parser.add_argument("--proxy-port", type=int, default=9101)
+    args = parser.parse_args()
+
+    upstream, proxy = start_processes(args)
+    try:
+        wait_ready(f"http://127.0.0.1:{args.upstream_port}/health")
+        wait_ready(f"http://127.0.0.1:{args.proxy_port}/health")
+        asyncio.run(run(args, proxy.pid))
+    finally:
+        for process in (proxy, upstream):
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# bench_sse_parser.py
+# SSE解析微基准：对比旧的字符串拼接+split方式与增量字节解码器
+#
+# 用法: python benchmarks/bench_sse_parser.py [--lines 200000] [--repeat 3] [--crlf]
+#
+# chunk列为event时每个数据块恰好是一个事件（上游逐token推送的常见情况），
+# 其余为固定大小切分，数据块边界落在行中间。
+
+import argparse
+import codecs
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sse_parser import SSEDecoder, SSEEvent  # noqa: E402
+
+
+def build_stream(lines: int, crlf: bool) -> bytes:
+    """生成模拟上游的SSE字节流"""
+    newline = "\r\n" if crlf else "\n"
+    parts = []
+    for i in range(lines):
+        data = json.dumps({"choices": [{"delta": {"content": f"词{i % 97} "}}]}, ensure_ascii=False)
+        parts.append(f"data: {data}{newline}{newline}")
+    parts.append(f"data: [DONE]{newline}{newline}")
+    return "".join(parts).encode("utf-8")
+
+
+def split_chunks(stream: bytes, chunk_size: int):
+    """按固定大小切分字节流，模拟网络读取"""
+    return [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+
+
+def split_events(stream: bytes, crlf: bool):
+    """每个事件一个数据块，模拟上游逐token推送、每次读取恰好拿到一个事件"""
+    separator = b"\r\n\r\n" if crlf else b"\n\n"
+    return [part + separator for part in stream.split(separator)[:-1]]
+
+
+def legacy_parse(chunks) -> int:
+    """旧实现：str拼接后反复split("\\n", 1)
+
+    为了与解码器做同样的工作：和旧代码的aiter_text一样用增量解码器处理跨数据块的多字节字符，
+    每个data行同样去掉\\r并组装成SSEEvent，按数据块返回事件列表。
+    """
+    count = 0
+    buffer = ""
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        events = []
+        while "\n" in buffer:
+            line, buffer = buffer.split("\n", 1)
+            if line.endswith("\r"):
+                line = line[:-1]
+            if line.startswith("data: "):
+                events.append(SSEEvent(line[6:]))
+        count += len(events)
+    return count
+
+
+def decoder_parse(chunks) -> int:
+    """新实现：SSEDecoder增量解码"""
+    count = 0
+    decoder = SSEDecoder()
+    for chunk in chunks:
+        count += len(decoder.feed(chunk))
+    count += len(decoder.flush())
+    return count
+
+
+def bench(func, chunks, repeat: int) -> float:
+    """返回多次运行中的最短耗时（秒）"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(chunks)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SSE parser micro-benchmark")
+    parser.add_argument("--lines", type=int, default=200000, help="合成流中的事件数")
+    parser.add_argument("--repeat", type=int, default=3, help="每组重复次数，取最好成绩")
+    parser.add_argument("--crlf", action="store_true", help="使用\\r\\n换行")
+    args = parser.parse_args()
+
+    stream = build_stream(args.lines, args.crlf)
+    print(f"stream: {args.lines} events, {len(stream) / 1e6:.1f} MB")
+    print(f"{'chunk':>8} {'legacy lines/s':>16} {'decoder lines/s':>16} {'speedup':>8}")
+
+    cases = [("event", split_events(stream, args.crlf))]
+    cases += [(chunk_size, split_chunks(stream, chunk_size)) for chunk_size in (64, 1024, 16384, 262144)]
+    for chunk_size, chunks in cases:
+        legacy = bench(legacy_parse, chunks, args.repeat)
+        decoder = bench(decoder_parse, chunks, args.repeat)
+        total = stream.count(b"\n")
+        print(f"{chunk_size:>8} {total / legacy:>16,.0f} {total / decoder:>16,.0f} {legacy / decoder:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# bench_startup.py
+# 冷启动基准：测量导入应用的耗时（对照 IMPORT_BUDGET_MS 预算）、进程启动到 /health 和 /ready 的时间，
+# 以及就绪后第一个请求与后续请求的延迟
+#
+# 用法: python benchmarks/bench_startup.py [--runs 5] [--budget-ms 400] [--requests 20] [--imports-only]
+#
+# 导入耗时超过预算时以状态码1退出，可放进CI。
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_proxy import TOKEN, MODEL, wait_ready, percentile  # noqa: E402
+from config import WarmupConfig  # noqa: E402
+
+# 本仓库的模块，用于区分自身代码和第三方库的导入耗时
+OWN_MODULES = frozenset(name[:-3] for name in os.listdir(ROOT) if name.endswith(".py"))
+
+
+def import_profile() -> dict:
+    """在新的解释器中导入main，解析 -X importtime 的输出
+
+    Returns:
+        total_ms为导入main的总耗时，own_ms为本仓库模块自身的耗时之和，modules为各模块的累计耗时
+    """
+    env = dict(os.environ, API_TOKEN=TOKEN, LOG_LEVEL="WARNING")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    own_us = 0
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        if name.split(".")[0] in OWN_MODULES:
+            own_us += int(self_us)
+            modules[name] = int(cumulative_us) / 1000
+    return {"total_ms": modules.get("main", 0.0), "own_ms": own_us / 1000, "modules": modules}
+
+
+def bench_imports(runs: int) -> float:
+    """多次测量导入耗时并输出中位数，返回总耗时的中位数（毫秒）"""
+    profiles = [import_profile() for _ in range(runs)]
+    total = statistics.median(p["total_ms"] for p in profiles)
+    own = statistics.median(p["own_ms"] for p in profiles)
+    print(f"import main: {total:.1f}ms (median of {runs}), own modules self time {own:.1f}ms")
+    slowest = sorted(profiles[-1]["modules"].items(), key=lambda item: item[1], reverse=True)
+    for name, ms in slowest[1:11]:
+        print(f"  {name:<24} {ms:7.2f}ms cumulative")
+    return total
+
+
+def bench_server(args):
+    """启动模拟上游和代理，测量到存活、就绪的时间以及第一个请求的延迟"""
+    upstream = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, "benchmarks", "fake_upstream.py"),
+        "--port", str(args.upstream_port), "--tokens", "20", "--token-rate", "0", "--first-byte-delay", "0",
+    ], cwd=ROOT)
+    proxy = None
+    try:
+        wait_ready(f"http://127.0.0.1:{args.upstream_port}/health")
+        env = dict(os.environ, API_TOKEN=TOKEN, LOG_LEVEL="WARNING",
+                   UPSTREAM_URL=f"http://127.0.0.1:{args.upstream_port}/api/chat")
+        started = time.perf_counter()
+        proxy = subprocess.Popen([
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--host", "127.0.0.1", "--port", str(args.proxy_port), "--log-level", "warning",
+        ], cwd=ROOT, env=env)
+        base = f"http://127.0.0.1:{args.proxy_port}"
+        wait_ready(f"{base}/health")
+        live = time.perf_counter() - started
+        wait_ready(f"{base}/ready")
+        ready = time.perf_counter() - started
+        print(f"process start -> /health {live * 1000:.0f}ms, -> /ready {ready * 1000:.0f}ms")
+
+        latencies = []
+        with httpx.Client(timeout=30) as client:
+            for index in range(args.requests + 1):
+                body = {"model": MODEL, "messages": [{"role": "user", "content": f"startup {time.time()} {index}"}]}
+                start = time.perf_counter()
+                response = client.post(f"{base}/v1/chat/completions", json=body,
+                                       headers={"Authorization": f"Bearer {TOKEN}"})
+                latencies.append(time.perf_counter() - start)
+                response.raise_for_status()
+        rest = latencies[1:]
+        print(f"first request {latencies[0] * 1000:.1f}ms, next {len(rest)} p50/p95 "
+              f"{percentile(rest, .5) * 1000:.1f}/{percentile(rest, .95) * 1000:.1f}ms")
+    finally:
+        for process in (proxy, upstream):
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start benchmark: import time budget, time to ready")
+    parser.add_argument("--runs", type=int, default=5, help="导入耗时的测量次数")
+    parser.add_argument("--budget-ms", type=float, default=WarmupConfig.IMPORT_BUDGET_MS, help="导入耗时预算")
+    parser.add_argument("--requests", type=int, default=20, help="就绪后第一个请求之外再发送的请求数")
+    parser.add_argument("--imports-only", action="store_true", help="只测量导入耗时")
+    parser.add_argument("--upstream-port", type=int, default=9100)
+    parser.add_argument("--proxy-port", type=int, default=9101)
+    args = parser.parse_args()
+
+    total = bench_imports(args.runs)
+    if not args.imports_only:
+        bench_server(args)
+    if total > args.budget_ms:
+        print(f"import time {total:.1f}ms exceeds budget {args.budget_ms:g}ms")
+        sys.exit(1)
+    print(f"import time within budget ({args.budget_ms:g}ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# fake_upstream.py
+# 本地模拟的 deepseek.rkui.cn/api/chat 上游，用于压测和延迟基准
+#
+# 用法: python benchmarks/fake_upstream.py [--port 9100] [--tokens 200] [--token-rate 100]
+#       [--chunk-tokens 1] [--first-byte-delay 0.2] [--error-rate 0.0]
+
+import argparse
+import asyncio
+import json
+import random
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+def create_app(tokens: int = 200, token_rate: float = 100.0, chunk_tokens: int = 1,
+               first_byte_delay: float = 0.2, error_rate: float = 0.0) -> FastAPI:
+    """创建模拟上游应用
+
+    Args:
+        tokens: 每个回答的token（增量事件）数
+        token_rate: 每个流每秒产出的token数，0表示不限速
+        chunk_tokens: 每次写出合并的token数，模拟上游的数据块大小
+        first_byte_delay: 响应头之后、第一个token之前的等待时间（秒）
+        error_rate: 直接返回500的请求比例（0~1）
+
+    Returns:
+        FastAPI应用
+    """
+    app = FastAPI()
+    # 预先编码好每个token的事件，避免模拟上游本身成为瓶颈
+    event = "data: " + json.dumps({"choices": [{"delta": {"content": "词 "}}]}, ensure_ascii=False) + "\n\n"
+    chunk = (event * chunk_tokens).encode("utf-8")
+    finish = ("data: " + json.dumps({"choices": [{"delta": {}, "finish_reason": "stop"}]}) + "\n\n"
+              "data: [DONE]\n\n").encode("utf-8")
+    interval = chunk_tokens / token_rate if token_rate > 0 else 0
+
+    async def generate():
+        await asyncio.sleep(first_byte_delay)
+        for _ in range(tokens // chunk_tokens):
+            yield chunk
+            if interval:
+                await asyncio.sleep(interval)
+        yield finish
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        await request.body()
+        if error_rate and random.random() < error_rate:
+            return JSONResponse(status_code=500, content={"error": "injected failure"})
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake rkui upstream")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--tokens", type=int, default=200, help="每个回答的token数")
+    parser.add_argument("--token-rate", type=float, default=100.0, help="每个流每秒的token数，0为不限速")
+    parser.add_argument("--chunk-tokens", type=int, default=1, help="每次写出合并的token数")
+    parser.add_argument("--first-byte-delay", type=float, default=0.2, help="第一个token前的等待（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入500错误的比例")
+    args = parser.parse_args()
+
+    import uvicorn
+    app = create_app(args.tokens, args.token_rate, args.chunk_tokens, args.first_byte_delay, args.error_rate)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
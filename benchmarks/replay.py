@@ -0,0 +1,272 @@
+# replay.py
+# 流量回放：把 CAPTURE_ENABLED 录制的请求按原始到达时间重新发给代理（uvicorn main:app），
+# 由本地替身上游按录制的响应头耗时、数据块间隔和大小产出SSE，对比各版本代理的延迟和吞吐
+#
+# 用法: python benchmarks/replay.py captures/*.jsonl.gz [--speed 1] [--limit 0]
+#       [--app-dir .] [--output result.json] [--baseline base.json]
+#
+# 对比两个版本：先在旧版本的检出目录上回放并保存结果，再在当前版本上回放并与之对比
+#   git worktree add /tmp/rkui2api-base HEAD~1
+#   python benchmarks/replay.py captures/*.gz --app-dir /tmp/rkui2api-base --output base.json
+#   python benchmarks/replay.py captures/*.gz --baseline base.json
+#
+# --speed 大于1时按比例压缩到达间隔和上游时序（加速回放）。请求中最后一条消息末尾会追加
+# [replay:序号] 标记，替身上游据此找到对应的录制；录制中的消息内容若已脱敏，回放的是等长的占位文本。
+
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_proxy import TOKEN, wait_ready, percentile, first_content  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MARKER_RE = re.compile(r"\[replay:(\d+)\]")
+
+# 替身上游产出的事件：内容用占位文本填充到录制的数据块大小
+EVENT_PREFIX = b'data: {"choices":[{"delta":{"content":"'
+EVENT_SUFFIX = b'"}}]}\n\n'
+FILLER = b"lorem ipsum dolor sit amet " * 4096
+DONE = b"data: [DONE]\n\n"
+
+
+def load_records(paths, limit: int = 0) -> list:
+    """读取录制文件（gzip或纯文本JSONL），只保留到达过上游的请求，按到达时间排序"""
+    records = []
+    for path in paths:
+        with open(path, "rb") as f:
+            gzipped = f.read(2) == b"\x1f\x8b"
+        opener = gzip.open if gzipped else open
+        with opener(path, "rb") as f:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+    records = sorted((r for r in records if r.get("upstream") is not None), key=lambda r: r["ts"])
+    return records[:limit] if limit else records
+
+
+def synth_chunk(size: int) -> bytes:
+    """构造一个约为size字节、内容为占位文本的SSE事件"""
+    room = min(max(size - len(EVENT_PREFIX) - len(EVENT_SUFFIX), 1), len(FILLER))
+    return EVENT_PREFIX + FILLER[:room] + EVENT_SUFFIX
+
+
+def create_upstream_app(records: list, speed: float):
+    """替身上游：按请求中的回放标记找到录制，重现其响应头耗时和数据块时序"""
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, StreamingResponse
+
+    app = FastAPI()
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        payload = json.loads(await request.body())
+        messages = payload.get("messages") or [{}]
+        match = MARKER_RE.search(json.dumps(messages[-1], ensure_ascii=False))
+        if match is None or int(match.group(1)) >= len(records):
+            return JSONResponse(status_code=400, content={"error": "missing replay marker"})
+        record = records[int(match.group(1))]
+        await asyncio.sleep((record.get("headers_ms") or 0) / 1000 / speed)
+        chunks = record.get("chunks") or []
+
+        async def generate():
+            start = time.perf_counter()
+            for offset_ms, size in chunks:
+                delay = offset_ms / 1000 / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                yield synth_chunk(size)
+            yield DONE
+
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    return app
+
+
+def replay_body(record: dict, index: int) -> dict:
+    """录制的请求体，在最后一条消息末尾加上回放标记"""
+    body = json.loads(json.dumps(record["body"]))
+    body["stream"] = bool(record.get("stream"))
+    marker = f" [replay:{index}]"
+    messages = body.get("messages") or [{"role": "user", "content": ""}]
+    last = messages[-1]
+    if isinstance(last.get("content"), list):
+        last["content"].append({"type": "text", "text": marker})
+    else:
+        last["content"] = (last.get("content") or "") + marker
+    body["messages"] = messages
+    return body
+
+
+def ideal_times(record: dict, speed: float):
+    """只由上游时序决定的首字耗时和总耗时（秒），代理引入的额外延迟以此为基准
+
+    非流式请求读完整个响应才算首字，两者相同。
+    """
+    chunks = record.get("chunks") or [[0, 0]]
+    headers = (record.get("headers_ms") or 0) / 1000
+    total = (headers + chunks[-1][0] / 1000) / speed
+    if not record.get("stream"):
+        return total, total
+    return (headers + chunks[0][0] / 1000) / speed, total
+
+
+async def replay_one(client: httpx.AsyncClient, url: str, record: dict, index: int, speed: float) -> dict:
+    body = replay_body(record, index)
+    start = time.perf_counter()
+    ttft = None
+    received = 0
+    async with client.stream("POST", url, json=body, headers={"Authorization": f"Bearer {TOKEN}"}) as response:
+        if body["stream"] and response.status_code == 200:
+            async for line in response.aiter_lines():
+                received += len(line) + 1
+                if ttft is None and first_content(line):
+                    ttft = time.perf_counter() - start
+        else:
+            received = len(await response.aread())
+    total = time.perf_counter() - start
+    ideal_ttft, ideal_total = ideal_times(record, speed)
+    ttft = ttft if ttft is not None else total
+    return {"status": response.status_code, "ttft": ttft, "total": total, "bytes": received,
+            "added_ttft": ttft - ideal_ttft, "added_total": total - ideal_total}
+
+
+async def run_replay(records: list, url: str, speed: float) -> dict:
+    """按录制的到达间隔（除以speed）发出所有请求"""
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=100)
+    async with httpx.AsyncClient(limits=limits, timeout=600) as client:
+        origin = records[0]["ts"]
+        start = time.perf_counter()
+
+        async def scheduled(index, record):
+            delay = (record["ts"] - origin) / speed - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                return await replay_one(client, url, record, index, speed)
+            except httpx.HTTPError as e:
+                return {"status": type(e).__name__}
+
+        results = await asyncio.gather(*(scheduled(i, r) for i, r in enumerate(records)))
+        elapsed = time.perf_counter() - start
+    return summarize(results, elapsed)
+
+
+def summarize(results: list, elapsed: float) -> dict:
+    ok = [r for r in results if r["status"] == 200]
+    errors = {}
+    for r in results:
+        if r["status"] != 200:
+            errors[str(r["status"])] = errors.get(str(r["status"]), 0) + 1
+    summary = {"requests": len(results), "ok": len(ok), "errors": errors, "elapsed_s": round(elapsed, 3),
+               "rps": round(len(ok) / elapsed, 2), "bytes_per_s": round(sum(r["bytes"] for r in ok) / elapsed, 1)}
+    for name in ("ttft", "total", "added_ttft", "added_total"):
+        values = [r[name] for r in ok]
+        for q in (.5, .95, .99):
+            summary[f"{name}_p{int(q * 100)}_ms"] = round(percentile(values, q) * 1000, 2)
+    return summary
+
+
+def report(summary: dict, baseline: dict = None):
+    print(f"requests={summary['requests']} ok={summary['ok']} errors={summary['errors'] or 0} "
+          f"elapsed={summary['elapsed_s']}s")
+    for name, value in summary.items():
+        if not isinstance(value, (int, float)) or name in ("requests", "ok"):
+            continue
+        line = f"  {name:<20} {value:>12,.2f}"
+        if baseline is not None and isinstance(baseline.get(name), (int, float)):
+            before = baseline[name]
+            delta = value - before
+            pct = f" ({delta / before * 100:+.1f}%)" if before else ""
+            line += f"   baseline {before:>12,.2f}   delta {delta:+,.2f}{pct}"
+        print(line)
+
+
+def start_processes(args):
+    upstream = subprocess.Popen([
+        sys.executable, os.path.abspath(__file__), *args.captures,
+        "--serve-upstream", "--upstream-port", str(args.upstream_port),
+        "--speed", str(args.speed), "--limit", str(args.limit),
+    ])
+    env = dict(os.environ)
+    for name in ("AUTH_KEYS", "AUTH_KEYS_FILE", "UPSTREAMS"):
+        env.pop(name, None)
+    env.update({
+        "UPSTREAM_URL": f"http://127.0.0.1:{args.upstream_port}/api/chat",
+        "API_TOKEN": TOKEN,
+        "LOG_LEVEL": "WARNING",
+        # 每个请求都要到达替身上游，关闭缓存、合并、录制和配额
+        "CACHE_ENABLED": "false",
+        "SINGLEFLIGHT_ENABLED": "false",
+        "CAPTURE_ENABLED": "false",
+        "AUTH_QUOTA_REQUESTS": "0",
+        "AUTH_QUOTA_TOKENS": "0",
+    })
+    proxy = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "main:app",
+        "--host", "127.0.0.1", "--port", str(args.proxy_port), "--log-level", "warning",
+    ], cwd=os.path.abspath(args.app_dir), env=env)
+    return upstream, proxy
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured traffic against a timing-faithful stand-in upstream")
+    parser.add_argument("captures", nargs="+", help="录制文件（CAPTURE_PATH）")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放速度倍数，2表示到达间隔和上游时序都压缩一半")
+    parser.add_argument("--limit", type=int, default=0, help="只回放前N条，0为全部")
+    parser.add_argument("--app-dir", default=ROOT, help="被测代理的代码目录（另一个版本的检出）")
+    parser.add_argument("--output", help="把结果保存为JSON，供之后 --baseline 对比")
+    parser.add_argument("--baseline", help="之前保存的结果，输出各项差值")
+    parser.add_argument("--upstream-port", type=int, default=9100)
+    parser.add_argument("--proxy-port", type=int, default=9101)
+    parser.add_argument("--serve-upstream", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    records = load_records(args.captures, args.limit)
+    if args.serve_upstream:
+        import uvicorn
+        uvicorn.run(create_upstream_app(records, args.speed), host="127.0.0.1", port=args.upstream_port,
+                    log_level="warning")
+        return
+    if not records:
+        sys.exit("no replayable records (nothing reached the upstream)")
+
+    span = records[-1]["ts"] - records[0]["ts"]
+    print(f"replaying {len(records)} requests captured over {span:.1f}s at {args.speed:g}x "
+          f"against {os.path.abspath(args.app_dir)}")
+    upstream, proxy = start_processes(args)
+    try:
+        wait_ready(f"http://127.0.0.1:{args.upstream_port}/health")
+        wait_ready(f"http://127.0.0.1:{args.proxy_port}/health")
+        summary = asyncio.run(run_replay(records, f"http://127.0.0.1:{args.proxy_port}/v1/chat/completions",
+                                         args.speed))
+    finally:
+        for process in (proxy, upstream):
+            process.terminate()
+            process.wait()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    report(summary, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+# cache.py
+# 响应缓存模块，按请求负载精确匹配缓存完整回答
+
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from config import CacheConfig
+from log_utils import get_logger, log_event
+from state import state_backend
+
+logger = get_logger("cache")
+
+
+def make_cache_key(payload) -> str:
+    """计算请求负载的规范化哈希
+
+    字段顺序、空白不影响结果，保证相同的 messages+model 得到相同的键。
+
+    Args:
+        payload: 转发给上游的请求负载
+
+    Returns:
+        十六进制的sha256摘要
+    """
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """带LRU和TTL淘汰的内存缓存
+
+    OrderedDict按访问顺序保存条目，命中时移到末尾，
+    超过条目数或总字节数上限时从头部淘汰最久未使用的条目。
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        """
+        Args:
+            max_entries: 最大条目数
+            max_bytes: 内容总字节数上限
+            ttl: 条目存活时间（秒）
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (过期时间, 内容, 字节数)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[str]:
+        """查询缓存
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            缓存的内容，未命中或已过期时返回None
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, content, size = entry
+        if expires_at <= time.monotonic():
+            self._remove(key, size)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return content
+
+    def set(self, key: str, content: str):
+        """写入缓存，必要时淘汰旧条目
+
+        Args:
+            key: 缓存键
+            content: 完整回答内容
+        """
+        size = len(content.encode("utf-8"))
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[2]
+
+        self._entries[key] = (time.monotonic() + self.ttl, content, size)
+        self._bytes += size
+
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        """清空缓存"""
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        """返回命中率等统计信息"""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": CacheConfig.ENABLED,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def _remove(self, key: str, size: int):
+        del self._entries[key]
+        self._bytes -= size
+
+
+class CacheClient:
+    """通过状态后端访问ResponseCache
+
+    单进程时直接调用进程内的缓存，多进程时所有工作进程共享状态服务中的同一份缓存。
+    """
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    async def get(self, key: str) -> Optional[str]:
+        """查询缓存，状态服务不可用时按未命中处理"""
+        try:
+            return await self._backend.call("cache_get", key)
+        except (OSError, RuntimeError) as e:
+            log_event(logger, logging.WARNING, "cache_unavailable", op="get", error=str(e))
+            return None
+
+    async def set(self, key: str, content: str):
+        """写入缓存，失败时只记录日志，不影响已经完成的请求"""
+        try:
+            await self._backend.call("cache_set", key, content)
+        except (OSError, RuntimeError) as e:
+            log_event(logger, logging.WARNING, "cache_unavailable", op="set", error=str(e))
+
+    async def stats(self) -> dict:
+        return await self._backend.call("cache_stats")
+
+
+# 全局缓存实例，条目保存在状态后端的ResponseCache中
+response_cache = CacheClient(state_backend)
@@ -0,0 +1,183 @@
+# capture.py
+# 流量录制：按采样率记录聊天请求的请求体、上游响应头耗时以及每个上游数据块的到达时间和大小，
+# 经脱敏后写入压缩的JSONL，供 benchmarks/replay.py 按原始时序回放
+#
+# 每条记录：
+#   {"v": 1, "ts": 请求到达的Unix时间, "request_id", "key": 密钥名称, "model": 请求中的模型, "mapped_model",
+#    "stream", "request_bytes": 请求体字节数, "body": 脱敏后的请求体, "upstream": 上游名称,
+#    "headers_ms": 发送上游请求到收到响应头的耗时, "chunks": [[距响应头的毫秒数, 字节数], ...],
+#    "status": 返回给客户端的状态码, "duration_ms": 总耗时}
+
+import importlib
+import logging
+import os
+import random
+import time
+from contextvars import ContextVar
+from typing import Callable, List, Optional
+
+from config import CaptureConfig
+from log_utils import get_logger, log_event, request_id_var, elapsed_ms
+from record_writer import RecordWriter
+
+logger = get_logger("capture")
+
+CAPTURE_VERSION = 1
+
+# 当前请求的录制，由routes设置，api_client在上游响应和数据块到达时更新
+current_capture: ContextVar[Optional["Capture"]] = ContextVar("current_capture", default=None)
+
+Redactor = Callable[[dict], Optional[dict]]
+
+
+def _filler(text: str) -> str:
+    """等长的占位文本，保留请求大小的分布"""
+    return "x" * len(text)
+
+
+def redact_content(record: dict) -> dict:
+    """内置脱敏：把消息内容替换为等长的占位文本"""
+    for message in record["body"].get("messages") or []:
+        if not isinstance(message, dict):
+            continue
+        content = message.get("content")
+        if isinstance(content, str):
+            message["content"] = _filler(content)
+        elif isinstance(content, list):
+            for part in content:
+                if isinstance(part, dict) and isinstance(part.get("text"), str):
+                    part["text"] = _filler(part["text"])
+        if isinstance(message.get("reasoning_content"), str):
+            message["reasoning_content"] = _filler(message["reasoning_content"])
+    return record
+
+
+def redact_key(record: dict) -> dict:
+    """内置脱敏：去掉密钥名称"""
+    record["key"] = None
+    return record
+
+
+BUILTIN_REDACTORS = {"content": redact_content, "key": redact_key}
+
+
+def load_redactors(spec: str) -> List[Redactor]:
+    """解析CAPTURE_REDACT：逗号分隔的内置名称（content、key）或 module:function
+
+    自定义函数接收一条记录（可直接修改），返回处理后的记录，返回None时丢弃该记录。
+    """
+    redactors = []
+    for name in filter(None, (part.strip() for part in spec.split(","))):
+        if name == "none":
+            continue
+        if name in BUILTIN_REDACTORS:
+            redactors.append(BUILTIN_REDACTORS[name])
+            continue
+        module, sep, attr = name.partition(":")
+        if not sep:
+            raise ValueError(f"Unknown capture redactor: {name}")
+        redactors.append(getattr(importlib.import_module(module), attr))
+    return redactors
+
+
+_redactors: List[Redactor] = load_redactors(CaptureConfig.REDACT) if CaptureConfig.ENABLED else []
+
+
+def add_redactor(redactor: Redactor):
+    """注册一个额外的脱敏函数，在写入线程中按注册顺序执行"""
+    _redactors.append(redactor)
+
+
+def _redact(record: dict) -> Optional[dict]:
+    for redactor in _redactors:
+        try:
+            record = redactor(record)
+        except Exception as e:
+            # 脱敏失败时宁可丢弃也不写出原文
+            log_event(logger, logging.WARNING, "capture_redact_failed", redactor=getattr(redactor, "__name__", "?"),
+                      error=str(e))
+            return None
+        if record is None:
+            return None
+    return record
+
+
+class Capture:
+    """一个请求的录制"""
+
+    __slots__ = ("record", "_started", "_headers_at", "_finished")
+
+    def __init__(self, key: str, body: dict, request_bytes: int, mapped_model: str, stream: bool):
+        self._started = time.perf_counter()
+        self._headers_at: Optional[float] = None
+        self._finished = False
+        self.record = {
+            "v": CAPTURE_VERSION,
+            "ts": round(time.time(), 3),
+            "request_id": request_id_var.get(),
+            "key": key,
+            "model": body.get("model"),
+            "mapped_model": mapped_model,
+            "stream": stream,
+            "request_bytes": request_bytes,
+            "body": body,
+            "upstream": None,
+            "headers_ms": None,
+            "chunks": [],
+            "status": None,
+            "duration_ms": None,
+        }
+
+    def on_response(self, upstream: str, seconds: float):
+        """收到上游响应头（对冲或重试时以最后一次为准）"""
+        self._headers_at = time.perf_counter()
+        self.record["upstream"] = upstream
+        self.record["headers_ms"] = round(seconds * 1000, 2)
+        self.record["chunks"] = []
+
+    def on_chunk(self, size: int):
+        """收到一个上游数据块"""
+        if self._headers_at is not None:
+            self.record["chunks"].append([elapsed_ms(self._headers_at), size])
+
+    def finish(self, status: int):
+        """请求结束，交给写入器；只记录第一次"""
+        if self._finished:
+            return
+        self._finished = True
+        self.record["status"] = status
+        self.record["duration_ms"] = elapsed_ms(self._started)
+        capture_writer.submit(self.record)
+
+
+def _writer_path(path: str) -> str:
+    # 多进程时每个工作进程写自己的文件
+    return path.replace("{pid}", str(os.getpid()))
+
+
+# 全局录制写入器，未启用录制时为None
+capture_writer = RecordWriter(
+    "capture",
+    _writer_path(CaptureConfig.PATH),
+    max_records=CaptureConfig.BUFFER_SIZE,
+    max_bytes=CaptureConfig.MAX_BYTES,
+    backups=CaptureConfig.BACKUPS,
+    transform=_redact,
+) if CaptureConfig.ENABLED else None
+
+
+def start_capture(key: str, body: dict, request_bytes: int, mapped_model: str, stream: bool) -> Optional[Capture]:
+    """按采样率为当前请求开始录制，未启用或未被采样时返回None
+
+    Args:
+        key: 密钥名称
+        body: 客户端请求体（此后不应再被修改）
+        request_bytes: 请求体字节数
+        mapped_model: 映射后的模型名称
+        stream: 是否为流式请求
+    """
+    if capture_writer is None or random.random() >= CaptureConfig.SAMPLE_RATE:
+        return None
+    capture = Capture(key, body, request_bytes, mapped_model, stream)
+    current_capture.set(capture)
+    return capture
@@ -0,0 +1,157 @@
+# completions.py
+# 聊天请求的公共流程：/v1/chat/completions 和批量请求共用模型解析、上下文压缩、配额、缓存、用量和指标
+
+from typing import Iterable
+
+from fastapi import HTTPException
+
+from api_client import call_api, call_api_choices, parse_choice_count
+from auth import ApiKey
+from cache import response_cache, make_cache_key
+from config import CacheConfig
+from context import compact_messages
+from metrics import RequestMetrics, error_class, observe_context_compaction
+from models import model_registry
+from quota import quotas
+from response_formatter import format_openai_response, iter_openai_stream
+from tracing import span
+from usage import Usage
+
+
+class ChatRequest:
+    """准备好、已通过配额检查的一条聊天请求"""
+
+    __slots__ = ("api_key", "model_spec", "payload", "context_report", "stream", "n", "include_usage",
+                 "usage", "tracker", "cache_key", "cached")
+
+    @property
+    def model(self) -> str:
+        """映射后的模型名称"""
+        return self.payload["model"]
+
+    async def store(self, content):
+        """上游正常结束后写入缓存（未使用缓存时忽略）"""
+        if self.cache_key is not None and content:
+            await response_cache.set(self.cache_key, content)
+
+    async def charge(self, contents: Iterable[str]):
+        """把各选项的内容计入用量，并按补全token数扣减该密钥的配额"""
+        if self.usage is None:
+            return
+        for text in contents:
+            self.usage.add(text)
+        await quotas.charge(self.api_key, self.usage.completion_tokens)
+
+    def set_headers(self, response):
+        """设置 X-Cache（使用了缓存时）和 X-Context-Tokens-Saved 响应头"""
+        if self.cache_key is not None:
+            response.headers["X-Cache"] = "HIT" if self.cached is not None else "MISS"
+        if self.context_report.changed:
+            response.headers["X-Context-Tokens-Saved"] = str(self.context_report.tokens_saved)
+
+
+async def prepare_chat(body: dict, api_key: ApiKey, stream: bool = False, use_cache: bool = True,
+                       request=None) -> ChatRequest:
+    """解析模型、按上下文预算压缩消息、检查配额并查询缓存
+
+    缓存中只有一个选项，n>1时不使用缓存。
+
+    Args:
+        body: 客户端请求体
+        api_key: 认证得到的密钥
+        stream: 是否为流式请求
+        use_cache: 是否允许使用缓存（客户端带 Cache-Control: no-cache 时为False）
+        request: 客户端请求，给出时把指标对象放进request.state供审计记录使用
+
+    Returns:
+        ChatRequest，cached不为None时表示缓存命中
+
+    Raises:
+        HTTPException: 模型不存在或不支持流式、n不合法、超出配额
+    """
+    chat = ChatRequest()
+    chat.api_key = api_key
+    chat.stream = stream
+
+    # 按注册表解析模型名称
+    chat.model_spec = model_registry.resolve(body.get("model"))
+    mapped_model = chat.model_spec.name
+
+    # 按模型的上下文预算压缩消息后构造转发请求体
+    with span("compact_context"):
+        messages, chat.context_report = compact_messages(body.get("messages", []), mapped_model)
+    if chat.context_report.changed:
+        observe_context_compaction(mapped_model, chat.context_report)
+    chat.payload = {
+        "messages": messages,
+        "model": mapped_model
+    }
+
+    if stream and not chat.model_spec.streaming:
+        raise HTTPException(status_code=400, detail=f"Model '{chat.model_spec.id}' does not support streaming")
+
+    # n>1时并发请求上游n次，每次一个选项
+    chat.n = parse_choice_count(body)
+    chat.tracker = RequestMetrics(mapped_model, stream)
+    if request is not None:
+        # 审计记录从这里取模型和首字时间
+        request.state.metrics = chat.tracker
+
+    try:
+        # 非流式响应总是带上用量；流式响应只在 stream_options.include_usage 时发送用量数据块
+        chat.include_usage = not stream or bool((body.get("stream_options") or {}).get("include_usage"))
+        chat.usage = Usage.for_messages(messages) if chat.include_usage or quotas.tracks_tokens(api_key) else None
+
+        # 检查并计入该密钥的请求数和提示词token数配额
+        with span("quota"):
+            await quotas.admit(api_key, chat.usage.prompt_tokens if chat.usage is not None else 0)
+
+        chat.cache_key = None
+        chat.cached = None
+        if chat.n == 1 and use_cache and CacheConfig.ENABLED:
+            chat.cache_key = make_cache_key(chat.payload)
+            with span("cache.get"):
+                chat.cached = await response_cache.get(chat.cache_key)
+    except BaseException as e:
+        chat.tracker.finish(error_class(e))
+        raise
+    return chat
+
+
+async def complete_chat(chat: ChatRequest) -> dict:
+    """执行非流式请求（缓存命中时直接使用缓存内容），写入缓存并计入用量和配额
+
+    Returns:
+        OpenAI格式的 chat.completion 响应体，n>1时有n个choices
+    """
+    content = chat.cached
+    if content is None:
+        try:
+            if chat.n > 1:
+                content = await call_api_choices(chat.payload, chat.n, tracker=chat.tracker)
+            else:
+                content = await call_api(chat.payload, is_stream=False, tracker=chat.tracker)
+        except BaseException as e:
+            chat.tracker.finish(error_class(e))
+            raise
+        await chat.store(content)
+    chat.tracker.finish()
+    await chat.charge(content if chat.n > 1 else [content])
+    return format_openai_response(content, model=chat.model, usage=chat.usage.as_dict())
+
+
+async def replay_cached(chat: ChatRequest):
+    """以SSE帧重放缓存命中的内容，转发结束（包括客户端断开）时才记录请求结束
+
+    Yields:
+        SSE帧文本
+    """
+    try:
+        async for frame in iter_openai_stream(chat.cached, model=chat.model,
+                                              usage=chat.usage if chat.include_usage else None):
+            yield frame
+    except Exception as e:
+        chat.tracker.finish(error_class(e))
+        raise
+    finally:
+        chat.tracker.finish()
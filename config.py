@@ -2,12 +2,33 @@
 # 配置模块，管理环境变量和配置项
 
 import os
-from typing import Optional
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    """读取布尔型环境变量，支持 1/true/yes/on"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
 
 # API认证配置
 class AuthConfig:
-    # 从环境变量获取API令牌，如果未设置则使用默认值
+    # 未配置 AUTH_KEYS_FILE 和 AUTH_KEYS 时使用的单个API令牌
     API_TOKEN: str = os.getenv('API_TOKEN', 'sk-114514')
+    # 密钥文件（JSON），修改后自动重新加载，格式见README
+    KEYS_FILE: str = os.getenv('AUTH_KEYS_FILE', '')
+    # 直接在环境变量中配置的密钥，格式: name=sk-xxx,name2=sha256:<十六进制摘要>
+    KEYS: str = os.getenv('AUTH_KEYS', '')
+    # 检查密钥文件是否修改的最小间隔（秒）
+    RELOAD_INTERVAL: float = float(os.getenv('AUTH_RELOAD_INTERVAL', '5'))
+    # 每个密钥在滑动窗口内的默认请求数和token数上限，0表示不限制，可在密钥文件中单独指定
+    QUOTA_REQUESTS: int = int(os.getenv('AUTH_QUOTA_REQUESTS', '0'))
+    QUOTA_TOKENS: int = int(os.getenv('AUTH_QUOTA_TOKENS', '0'))
+    # 配额滑动窗口长度（秒）
+    QUOTA_WINDOW: float = float(os.getenv('AUTH_QUOTA_WINDOW', '60'))
+    # 拥有管理权限的密钥名称，逗号分隔；默认没有管理密钥，未配置多密钥时API_TOKEN的名称为default
+    ADMIN_KEYS: str = os.getenv('AUTH_ADMIN_KEYS', '')
     
     @classmethod
     def get_token(cls) -> str:
@@ -17,22 +38,315 @@ class AuthConfig:
             str: API认证令牌
         """
         return cls.API_TOKEN
-    
+
+
+# 模型注册表配置
+class ModelConfig:
+    # 模型定义文件（JSON），未设置时使用models.py中的内置定义，修改后自动重新加载
+    FILE: str = os.getenv('MODELS_FILE', '')
+    # 额外的模型别名，格式: gpt-4o=deepseek-v3-turbo,r1=deepseek70b
+    ALIASES: str = os.getenv('MODEL_ALIASES', '')
+    # 检查模型文件是否修改的最小间隔（秒）
+    RELOAD_INTERVAL: float = float(os.getenv('MODELS_RELOAD_INTERVAL', '5'))
+    # 未知模型名称返回404，关闭时回退到默认模型
+    STRICT: bool = _env_bool('MODELS_STRICT', False)
+
+# 上游连接池配置
+class UpstreamConfig:
+    # 上游聊天接口地址
+    URL: str = os.getenv('UPSTREAM_URL', 'https://deepseek.rkui.cn/api/chat')
+    # 连接池上限与保活连接数
+    MAX_CONNECTIONS: int = int(os.getenv('UPSTREAM_MAX_CONNECTIONS', '100'))
+    MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv('UPSTREAM_MAX_KEEPALIVE', '20'))
+    # 空闲保活连接的过期时间（秒）
+    KEEPALIVE_EXPIRY: float = float(os.getenv('UPSTREAM_KEEPALIVE_EXPIRY', '30'))
+    # 是否启用HTTP/2多路复用（需要安装h2）
+    HTTP2: bool = _env_bool('UPSTREAM_HTTP2', False)
+    # 分阶段超时（秒）：建立连接 / 读取 / 写入 / 等待连接池
+    CONNECT_TIMEOUT: float = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', '10'))
+    READ_TIMEOUT: float = float(os.getenv('UPSTREAM_READ_TIMEOUT', '60'))
+    WRITE_TIMEOUT: float = float(os.getenv('UPSTREAM_WRITE_TIMEOUT', '10'))
+    POOL_TIMEOUT: float = float(os.getenv('UPSTREAM_POOL_TIMEOUT', '5'))
+    # 多个上游地址/镜像（JSON数组），为空时只使用URL，格式见upstreams.load_upstreams
+    UPSTREAMS: str = os.getenv('UPSTREAMS', '')
+    # 负载均衡策略：least_outstanding（在途请求最少）或 ewma（响应耗时加权）
+    BALANCE: str = os.getenv('UPSTREAM_BALANCE', 'least_outstanding').lower()
+    # 连续失败多少次后暂时摘除该上游，以及摘除时长（秒）
+    EJECT_FAILURES: int = int(os.getenv('UPSTREAM_EJECT_FAILURES', '3'))
+    EJECT_COOLDOWN: float = float(os.getenv('UPSTREAM_EJECT_COOLDOWN', '15'))
+    # 首字节前单次请求最多尝试的上游个数
+    FAILOVER_ATTEMPTS: int = int(os.getenv('UPSTREAM_FAILOVER_ATTEMPTS', '3'))
+
+
+# 日志配置
+class LogConfig:
+    # 日志级别：DEBUG / INFO / WARNING / ERROR
+    LEVEL: str = os.getenv('LOG_LEVEL', 'INFO').upper()
+    # 输出格式：json 为结构化日志，text 为普通文本
+    FORMAT: str = os.getenv('LOG_FORMAT', 'json').lower()
+    # 热路径（逐块/逐行）调试日志的采样率，0~1
+    SAMPLE_RATE: float = float(os.getenv('LOG_SAMPLE_RATE', '0.01'))
+
+
+# 请求追踪与性能剖析配置
+class TraceConfig:
+    # 是否为每个请求记录各阶段耗时
+    ENABLED: bool = _env_bool('TRACE_ENABLED', True)
+    # 每个进程在内存中保留的最近Trace数
+    BUFFER_SIZE: int = int(os.getenv('TRACE_BUFFER_SIZE', '1000'))
+    # 总耗时超过该值（毫秒）的请求记录一条带各阶段耗时的日志，0表示不记录
+    SLOW_MS: float = float(os.getenv('TRACE_SLOW_MS', '10000'))
+    # 不追踪的路径，逗号分隔
+    EXCLUDE_PATHS: str = os.getenv('TRACE_EXCLUDE_PATHS', '/metrics,/health,/ready')
+    # 性能剖析的最长时间（秒）与默认采样间隔（毫秒）
+    PROFILE_MAX_SECONDS: float = float(os.getenv('PROFILE_MAX_SECONDS', '60'))
+    PROFILE_INTERVAL_MS: float = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+
     @classmethod
-    def validate_token(cls, token: Optional[str]) -> bool:
-        """验证API令牌是否有效
-        
-        Args:
-            token: 待验证的令牌
-            
+    def get_exclude_paths(cls) -> frozenset:
+        return frozenset(path.strip() for path in cls.EXCLUDE_PATHS.split(',') if path.strip())
+
+# 启动预热配置
+class WarmupConfig:
+    # 是否在启动时预先解析上游域名并建立连接，关闭时启动后立即就绪
+    ENABLED: bool = _env_bool('WARMUP_ENABLED', True)
+    # 每个上游预先建立的连接数（HTTP/2时1条即可）
+    CONNECTIONS: int = int(os.getenv('WARMUP_CONNECTIONS', '2'))
+    # 单轮预热的超时时间（秒）
+    TIMEOUT: float = float(os.getenv('WARMUP_TIMEOUT', '10'))
+    # 预热失败后重试的间隔（秒）
+    RETRY_INTERVAL: float = float(os.getenv('WARMUP_RETRY_INTERVAL', '5'))
+    # 就绪后定期重新预热的间隔（秒），应小于UPSTREAM_KEEPALIVE_EXPIRY，0表示不重新预热
+    REFRESH_INTERVAL: float = float(os.getenv('WARMUP_REFRESH_INTERVAL', '0'))
+    # 导入main模块的耗时预算（毫秒），benchmarks/bench_startup.py 据此检查
+    IMPORT_BUDGET_MS: float = float(os.getenv('IMPORT_BUDGET_MS', '400'))
+
+# 流量录制配置
+class CaptureConfig:
+    # 是否录制请求与上游数据块的时序，供 benchmarks/replay.py 回放（默认关闭）
+    ENABLED: bool = _env_bool('CAPTURE_ENABLED', False)
+    # 录制文件路径，以.gz结尾时gzip压缩，{pid}替换为进程号
+    PATH: str = os.getenv('CAPTURE_PATH', 'captures/capture-{pid}.jsonl.gz')
+    # 录制的请求比例（0~1）
+    SAMPLE_RATE: float = float(os.getenv('CAPTURE_SAMPLE_RATE', '1'))
+    # 等待写入的记录数上限，超过时丢弃
+    BUFFER_SIZE: int = int(os.getenv('CAPTURE_BUFFER_SIZE', '10000'))
+    # 单个录制文件的大小上限（字节）与保留的旧文件数
+    MAX_BYTES: int = int(os.getenv('CAPTURE_MAX_BYTES', str(256 * 1024 * 1024)))
+    BACKUPS: int = int(os.getenv('CAPTURE_BACKUPS', '5'))
+    # 脱敏：逗号分隔的 content（消息内容替换为等长占位）、key（去掉密钥名称）、none 或 module:function
+    REDACT: str = os.getenv('CAPTURE_REDACT', 'content')
+
+# 审计/用量日志配置
+class AuditConfig:
+    # 是否为每个请求写一条审计记录（默认关闭）
+    ENABLED: bool = _env_bool('AUDIT_ENABLED', False)
+    # 审计文件路径，以.gz结尾时gzip压缩，{pid}替换为进程号
+    PATH: str = os.getenv('AUDIT_PATH', 'logs/audit-{pid}.jsonl')
+    # 等待写入的记录数上限，超过时丢弃并计数
+    BUFFER_SIZE: int = int(os.getenv('AUDIT_BUFFER_SIZE', '10000'))
+    # 攒够多少条或最长多久（秒）写一批
+    BATCH_SIZE: int = int(os.getenv('AUDIT_BATCH_SIZE', '256'))
+    FLUSH_INTERVAL: float = float(os.getenv('AUDIT_FLUSH_INTERVAL', '1'))
+    # 单个审计文件的大小上限（字节）与保留的旧文件数
+    MAX_BYTES: int = int(os.getenv('AUDIT_MAX_BYTES', str(100 * 1024 * 1024)))
+    BACKUPS: int = int(os.getenv('AUDIT_BACKUPS', '10'))
+    # 不记录的路径，逗号分隔
+    EXCLUDE_PATHS: str = os.getenv('AUDIT_EXCLUDE_PATHS', '/metrics,/health,/ready')
+
+    @classmethod
+    def get_exclude_paths(cls) -> frozenset:
+        return frozenset(path.strip() for path in cls.EXCLUDE_PATHS.split(',') if path.strip())
+
+# 响应缓存配置
+class CacheConfig:
+    # 是否启用非流式/流式响应的精确匹配缓存（默认关闭）
+    ENABLED: bool = _env_bool('CACHE_ENABLED', False)
+    # 最大缓存条目数
+    MAX_ENTRIES: int = int(os.getenv('CACHE_MAX_ENTRIES', '1024'))
+    # 缓存内容总大小上限（字节）
+    MAX_BYTES: int = int(os.getenv('CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+    # 缓存条目存活时间（秒）
+    TTL: float = float(os.getenv('CACHE_TTL', '600'))
+
+
+# 在途请求合并（single-flight）配置
+class SingleFlightConfig:
+    # 是否让相同负载的并发请求共享同一个上游流（默认关闭）
+    ENABLED: bool = _env_bool('SINGLEFLIGHT_ENABLED', False)
+    # 每个订阅者缓冲的最大事件批次数，超过则视为慢消费者并断开
+    QUEUE_SIZE: int = int(os.getenv('SINGLEFLIGHT_QUEUE_SIZE', '256'))
+
+
+# 多选项（n>1）配置
+class ChoicesConfig:
+    # 单个请求允许的最大n
+    MAX_N: int = int(os.getenv('CHOICES_MAX_N', '8'))
+    # 单个请求同时在途的上游请求数上限
+    CONCURRENCY: int = int(os.getenv('CHOICES_CONCURRENCY', '4'))
+
+# 流式转发配置
+class StreamConfig:
+    # 是否在上游与客户端之间使用有界缓冲的转发任务（客户端断开时立即取消上游读取）
+    RELAY_ENABLED: bool = _env_bool('STREAM_RELAY_ENABLED', True)
+    # 等待客户端读取的数据上限（字符数），超过后暂停读取上游
+    BUFFER_SIZE: int = int(os.getenv('STREAM_BUFFER_SIZE', '65536'))
+    # 缓冲区持续满载多久（秒）后视为慢客户端并断开，0表示一直等待
+    SLOW_CLIENT_TIMEOUT: float = float(os.getenv('STREAM_SLOW_CLIENT_TIMEOUT', '30'))
+
+
+# 批量请求配置
+class BatchConfig:
+    # 单个批量请求的最大条目数
+    MAX_ITEMS: int = int(os.getenv('BATCH_MAX_ITEMS', '10000'))
+    # 批量请求体的最大字节数
+    MAX_BYTES: int = int(os.getenv('BATCH_MAX_BYTES', str(64 * 1024 * 1024)))
+    # 默认同时处理的条目数，请求可通过concurrency参数调小
+    CONCURRENCY: int = int(os.getenv('BATCH_CONCURRENCY', '8'))
+    # 已完成条目的检查点保存时间（秒），同一批次重新提交时跳过已完成的条目
+    CHECKPOINT_TTL: float = float(os.getenv('BATCH_CHECKPOINT_TTL', '86400'))
+
+# 上游并发调度配置
+class SchedulerConfig:
+    # 是否启用上游并发限制与排队
+    ENABLED: bool = _env_bool('SCHED_ENABLED', True)
+    # 全局最大并发上游请求数
+    GLOBAL_CONCURRENCY: int = int(os.getenv('SCHED_GLOBAL_CONCURRENCY', '64'))
+    # 每个映射后模型的默认最大并发数
+    MODEL_CONCURRENCY: int = int(os.getenv('SCHED_MODEL_CONCURRENCY', '16'))
+    # 单独指定某些模型的并发上限，格式: deepseek70b=8,grok3=2
+    MODEL_LIMITS: str = os.getenv('SCHED_MODEL_LIMITS', '')
+    # 等待队列长度上限，超过则直接返回429
+    QUEUE_SIZE: int = int(os.getenv('SCHED_QUEUE_SIZE', '256'))
+    # 请求最多排队等待的时间（秒）
+    MAX_WAIT: float = float(os.getenv('SCHED_MAX_WAIT', '30'))
+
+    @classmethod
+    def get_model_limits(cls) -> dict:
+        """解析 SCHED_MODEL_LIMITS
+
         Returns:
-            bool: 令牌是否有效
+            dict: 模型名 -> 并发上限
         """
-        if not token:
-            return False
-        
-        # 移除Bearer前缀并验证
-        if token.startswith('Bearer '):
-            token = token[7:]
+        limits = {}
+        for item in cls.MODEL_LIMITS.split(','):
+            name, sep, value = item.partition('=')
+            if sep and name.strip() and value.strip().isdigit():
+                limits[name.strip()] = int(value)
+        return limits
+
+    @classmethod
+    def max_workers(cls) -> int:
+        """共享状态的工作进程数上限
+
+        并发上限和队列长度在工作进程之间平分且每个进程至少分到1，
+        进程数超过其中最小的一个时，各进程份额之和会超过配置的上限。
+
+        Returns:
+            int: 最小的并发上限或队列长度；未启用调度时为0，表示不限制
+        """
+        if not cls.ENABLED:
+            return 0
+        limits = [cls.GLOBAL_CONCURRENCY, cls.MODEL_CONCURRENCY, cls.QUEUE_SIZE, *cls.get_model_limits().values()]
+        return max(1, min(limits))
+
+
+# 上游容错配置：重试、对冲请求、熔断
+class ResilienceConfig:
+    # 连接错误或上游5xx时的最大重试次数（只在向客户端发送第一个字节之前重试）
+    RETRY_ATTEMPTS: int = int(os.getenv('RETRY_ATTEMPTS', '2'))
+    # 重试退避的基准时间与上限（秒），实际等待在[0, 基准*2^n]内随机
+    RETRY_BACKOFF_BASE: float = float(os.getenv('RETRY_BACKOFF_BASE', '0.2'))
+    RETRY_BACKOFF_MAX: float = float(os.getenv('RETRY_BACKOFF_MAX', '2'))
+    # 是否为非流式请求启用对冲请求（默认关闭）
+    HEDGE_ENABLED: bool = _env_bool('HEDGE_ENABLED', False)
+    # 对冲阈值取首字节耗时的分位数，样本不足时使用下限
+    HEDGE_QUANTILE: float = float(os.getenv('HEDGE_QUANTILE', '0.95'))
+    HEDGE_MIN_DELAY: float = float(os.getenv('HEDGE_MIN_DELAY', '2'))
+    HEDGE_MIN_SAMPLES: int = int(os.getenv('HEDGE_MIN_SAMPLES', '20'))
+    # 每个模型保留的首字节耗时样本数
+    HEDGE_WINDOW: int = int(os.getenv('HEDGE_WINDOW', '200'))
+    # 是否启用按模型的熔断器
+    BREAKER_ENABLED: bool = _env_bool('BREAKER_ENABLED', True)
+    # 连续失败多少次后熔断
+    BREAKER_FAILURES: int = int(os.getenv('BREAKER_FAILURES', '5'))
+    # 熔断后多久允许探测请求（秒）
+    BREAKER_COOLDOWN: float = float(os.getenv('BREAKER_COOLDOWN', '30'))
+
+
+def _default_workers() -> int:
+    """默认工作进程数：CPU核数，但不超过调度器允许的进程数"""
+    workers = os.cpu_count() or 1
+    return min(workers, SchedulerConfig.max_workers() or workers)
+
+
+# 多进程部署与共享状态配置
+class ServerConfig:
+    # 监听地址与端口（serve.py使用）
+    HOST: str = os.getenv('HOST', '0.0.0.0')
+    PORT: int = int(os.getenv('PORT', '8080'))
+    # 工作进程数，0表示CPU核数（不超过调度并发上限和队列长度中最小的一个）
+    WORKERS: int = int(os.getenv('WORKERS', '0')) or _default_workers()
+    # 共享状态后端：local 为进程内，socket 为通过Unix套接字访问的状态服务（serve.py多进程时自动设置）
+    STATE_BACKEND: str = os.getenv('STATE_BACKEND', 'local').lower()
+    # 状态服务的Unix套接字路径
+    STATE_SOCKET: str = os.getenv('STATE_SOCKET', '/tmp/rkui2api-state.sock')
+    # 状态服务键值存储的最大键数
+    STATE_MAX_KEYS: int = int(os.getenv('STATE_MAX_KEYS', '100000'))
+    # 多进程时各工作进程向状态服务上报指标的间隔（秒）
+    METRICS_PUSH_INTERVAL: float = float(os.getenv('METRICS_PUSH_INTERVAL', '5'))
+    # 关闭或重载时等待在途请求结束的最长时间（秒）
+    GRACEFUL_TIMEOUT: int = int(os.getenv('GRACEFUL_TIMEOUT', '30'))
+
+    @classmethod
+    def shared_workers(cls) -> int:
+        """共享同一份状态的工作进程数，用于在进程之间分摊并发上限
+
+        Returns:
+            int: 使用socket后端时为WORKERS，否则为1
+        """
+        return cls.WORKERS if cls.STATE_BACKEND == 'socket' else 1
+
+
+# JSON编解码配置
+class JsonConfig:
+    # JSON后端：auto 在安装了orjson时使用orjson，stdlib 强制使用标准库
+    BACKEND: str = os.getenv('JSON_BACKEND', 'auto').lower()
+    # 解析上游增量事件时只解码需要的字段，不构造完整对象（事件中有大量无关字段时更快）
+    LAZY_DELTA: bool = _env_bool('JSON_LAZY_DELTA', False)
+
+
+# 用量统计配置
+class UsageConfig:
+    # 分词器：approx 为内置近似分词，tiktoken[:编码名] 需要安装tiktoken
+    TOKENIZER: str = os.getenv('USAGE_TOKENIZER', 'approx')
+    # 按消息内容缓存的提示词token数条目上限
+    MEMO_SIZE: int = int(os.getenv('USAGE_MEMO_SIZE', '10000'))
+
+
+# 上下文压缩配置
+class ContextConfig:
+    # 超出上下文预算时的处理策略：truncate 丢弃最早的对话轮次，summarize 用摘要替换，off 不处理（默认，原样转发）
+    POLICY: str = os.getenv('CONTEXT_POLICY', 'off').lower()
+    # 为模型回答预留的token数，从上下文预算中扣除
+    RESERVE_TOKENS: int = int(os.getenv('CONTEXT_RESERVE_TOKENS', '4000'))
+    # 单独指定某些模型的上下文预算，格式: deepseek70b=16000,qwen32b=8000
+    MODEL_LIMITS: str = os.getenv('CONTEXT_MODEL_LIMITS', '')
+    # 是否去掉历史assistant消息中的推理内容（reasoning_content 和 <think> 块）
+    STRIP_REASONING: bool = _env_bool('CONTEXT_STRIP_REASONING', False)
+    # summarize策略下每条被摘要消息保留的字符数
+    SUMMARY_CHARS: int = int(os.getenv('CONTEXT_SUMMARY_CHARS', '200'))
+
+    @classmethod
+    def get_model_limits(cls) -> dict:
+        """解析 CONTEXT_MODEL_LIMITS
         
-        return token == cls.API_TOKEN
\ No newline at end of file
+        Returns:
+            dict: 模型名 -> 上下文token预算
+        """
+        limits = {}
+        for item in cls.MODEL_LIMITS.split(','):
+            name, sep, value = item.partition('=')
+            if sep and name.strip() and value.strip().isdigit():
+                limits[name.strip()] = int(value)
+        return limits
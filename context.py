@@ -0,0 +1,178 @@
+# context.py
+# 上下文压缩模块：转发前去掉历史推理内容，并按模型的上下文预算截断或摘要早期对话
+
+import logging
+import re
+from typing import List, Tuple
+
+from config import ContextConfig
+from fast_json import dumps_bytes
+from log_utils import get_logger, log_event
+from models import get_context_limit
+from usage import TOKENS_PER_MESSAGE, TOKENS_PER_REPLY, count_tokens, prompt_counter
+
+logger = get_logger("context")
+
+# 推理模型在回答中输出的思考块
+_THINK_RE = re.compile(r"<think>.*?</think>\s*", re.DOTALL)
+
+# 按环境变量覆盖的模型上下文预算
+_MODEL_LIMITS = ContextConfig.get_model_limits()
+
+SUMMARY_HEADER = "Earlier conversation (summarized):"
+
+
+class ContextReport:
+    """一次压缩的结果统计"""
+
+    __slots__ = ("tokens_before", "tokens_after", "bytes_before", "bytes_after", "dropped", "stripped", "policy")
+
+    def __init__(self, policy: str):
+        self.policy = policy
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self.dropped = 0
+        self.stripped = 0
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.dropped or self.stripped)
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.bytes_before - self.bytes_after
+
+
+def context_budget(model: str) -> int:
+    """模型可用于提示词的token数：上下文预算减去为回答预留的部分，至少保留一半"""
+    limit = _MODEL_LIMITS.get(model) or get_context_limit(model)
+    return max(limit - ContextConfig.RESERVE_TOKENS, limit // 2)
+
+
+def strip_reasoning(message):
+    """去掉历史assistant消息中的推理内容，没有可去掉的内容时返回原对象"""
+    if not isinstance(message, dict) or message.get("role") != "assistant":
+        return message
+    content = message.get("content")
+    has_think = isinstance(content, str) and "<think>" in content
+    if "reasoning_content" not in message and not has_think:
+        return message
+    stripped = {key: value for key, value in message.items() if key != "reasoning_content"}
+    if has_think:
+        stripped["content"] = _THINK_RE.sub("", content)
+    return stripped
+
+
+def _summary_line(message) -> str:
+    content = message.get("content") if isinstance(message, dict) else message
+    if isinstance(content, list):
+        content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    content = " ".join(str(content or "").split())
+    if len(content) > ContextConfig.SUMMARY_CHARS:
+        content = content[:ContextConfig.SUMMARY_CHARS] + "..."
+    role = message.get("role", "user") if isinstance(message, dict) else "user"
+    return f"- {role}: {content}"
+
+
+def compact_messages(messages: List, model: str) -> Tuple[List, ContextReport]:
+    """按上下文预算压缩消息列表
+
+    1. 去掉历史assistant消息中的推理内容（CONTEXT_STRIP_REASONING）
+    2. 仍超出预算时，从最早的非system消息开始按轮次丢弃，system消息和最后一条消息始终保留；
+       summarize策略下被丢弃的消息会被压缩成一条摘要消息放在system消息之后
+
+    Args:
+        messages: 客户端发送的消息列表
+        model: 映射后的模型名称
+
+    Returns:
+        (压缩后的消息列表, ContextReport)
+    """
+    policy = ContextConfig.POLICY
+    report = ContextReport(policy)
+    if not isinstance(messages, list) or not messages:
+        return messages, report
+    if policy not in ("truncate", "summarize") and not ContextConfig.STRIP_REASONING:
+        # 默认不压缩，消息原样转发，也不必计算token数
+        return messages, report
+
+    original = messages
+    if ContextConfig.STRIP_REASONING:
+        # 最后一条消息是本轮输入，不做处理
+        messages = [strip_reasoning(m) for m in messages[:-1]] + messages[-1:]
+        report.stripped = sum(1 for a, b in zip(original, messages) if a is not b)
+
+    counts = [prompt_counter.count_message(m) for m in messages]
+    report.tokens_before = TOKENS_PER_REPLY + sum(prompt_counter.count_message(m) for m in original)
+    total = TOKENS_PER_REPLY + sum(counts)
+
+    budget = context_budget(model)
+    summary = None
+    if total > budget and policy in ("truncate", "summarize"):
+        messages, total, summary = _drop_oldest(messages, counts, total, budget, policy)
+        report.dropped = len(original) - len(messages) + (1 if summary else 0)
+
+    report.tokens_after = total
+    if report.changed:
+        report.bytes_before = len(dumps_bytes(original))
+        report.bytes_after = len(dumps_bytes(messages))
+        log_event(logger, logging.INFO, "context_compacted", model=model, policy=policy,
+                  dropped=report.dropped, stripped=report.stripped,
+                  tokens_saved=report.tokens_saved, bytes_saved=report.bytes_saved)
+    return messages, report
+
+
+def _drop_oldest(messages, counts, total, budget, policy):
+    """从最早的非system消息开始丢弃，直到不超过预算
+
+    summarize策略下先为摘要标题预留token，再用剩余预算从最近被丢弃的消息往前生成摘要行。
+
+    Returns:
+        (保留的消息列表, 新的token总数, 摘要消息或None)
+    """
+    last = len(messages) - 1
+    candidates = [i for i, m in enumerate(messages[:last])
+                  if not (isinstance(m, dict) and m.get("role") == "system")]
+    header_tokens = count_tokens(SUMMARY_HEADER) + TOKENS_PER_MESSAGE if policy == "summarize" else 0
+    dropped = []
+
+    for index in candidates:
+        within = total + header_tokens <= budget
+        # 达到预算后继续丢弃到下一条user消息为止，保证保留的历史从完整的一轮开始
+        next_is_user = isinstance(messages[index], dict) and messages[index].get("role") == "user"
+        if within and next_is_user:
+            break
+        dropped.append(index)
+        total -= counts[index]
+
+    removed = set(dropped)
+    kept = [m for i, m in enumerate(messages) if i not in removed]
+    if not header_tokens:
+        return kept, total, None
+
+    # 摘要越靠近当前轮次越有用，预算不足时优先保留较新的消息
+    room = budget - total - header_tokens
+    lines = []
+    for index in reversed(dropped):
+        line = _summary_line(messages[index])
+        cost = count_tokens(line) + 1
+        if cost > room:
+            break
+        room -= cost
+        lines.append(line)
+    if not lines:
+        return kept, total, None
+
+    summary = {"role": "system", "content": "\n".join([SUMMARY_HEADER] + lines[::-1])}
+    # 摘要放在开头的system消息之后
+    insert_at = 0
+    while insert_at < len(kept) and isinstance(kept[insert_at], dict) and kept[insert_at].get("role") == "system":
+        insert_at += 1
+    kept.insert(insert_at, summary)
+    return kept, total + prompt_counter.count_message(summary), summary
@@ -0,0 +1,121 @@
+# fast_json.py
+# JSON编解码模块：安装了orjson时使用orjson，否则回退到标准库；并提供只解码所需字段的增量内容提取
+
+import json
+import re
+from json.decoder import scanstring
+from typing import Optional, Tuple
+
+from fastapi.responses import JSONResponse
+
+from config import JsonConfig
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 取决于运行环境
+    orjson = None
+
+# 实际使用的后端名称
+BACKEND = "orjson" if orjson is not None and JsonConfig.BACKEND != "stdlib" else "stdlib"
+
+# orjson.JSONDecodeError 是 json.JSONDecodeError 的子类，统一捕获这个类型即可
+JSONDecodeError = json.JSONDecodeError
+
+if BACKEND == "orjson":
+    def loads(data):
+        """解析JSON，接受str或bytes"""
+        return orjson.loads(data)
+
+    def dumps_bytes(value) -> bytes:
+        """紧凑的JSON编码，输出UTF-8字节"""
+        return orjson.dumps(value)
+
+    def dumps(value) -> str:
+        """紧凑的JSON编码，保留非ASCII字符"""
+        return orjson.dumps(value).decode("utf-8")
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    def loads(data):
+        """解析JSON，接受str或bytes"""
+        return json.loads(data)
+
+    def dumps_bytes(value) -> bytes:
+        """紧凑的JSON编码，输出UTF-8字节"""
+        return _encoder.encode(value).encode("utf-8")
+
+    def dumps(value) -> str:
+        """紧凑的JSON编码，保留非ASCII字符"""
+        return _encoder.encode(value)
+
+
+class FastJSONResponse(JSONResponse):
+    """使用当前JSON后端序列化的JSONResponse"""
+
+    def render(self, content) -> bytes:
+        return dumps_bytes(content)
+
+
+# 增量事件中的字段位置，只在 "delta" 之后查找
+_DELTA_KEY = '"delta"'
+_CONTENT_RE = re.compile(r'"content"\s*:\s*(?:"|(null))')
+_REASONING_RE = re.compile(r'"reasoning_content"\s*:\s*(?:"|(null))')
+_FINISH_RE = re.compile(r'"finish_reason"\s*:\s*(?:"([^"\\]*)"|null)')
+
+
+def _scan_field(key: str, pattern, data: str, start: int) -> Optional[str]:
+    """在data[start:]中查找字符串字段，只解码这一个字符串
+
+    先按紧凑格式（"key":"）做子串查找，找不到时再用允许空白的正则。
+
+    Returns:
+        字段值，不存在或为null时返回None
+    """
+    index = data.find(key, start)
+    if index != -1:
+        return scanstring(data, index + len(key))[0]
+    match = pattern.search(data, start)
+    if match is None or match.group(1) is not None:
+        return None
+    return scanstring(data, match.end())[0]
+
+
+def extract_delta(data: str) -> Optional[Tuple[Optional[str], Optional[str], Optional[str]]]:
+    """从一条上游SSE事件中取出 choices[0] 的增量内容
+
+    JsonConfig.LAZY_DELTA 开启时不构造完整对象：定位到 "delta" 后用正则找到字段，
+    再用标准库的C实现 scanstring 只解码这一个字符串。
+    结构不符合预期（例如没有delta、存在多个choice）时回退到完整解析，结果与完整解析一致。
+
+    Args:
+        data: 事件数据（JSON字符串）
+
+    Returns:
+        (content, reasoning_content, finish_reason)，没有choices时返回None
+
+    Raises:
+        JSONDecodeError: 数据不是合法JSON
+    """
+    if JsonConfig.LAZY_DELTA:
+        start = data.find(_DELTA_KEY)
+        # 只有一个choice时才走快速路径，避免读到其他choice的字段
+        if start != -1 and data.find(_DELTA_KEY, start + 1) == -1:
+            # 先用子串检查跳过不存在的字段，绝大多数事件只有content
+            content = reasoning_content = finish_reason = None
+            if '"content"' in data:
+                content = _scan_field('"content":"', _CONTENT_RE, data, start)
+            if '"reasoning_content"' in data:
+                reasoning_content = _scan_field('"reasoning_content":"', _REASONING_RE, data, start)
+            if '"finish_reason":null' not in data and '"finish_reason": null' not in data:
+                # finish_reason与delta同级，可能出现在delta之前
+                finish = _FINISH_RE.search(data)
+                finish_reason = finish.group(1) if finish else None
+            return content, reasoning_content, finish_reason
+
+    payload = loads(data)
+    choices = payload.get("choices")
+    if not choices:
+        return None
+    choice = choices[0]
+    delta = choice.get("delta") or {}
+    return delta.get("content"), delta.get("reasoning_content"), choice.get("finish_reason")
@@ -0,0 +1,136 @@
+# log_utils.py
+# 日志模块，提供分级、采样的结构化日志
+
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from config import LogConfig
+
+# 所有模块日志的根名称
+ROOT_LOGGER_NAME = "rkui2api"
+
+# 当前请求的ID，由tracing.TraceMiddleware设置，log_event自动附加到日志中
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+# 后台写日志的监听器，由setup_logging创建
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """把日志记录格式化为单行JSON，附带log_event传入的字段"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """普通文本格式，字段以 key=value 形式追加"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            text += " " + " ".join(f"{k}={v!r}" for k, v in fields.items())
+        return text
+
+
+def setup_logging():
+    """初始化日志
+
+    日志记录先进入内存队列，由后台线程写到stderr，
+    避免请求协程在终端输出上阻塞事件循环。重复调用无副作用。
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    if LogConfig.FORMAT == "text":
+        formatter = TextFormatter("%(asctime)s %(levelname)s %(name)s %(message)s")
+    else:
+        formatter = JsonFormatter()
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger(ROOT_LOGGER_NAME)
+    root.setLevel(LogConfig.LEVEL)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    _listener.start()
+
+
+def shutdown_logging():
+    """停止后台日志线程并写出剩余日志"""
+    global _listener
+    if _listener is not None:
+        listener, _listener = _listener, None
+        listener.stop()
+
+
+def get_logger(name: str) -> logging.Logger:
+    """获取模块日志对象
+
+    Args:
+        name: 模块名，会挂在 rkui2api 根日志下
+
+    Returns:
+        logging.Logger对象
+    """
+    return logging.getLogger(f"{ROOT_LOGGER_NAME}.{name}")
+
+
+def log_event(logger: logging.Logger, level: int, event: str, **fields):
+    """记录一条结构化日志
+
+    Args:
+        logger: 日志对象
+        level: 日志级别
+        event: 事件名
+        **fields: 附加字段
+    """
+    if logger.isEnabledFor(level):
+        request_id = request_id_var.get()
+        if request_id is not None:
+            fields.setdefault("request_id", request_id)
+        logger.log(level, event, extra={"fields": fields})
+
+
+def should_sample(logger: logging.Logger, level: int = logging.DEBUG) -> bool:
+    """判断热路径上的这条日志是否需要记录
+
+    先检查级别（默认关闭时只有一次属性查找），再按LOG_SAMPLE_RATE采样。
+
+    Args:
+        logger: 日志对象
+        level: 日志级别
+
+    Returns:
+        bool: 是否记录
+    """
+    return logger.isEnabledFor(level) and random.random() < LogConfig.SAMPLE_RATE
+
+
+def elapsed_ms(start: float) -> float:
+    """计算从start（time.perf_counter）到现在的毫秒数"""
+    return round((time.perf_counter() - start) * 1000, 2)
@@ -1,20 +1,82 @@
 # main.py
 # 主应用入口
 
+import time
+
+# 导入整个应用的耗时，启动时记录到日志（预算检查见 benchmarks/bench_startup.py）
+_import_started = time.perf_counter()
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from log_utils import setup_logging, shutdown_logging, get_logger, log_event, elapsed_ms
 from routes import router
+from api_client import init_client, close_client
+from metrics import publish_metrics_forever
+from state import state_backend
+from tracing import TraceMiddleware
+from warmup import readiness, warm_up_forever
+from capture import capture_writer
+from audit import AuditMiddleware, audit_writer
+
+setup_logging()
+
+logger = get_logger("main")
+
+IMPORT_MS = elapsed_ms(_import_started)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时创建上游连接池并在后台预热，关闭时释放
+    
+    多进程共享状态时，在后台定期把本进程的指标上报给状态服务。
+    """
+    await init_client()
+    for writer in (capture_writer, audit_writer):
+        if writer is not None:
+            writer.start()
+    log_event(logger, logging.INFO, "startup", import_ms=IMPORT_MS)
+    warmer = asyncio.create_task(warm_up_forever())
+    publisher = asyncio.create_task(publish_metrics_forever()) if state_backend.shared else None
+    try:
+        yield
+    finally:
+        warmer.cancel()
+        if publisher is not None:
+            publisher.cancel()
+        await close_client()
+        for writer in (capture_writer, audit_writer):
+            if writer is not None:
+                # 写完剩余的录制和审计记录，join在线程中等待以免阻塞事件循环
+                await asyncio.to_thread(writer.close)
+        shutdown_logging()
+
 
 # 创建FastAPI应用
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # 注册路由
 app.include_router(router)
 
-# 添加健康检查路由
+# 审计记录，放在追踪之内以便带上请求ID
+app.add_middleware(AuditMiddleware)
+
+# 请求阶段追踪，放在最外层以覆盖完整的请求处理时间
+app.add_middleware(TraceMiddleware)
+
+# 添加健康检查路由（存活检查，进程能响应即返回ok）
 @app.get("/health")
 async def health_check():
     return {"status": "ok"}
 
+# 就绪检查：上游连接预热完成前返回503
+@app.get("/ready")
+async def ready_check():
+    return JSONResponse(readiness.status(), status_code=200 if readiness.ready else 503)
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8080)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8080)
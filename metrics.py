@@ -0,0 +1,283 @@
+# metrics.py
+# 指标模块，以Prometheus文本格式导出请求数、错误、在途请求和各阶段耗时
+
+import asyncio
+import os
+import time
+from bisect import bisect_left
+from typing import Dict, Optional, Tuple
+
+from config import ServerConfig
+from state import state_backend
+
+# 默认的耗时分桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# 速率分桶（每秒数量）
+RATE_BUCKETS = (1, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# 指标名称前缀
+PREFIX = "rkui2api_"
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """单调递增的计数器，按标签值元组保存"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = PREFIX + name
+        self.help = help_text
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self, values=None):
+        for key, value in (self._values if values is None else values).items():
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+    @staticmethod
+    def merge(total, value):
+        return value if total is None else total + value
+
+
+class Gauge(Counter):
+    """可增可减的瞬时值"""
+
+    kind = "gauge"
+
+    def dec(self, *label_values: str, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) - amount
+
+
+class Histogram:
+    """分桶直方图
+
+    观测时只做一次二分查找和两次加法，导出时才计算累积值。
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # 标签值 -> [各桶计数..., +Inf桶计数, 总和]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *label_values: str):
+        series = self._values.get(label_values)
+        if series is None:
+            series = self._values[label_values] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self, values=None):
+        for key, series in (self._values if values is None else values).items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = 'le="%s"' % (bound if bound == "+Inf" else _format_value(bound))
+                yield f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(series[-1])}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}"
+
+    @staticmethod
+    def merge(total, series):
+        return list(series) if total is None else [a + b for a, b in zip(total, series)]
+
+
+class Registry:
+    """指标注册表，负责导出Prometheus文本格式"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self, snapshots=None) -> str:
+        """导出Prometheus文本
+
+        Args:
+            snapshots: 多个进程的snapshot()结果，给出时按标签合并后导出，否则只导出本进程
+        """
+        merged = self._merge(snapshots) if snapshots is not None else {}
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render(merged.get(metric.name) if snapshots is not None else None))
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """本进程所有指标的可JSON序列化快照：指标名 -> [[标签值列表, 值], ...]"""
+        return {
+            metric.name: [[list(key), value] for key, value in metric._values.items()]
+            for metric in self._metrics
+        }
+
+    def _merge(self, snapshots) -> dict:
+        kinds = {metric.name: metric for metric in self._metrics}
+        merged: Dict[str, dict] = {}
+        for snapshot in snapshots:
+            for name, series in snapshot.items():
+                metric = kinds.get(name)
+                if metric is None:
+                    continue
+                values = merged.setdefault(name, {})
+                for labels, value in series:
+                    key = tuple(labels)
+                    values[key] = metric.merge(values.get(key), value)
+        return merged
+
+
+registry = Registry()
+
+requests_total = registry.register(Counter(
+    "requests_total", "Chat completion requests", ("model", "stream")))
+errors_total = registry.register(Counter(
+    "errors_total", "Failed chat completion requests by error class", ("model", "error")))
+in_flight = registry.register(Gauge(
+    "in_flight_requests", "Chat completion requests currently being served", ("model",)))
+upstream_connect_seconds = registry.register(Histogram(
+    "upstream_connect_seconds", "Time from sending the upstream request to its response headers", ("model",)))
+ttft_seconds = registry.register(Histogram(
+    "time_to_first_token_seconds", "Time from request start to the first content delta", ("model",)))
+duration_seconds = registry.register(Histogram(
+    "request_duration_seconds", "Total chat completion duration", ("model", "stream")))
+tokens_per_second = registry.register(Histogram(
+    "tokens_per_second", "Content deltas per second after the first token", ("model",), RATE_BUCKETS))
+chunks_per_second = registry.register(Histogram(
+    "chunks_per_second", "Upstream SSE events per second after the first token", ("model",), RATE_BUCKETS))
+stream_aborts_total = registry.register(Counter(
+    "stream_aborts_total", "Streaming responses cut short by the proxy, by reason", ("reason",)))
+context_compactions_total = registry.register(Counter(
+    "context_compactions_total", "Requests whose messages were compacted before forwarding", ("model", "policy")))
+context_tokens_saved_total = registry.register(Counter(
+    "context_tokens_saved_total", "Prompt tokens removed by context compaction", ("model",)))
+context_bytes_saved_total = registry.register(Counter(
+    "context_bytes_saved_total", "Request body bytes removed by context compaction", ("model",)))
+records_dropped_total = registry.register(Counter(
+    "records_dropped_total", "Capture/audit records dropped because the writer buffer was full", ("writer",)))
+
+
+class RequestMetrics:
+    """一次聊天请求的指标记录器
+
+    热路径上只累加整数，所有直方图在finish时一次写入。
+    """
+
+    __slots__ = ("model", "stream", "start", "first_token", "tokens", "chunks", "finished")
+
+    def __init__(self, model: str, stream: bool):
+        self.model = model
+        self.stream = "true" if stream else "false"
+        self.start = time.perf_counter()
+        self.first_token: Optional[float] = None
+        self.tokens = 0
+        self.chunks = 0
+        self.finished = False
+        requests_total.inc(model, self.stream)
+        in_flight.inc(model)
+
+    def on_batch(self, chunks: int, tokens: int):
+        """记录一批上游事件
+
+        Args:
+            chunks: 本批上游SSE事件数
+            tokens: 本批中带内容的增量数
+        """
+        self.chunks += chunks
+        if tokens:
+            if self.first_token is None:
+                self.first_token = time.perf_counter()
+            self.tokens += tokens
+
+    def finish(self, error: Optional[str] = None):
+        """请求结束时调用，重复调用只记录一次
+
+        Args:
+            error: 错误类别（状态码或异常类型），成功时为None
+        """
+        if self.finished:
+            return
+        self.finished = True
+        now = time.perf_counter()
+        in_flight.dec(self.model)
+        duration_seconds.observe(now - self.start, self.model, self.stream)
+        if error is not None:
+            errors_total.inc(self.model, error)
+        if self.first_token is not None:
+            ttft_seconds.observe(self.first_token - self.start, self.model)
+            generation = now - self.first_token
+            if generation > 0:
+                tokens_per_second.observe(self.tokens / generation, self.model)
+                chunks_per_second.observe(self.chunks / generation, self.model)
+
+
+def observe_upstream_connect(model: str, seconds: float):
+    """记录上游响应头到达的耗时"""
+    upstream_connect_seconds.observe(seconds, model)
+
+
+def observe_context_compaction(model: str, report):
+    """记录一次上下文压缩节省的token数和字节数"""
+    context_compactions_total.inc(model, report.policy)
+    context_tokens_saved_total.inc(model, amount=report.tokens_saved)
+    context_bytes_saved_total.inc(model, amount=report.bytes_saved)
+
+
+def _snapshot_key() -> str:
+    return f"metrics:{os.getpid()}"
+
+
+async def publish_metrics():
+    """把本进程的指标快照写入共享状态，过期时间为上报间隔的3倍"""
+    await state_backend.call("set", _snapshot_key(), registry.snapshot(), ServerConfig.METRICS_PUSH_INTERVAL * 3)
+
+
+async def publish_metrics_forever():
+    """多进程时由每个工作进程在后台定期上报指标"""
+    while True:
+        await asyncio.sleep(ServerConfig.METRICS_PUSH_INTERVAL)
+        try:
+            await publish_metrics()
+        except (OSError, RuntimeError):
+            pass
+
+
+async def render_metrics() -> str:
+    """导出所有指标的Prometheus文本
+
+    单进程时直接导出；多进程时先上报本进程的最新快照，再合并所有工作进程的快照。
+    """
+    if not state_backend.shared:
+        return registry.render()
+    await publish_metrics()
+    snapshots = await state_backend.call("get_prefix", "metrics:")
+    return registry.render(list(snapshots.values()))
+
+
+def error_class(error: BaseException) -> str:
+    """错误类别标签：HTTP异常取状态码，其余取异常类型名"""
+    status_code = getattr(error, "status_code", None)
+    return str(status_code) if status_code is not None else type(error).__name__
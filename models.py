@@ -1,179 +1,249 @@
 # models.py
-# 模型映射和管理模块
-
-# 可用模型列表，兼容OpenAI格式
-AVAILABLE_MODELS = [
-    {
-        "id": "deepseek-r1-70b",
-        "object": "model",
-        "created": 1677610602,
-        "owned_by": "deepseek",
-        "permission": [],
-        "root": "deepseek70b",
-        "parent": None
-    },
-    {
-        "id": "deepseek-r1-turbo",
-        "object": "model",
-        "created": 1677650000,
-        "owned_by": "deepseek",
-        "permission": [],
-        "root": "deepseekr1turbo",
-        "parent": None
-    },
-     {
-        "id": "deepseek-r1-turbo2",
-        "object": "model",
-        "created": 1677650000,
-        "owned_by": "deepseek",
-        "permission": [],
-        "root": "deepseekr1turbo2",
-        "parent": None
-    },
-    {
-        "id": "deepseek-r1-turbo3",
-        "object": "model",
-        "created": 1677650000,
-        "owned_by": "deepseek",
-        "permission": [],
-        "root": "deepseekr1turbo3",
-        "parent": None
-    },
-    {
-        "id": "deepseek-v3-turbo",
-        "object": "model",
-        "created": 1677650100,
-        "owned_by": "deepseek",
-        "permission": [],
-        "root": "deepseekv3turbo",
-        "parent": None
-    },
-    {
-        "id": "deepseek-v3-0324",
-        "object": "model",
-        "created": 1677650200,
-        "owned_by": "deepseek",
-        "permission": [],
-        "root": "deepseekv30324",
-        "parent": None
-    },
-    {
-        "id": "deepseek-v3-03242",
-        "object": "model",
-        "created": 1677650200,
-        "owned_by": "deepseek",
-        "permission": [],
-        "root": "deepseekv303242",
-        "parent": None
-    },
-    {
-        "id": "deepseek-v3-03243",
-        "object": "model",
-        "created": 1677650200,
-        "owned_by": "deepseek",
-        "permission": [],
-        "root": "deepseekv303243",
-        "parent": None
-    },
-    {
-        "id": "deepseek-r1-search",
-        "object": "model",
-        "created": 1677650300,
-        "owned_by": "deepseek",
-        "permission": [],
-        "root": "volcengine",
-        "parent": None
-    },
-    {
-        "id": "grok-3",
-        "object": "model",
-        "created": 1677650400,
-        "owned_by": "xai",
-        "permission": [],
-        "root": "grok3",
-        "parent": None
-    },
-    {
-        "id": "grok-3-search",
-        "object": "model",
-        "created": 1677650500,
-        "owned_by": "xai",
-        "permission": [],
-        "root": "grok3search",
-        "parent": None
-    },
-    {
-        "id": "grok-3-deepsearch",
-        "object": "model",
-        "created": 1677650600,
-        "owned_by": "xai",
-        "permission": [],
-        "root": "grok3deepsearch",
-        "parent": None
-    },
-    {
-        "id": "grok-3-reasoning",
-        "object": "model",
-        "created": 1677650700,
-        "owned_by": "xai",
-        "permission": [],
-        "root": "grok3reasoning",
-        "parent": None
-    },
-    {
-        "id": "qwen-32b",
-        "object": "model",
-        "created": 1677650800,
-        "owned_by": "alibaba",
-        "permission": [],
-        "root": "qwen32b",
-        "parent": None
-    }
+# 模型注册表：声明式的模型定义编译为不区分大小写的别名索引、能力信息和预先序列化的 /v1/models 响应
+
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+
+from config import ModelConfig
+from fast_json import dumps_bytes
+from log_utils import get_logger, log_event
+
+logger = get_logger("models")
+
+# 内置模型定义，每个上游模型一项：
+#   name 为发往上游的模型名称，id 为 /v1/models 中列出的对外名称，aliases 为其他可用的请求名称
+#   context_limit 为上下文token预算；streaming/search/reasoning 为模型能力，未写时分别默认为 true/false/false
+BUILTIN_MODELS = [
+    {"name": "deepseek70b", "id": "deepseek-r1-70b", "owned_by": "deepseek", "created": 1677610602,
+     "context_limit": 32000, "reasoning": True},
+    {"name": "deepseekr1turbo", "id": "deepseek-r1-turbo", "owned_by": "deepseek", "created": 1677650000,
+     "aliases": ["deepseek-ai/DeepSeek-R1-Turbo"], "context_limit": 64000, "reasoning": True},
+    {"name": "deepseekr1turbo2", "id": "deepseek-r1-turbo2", "owned_by": "deepseek", "created": 1677650000,
+     "context_limit": 64000, "reasoning": True},
+    {"name": "deepseekr1turbo3", "id": "deepseek-r1-turbo3", "owned_by": "deepseek", "created": 1677650000,
+     "context_limit": 64000, "reasoning": True},
+    {"name": "deepseekv3turbo", "id": "deepseek-v3-turbo", "owned_by": "deepseek", "created": 1677650100,
+     "aliases": ["deepseek-ai/DeepSeek-V3-Turbo"], "context_limit": 64000},
+    {"name": "deepseekv30324", "id": "deepseek-v3-0324", "owned_by": "deepseek", "created": 1677650200,
+     "context_limit": 64000},
+    {"name": "deepseekv303242", "id": "deepseek-v3-03242", "owned_by": "deepseek", "created": 1677650200,
+     "context_limit": 64000},
+    {"name": "deepseekv303243", "id": "deepseek-v3-03243", "owned_by": "deepseek", "created": 1677650200,
+     "context_limit": 64000},
+    {"name": "volcengine", "id": "deepseek-r1-search", "owned_by": "deepseek", "created": 1677650300,
+     "context_limit": 64000, "search": True, "reasoning": True},
+    {"name": "grok3", "id": "grok-3", "owned_by": "xai", "created": 1677650400,
+     "context_limit": 128000},
+    {"name": "grok3search", "id": "grok-3-search", "owned_by": "xai", "created": 1677650500,
+     "context_limit": 128000, "search": True},
+    {"name": "grok3deepsearch", "id": "grok-3-deepsearch", "owned_by": "xai", "created": 1677650600,
+     "context_limit": 128000, "search": True, "reasoning": True},
+    {"name": "grok3reasoning", "id": "grok-3-reasoning", "owned_by": "xai", "created": 1677650700,
+     "context_limit": 128000, "reasoning": True},
+    {"name": "qwen32b", "id": "qwen-32b", "owned_by": "alibaba", "created": 1677650800,
+     "aliases": ["qwq-32b"], "context_limit": 32000, "reasoning": True},
 ]
 
-# 模型映射
-MODEL_MAPPING = {
-    "deepseek-r1-70b": "deepseek70b",
-    "deepseek-r1-turbo": "deepseekr1turbo",
-    "deepseek-ai/DeepSeek-R1-Turbo": "deepseekr1turbo",
-    "deepseek-ai/DeepSeek-V3-Turbo": "deepseekv3turbo",
-    "deepseek-v3-turbo": "deepseekv3turbo",
-    "deepseek-v3-0324": "deepseekv30324",
-    "deepseek-r1-search": "volcengine",
-    "grok-3": "grok3",
-    "grok-3-search": "grok3search",
-    "grok-3-deepsearch": "grok3deepsearch",
-    "grok-3-reasoning": "grok3reasoning",
-    "qwen-32b": "qwen32b",
-    "qwq-32b": "qwen32b",
-    "deepseek-r1-turbo2": "deepseekr1turbo2",
-    "deepseek-r1-turbo3": "deepseekr1turbo3",
-    "deepseek-v3-03242": "deepseekv303242",
-    "deepseek-v3-03243": "deepseekv303243"
-}
-
-# 默认模型
+# 默认模型（映射后名称）
 DEFAULT_MODEL = "deepseek70b"
 
+# 默认上下文token预算
+DEFAULT_CONTEXT_LIMIT = 32000
+
+# 未知模型名称只记录一次警告，最多记住这么多个
+_MAX_WARNED_NAMES = 1024
+
+
+class ModelSpec:
+    """编译后的一个模型"""
+
+    __slots__ = ("name", "id", "aliases", "owned_by", "created", "context_limit", "streaming", "search", "reasoning")
+
+    def __init__(self, definition: dict):
+        self.name = str(definition["name"])
+        self.id = str(definition.get("id") or self.name)
+        self.aliases = [str(alias) for alias in definition.get("aliases", [])]
+        self.owned_by = str(definition.get("owned_by", "system"))
+        self.created = int(definition.get("created", 0))
+        self.context_limit = int(definition.get("context_limit", DEFAULT_CONTEXT_LIMIT))
+        self.streaming = bool(definition.get("streaming", True))
+        self.search = bool(definition.get("search", False))
+        self.reasoning = bool(definition.get("reasoning", False))
+
+    def as_openai(self) -> dict:
+        """/v1/models 中的一项，兼容OpenAI格式并附带能力信息"""
+        return {
+            "id": self.id,
+            "object": "model",
+            "created": self.created,
+            "owned_by": self.owned_by,
+            "permission": [],
+            "root": self.name,
+            "parent": None,
+            "context_length": self.context_limit,
+            "capabilities": {"streaming": self.streaming, "search": self.search, "reasoning": self.reasoning},
+        }
+
+
+class ModelRegistry:
+    """模型注册表
+
+    定义来自内置列表或 MODELS_FILE（JSON），加载时编译为：
+    - 不区分大小写的别名索引（对外ID、映射后名称、aliases、MODEL_ALIASES），查找是一次字典访问
+    - 预先序列化的 /v1/models 响应体及其ETag
+    MODELS_FILE 按修改时间热加载，内容有误时保留原有注册表并记录警告。
+    """
+
+    def __init__(self, path: str, extra_aliases: str, reload_interval: float, strict: bool):
+        self.path = path
+        self.extra_aliases = extra_aliases
+        self.reload_interval = reload_interval
+        self.strict = strict
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._warned: set = set()
+        self._load()
+
+    def _read_definitions(self):
+        if not self.path:
+            return BUILTIN_MODELS, DEFAULT_MODEL
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, list):
+            return data, None
+        return data.get("models", []), data.get("default")
+
+    def _load(self):
+        if self.path:
+            self._mtime = os.stat(self.path).st_mtime
+        definitions, default = self._read_definitions()
+        self._compile(definitions, default)
+        log_event(logger, logging.INFO, "models_loaded", models=len(self.models), aliases=len(self._by_alias),
+                  source=self.path or "builtin")
+
+    def _compile(self, definitions: List[dict], default: Optional[str]):
+        models = [ModelSpec(definition) for definition in definitions]
+        if not models:
+            raise ValueError("model registry is empty")
+        by_name = {spec.name: spec for spec in models}
+        by_alias: Dict[str, ModelSpec] = {}
+
+        def index(alias: str, spec: ModelSpec):
+            key = alias.casefold()
+            existing = by_alias.setdefault(key, spec)
+            if existing is not spec:
+                log_event(logger, logging.WARNING, "model_alias_conflict", alias=alias,
+                          kept=existing.name, ignored=spec.name)
+
+        for spec in models:
+            for alias in (spec.id, spec.name, *spec.aliases):
+                index(alias, spec)
+        for item in filter(None, (part.strip() for part in self.extra_aliases.split(","))):
+            alias, _, target = item.partition("=")
+            spec = by_alias.get(target.strip().casefold())
+            if spec is None:
+                log_event(logger, logging.WARNING, "model_alias_unknown_target", alias=alias, target=target)
+            else:
+                index(alias.strip(), spec)
+
+        default_spec = by_name.get(default or DEFAULT_MODEL) or models[0]
+        body = dumps_bytes({"object": "list", "data": [spec.as_openai() for spec in models]})
+
+        # 一次性替换，查找时不会看到编译到一半的状态
+        self.models = models
+        self.default = default_spec
+        self._by_name = by_name
+        self._by_alias = by_alias
+        self.models_body = body
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+    def maybe_reload(self):
+        """距上次检查超过reload_interval时检查模型文件的修改时间"""
+        if not self.path:
+            return
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        try:
+            if os.stat(self.path).st_mtime != self._mtime:
+                self._load()
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            log_event(logger, logging.WARNING, "models_reload_failed", path=self.path, error=str(e))
+
+    def find(self, name: Optional[str]) -> Optional[ModelSpec]:
+        """按名称或别名查找模型（不区分大小写），找不到时返回None"""
+        self.maybe_reload()
+        if not name:
+            return None
+        return self._by_alias.get(name.casefold())
+
+    def resolve(self, name: Optional[str]) -> ModelSpec:
+        """把请求中的模型名称解析为模型
+
+        未指定时使用默认模型；未知名称在 MODELS_STRICT 开启时返回404，否则回退到默认模型并记录一次警告。
+
+        Raises:
+            HTTPException: 严格模式下模型不存在
+        """
+        if not name:
+            self.maybe_reload()
+            return self.default
+        spec = self.find(name)
+        if spec is not None:
+            return spec
+        if self.strict:
+            raise HTTPException(status_code=404, detail=f"The model '{name}' does not exist")
+        if name not in self._warned and len(self._warned) < _MAX_WARNED_NAMES:
+            self._warned.add(name)
+            log_event(logger, logging.WARNING, "model_unknown_fallback", model=name, fallback=self.default.name)
+        return self.default
+
+    def spec(self, mapped_model: str) -> Optional[ModelSpec]:
+        """按映射后名称取模型"""
+        return self._by_name.get(mapped_model)
+
+
+# 全局模型注册表
+model_registry = ModelRegistry(ModelConfig.FILE, ModelConfig.ALIASES, ModelConfig.RELOAD_INTERVAL,
+                               ModelConfig.STRICT)
+
 
 def get_model_list():
     """获取所有可用模型列表，兼容OpenAI格式"""
+    model_registry.maybe_reload()
     return {
         "object": "list",
-        "data": AVAILABLE_MODELS
+        "data": [spec.as_openai() for spec in model_registry.models]
     }
 
 
 def map_model_name(model_name):
     """将请求中的模型名称映射到内部使用的模型名称
-    
+
     Args:
         model_name: 请求中指定的模型名称
-        
+
     Returns:
         映射后的内部模型名称
     """
-    if not model_name:
-        return DEFAULT_MODEL
-        
-    return MODEL_MAPPING.get(model_name, DEFAULT_MODEL)
+    return model_registry.resolve(model_name).name
+
+
+def get_context_limit(mapped_model):
+    """获取映射后模型的上下文token预算
+
+    Args:
+        mapped_model: 映射后的内部模型名称
+
+    Returns:
+        上下文token预算
+    """
+    spec = model_registry.spec(mapped_model)
+    return spec.context_limit if spec is not None else DEFAULT_CONTEXT_LIMIT
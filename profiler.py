@@ -0,0 +1,90 @@
+# profiler.py
+# 采样性能剖析：后台线程定期抓取事件循环线程的调用栈，输出可直接用于火焰图的折叠栈格式
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+# 同一时间只允许一次剖析
+_lock = asyncio.Lock()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """对指定线程做定时栈采样
+
+    采样在独立线程中进行，被剖析的事件循环不需要做任何配合；
+    事件循环空闲时的栈停在selector上，火焰图中对应的宽度就是空闲时间。
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        """
+        Args:
+            thread_id: 被采样线程的ident
+            interval: 采样间隔（秒）
+        """
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        labels = []
+        while frame is not None:
+            labels.append(_frame_label(frame))
+            frame = frame.f_back
+        labels.reverse()
+        self.stacks[";".join(labels)] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="rkui2api-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def folded(self) -> str:
+        """折叠栈格式，每行 "帧;帧;帧 次数"，可直接交给flamegraph.pl或speedscope"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+async def profile_event_loop(seconds: float, interval: float) -> SamplingProfiler:
+    """对当前事件循环所在线程采样seconds秒
+
+    Raises:
+        RuntimeError: 已有剖析在进行
+    """
+    if _lock.locked():
+        raise RuntimeError("A profile is already running")
+    async with _lock:
+        profiler = SamplingProfiler(threading.get_ident(), interval)
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            # join最多等待一个采样间隔
+            profiler.stop()
+        profiler.duration = time.perf_counter() - started
+        return profiler
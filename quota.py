@@ -0,0 +1,71 @@
+# quota.py
+# 按密钥的请求数/token数配额，使用滑动窗口计数，多进程时计数保存在共享状态服务中
+
+import logging
+import math
+
+from fastapi import HTTPException
+
+from auth import ApiKey
+from config import AuthConfig
+from log_utils import get_logger, log_event
+from state import state_backend
+
+logger = get_logger("quota")
+
+
+class QuotaManager:
+    """滑动窗口配额
+
+    每个密钥每种配额只保存当前和上一个固定窗口的计数，按上一个窗口的剩余比例加权估算，
+    每次检查只需一次状态后端调用。
+    """
+
+    def __init__(self, backend, window: float):
+        self.backend = backend
+        self.window = window
+        self.rejected = 0
+
+    def tracks_tokens(self, key: ApiKey) -> bool:
+        return key.tokens > 0
+
+    async def admit(self, key: ApiKey, prompt_tokens: int = 0):
+        """请求开始前检查并计入请求数和提示词token数
+
+        Raises:
+            HTTPException: 超出配额时返回429并附带Retry-After
+        """
+        if key.requests > 0:
+            await self._add(key, "requests", 1, key.requests)
+        if key.tokens > 0:
+            await self._add(key, "tokens", prompt_tokens, key.tokens)
+
+    async def charge(self, key: ApiKey, completion_tokens: int):
+        """请求结束后计入补全token数，不再拒绝"""
+        if key.tokens > 0 and completion_tokens:
+            await self.backend.call("window_add", f"quota:{key.name}:tokens", self.window, completion_tokens, 0)
+
+    async def _add(self, key: ApiKey, kind: str, amount: int, limit: int):
+        allowed, used, retry_after = await self.backend.call(
+            "window_add", f"quota:{key.name}:{kind}", self.window, amount, limit)
+        if allowed:
+            return
+        self.rejected += 1
+        log_event(logger, logging.INFO, "quota_exceeded", key=key.name, kind=kind, used=int(used), limit=limit)
+        raise HTTPException(
+            status_code=429,
+            detail=f"Quota exceeded: {kind} per {self.window:g}s",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+    async def usage(self, key: ApiKey) -> dict:
+        """当前窗口内的估算用量"""
+        result = {"key": key.name, "window": self.window}
+        for kind, limit in (("requests", key.requests), ("tokens", key.tokens)):
+            _, used, _ = await self.backend.call("window_add", f"quota:{key.name}:{kind}", self.window, 0, 0)
+            result[kind] = {"used": round(used, 1), "limit": limit}
+        return result
+
+
+# 全局配额管理器
+quotas = QuotaManager(state_backend, AuthConfig.QUOTA_WINDOW)
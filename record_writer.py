@@ -0,0 +1,160 @@
+# record_writer.py
+# 后台记录写入器：请求路径只把记录放进有界缓冲区，由后台线程批量序列化、压缩并写入按大小轮转的文件，
+# 缓冲区满时丢弃并计数，不阻塞事件循环
+
+import gzip
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+from fast_json import dumps_bytes
+from log_utils import get_logger, log_event, elapsed_ms
+from metrics import records_dropped_total
+
+logger = get_logger("record_writer")
+
+
+class RecordWriter:
+    """把字典记录以JSONL追加到文件
+
+    submit()只在事件循环线程上做一次加锁的deque追加；序列化、gzip压缩和文件I/O都在后台线程中进行，
+    每flush_interval秒或攒够batch_size条时写一批。文件超过max_bytes时按 path.1、path.2 ... 轮转，
+    最多保留backups个旧文件。
+    """
+
+    def __init__(self, name: str, path: str, max_records: int, batch_size: int = 256,
+                 flush_interval: float = 1.0, max_bytes: int = 0, backups: int = 5,
+                 compress: Optional[bool] = None, transform: Optional[Callable[[dict], Optional[dict]]] = None):
+        """
+        Args:
+            name: 写入器名称，用于日志和指标标签
+            path: 输出文件路径
+            max_records: 缓冲区最多容纳的记录数，超过时丢弃新记录
+            batch_size: 攒够多少条立即写一批
+            flush_interval: 最长多久写一批（秒）
+            max_bytes: 单个文件的大小上限，0表示不轮转
+            backups: 轮转时保留的旧文件数
+            compress: 是否gzip压缩，None时按path是否以.gz结尾判断
+            transform: 写入前在后台线程中对每条记录调用（例如脱敏），返回None时跳过该记录
+        """
+        self.name = name
+        self.path = path
+        self.max_records = max_records
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.compress = path.endswith(".gz") if compress is None else compress
+        self.transform = transform
+        self.written = 0
+        self.dropped = 0
+        self._buffer: deque = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._file = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """启动后台写入线程"""
+        if self._thread is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name=f"rkui2api-{self.name}-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, record: dict) -> bool:
+        """提交一条记录，缓冲区已满或写入器已关闭时丢弃并返回False
+
+        提交后调用方不应再修改该记录。
+        """
+        with self._condition:
+            if self._closed or len(self._buffer) >= self.max_records:
+                self.dropped += 1
+                records_dropped_total.inc(self.name)
+                return False
+            self._buffer.append(record)
+            if len(self._buffer) >= self.batch_size:
+                self._condition.notify()
+        return True
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if len(self._buffer) < self.batch_size and not self._closed:
+                    self._condition.wait(self.flush_interval)
+                batch, self._buffer = self._buffer, deque()
+                closed = self._closed
+            if batch:
+                self._write(batch)
+            if closed:
+                break
+        self._close_file()
+
+    def _write(self, batch):
+        if self.transform is not None:
+            batch = [record for record in map(self.transform, batch) if record is not None]
+            if not batch:
+                return
+        data = b"".join(dumps_bytes(record) + b"\n" for record in batch)
+        try:
+            if self._file is None:
+                self._open()
+            self._file.write(data)
+            self._file.flush()
+            self.written += len(batch)
+            if self.max_bytes and self._size() >= self.max_bytes:
+                self._rotate()
+        except OSError as e:
+            log_event(logger, logging.ERROR, "record_write_failed", writer=self.name, path=self.path,
+                      records=len(batch), error=str(e))
+            self._close_file()
+
+    def _open(self):
+        self._file = gzip.open(self.path, "ab") if self.compress else open(self.path, "ab")
+
+    def _size(self) -> int:
+        # gzip文件对象的tell()是解压后的偏移，轮转按磁盘上的大小计算
+        return os.path.getsize(self.path)
+
+    def _close_file(self):
+        if self._file is not None:
+            file, self._file = self._file, None
+            try:
+                file.close()
+            except OSError:
+                pass
+
+    def _rotate(self):
+        self._close_file()
+        for index in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def close(self, timeout: float = 10):
+        """停止接收新记录，写完缓冲区中剩余的记录后关闭文件"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread is not None:
+            started = time.perf_counter()
+            self._thread.join(timeout)
+            log_event(logger, logging.INFO, "record_writer_closed", writer=self.name, written=self.written,
+                      dropped=self.dropped, pending=len(self._buffer),
+                      close_ms=elapsed_ms(started))
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "written": self.written,
+            "dropped": self.dropped,
+            "pending": len(self._buffer),
+        }
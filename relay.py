@@ -0,0 +1,147 @@
+# relay.py
+# 流式转发模块：上游读取与客户端写出之间的有界缓冲，客户端断开或读取过慢时立即取消上游读取
+
+import asyncio
+import logging
+from collections import deque
+from typing import Optional
+
+import anyio
+from fastapi import HTTPException, Request
+
+from config import StreamConfig
+from log_utils import get_logger, log_event
+from metrics import stream_aborts_total
+
+logger = get_logger("relay")
+
+
+def _spec_version(request: Request) -> tuple:
+    version = request.scope.get("asgi", {}).get("spec_version", "2.0")
+    return tuple(int(part) for part in version.split("."))
+
+
+class StreamRelay:
+    """在独立任务中读取SSE帧，经过有界缓冲交给客户端
+
+    - 缓冲区中的内容超过max_size时暂停读取上游，慢客户端的压力传导到上游而不是堆积在内存中；
+      持续满载超过stall_timeout时断开该客户端并释放上游连接
+    - 客户端写出比上游慢时，把缓冲区中积累的帧合并成一次写出
+    - 客户端断开时取消读取任务，上游连接和并发名额在读取任务中归还，
+      不受Starlette取消作用域的影响
+    - ASGI spec_version>=2.4 时Starlette不再监听断开消息，由本类自行监听
+    """
+
+    def __init__(self, frames, request: Optional[Request] = None, max_size: int = 65536,
+                 stall_timeout: float = 0):
+        """
+        Args:
+            frames: 产生SSE文本的异步生成器，结束或被取消时负责清理上游资源
+            request: 客户端请求，用于监听断开
+            max_size: 缓冲区上限（字符数）
+            stall_timeout: 缓冲区满载的最长等待时间（秒），0表示一直等待
+        """
+        self._frames = frames
+        self._request = request
+        self._max_size = max_size
+        self._stall_timeout = stall_timeout or None
+        self._buffer: deque = deque()
+        self._size = 0
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self._finished = False
+        self._error: Optional[BaseException] = None
+        self._task: Optional[asyncio.Task] = None
+        self._aborted = False
+
+    def _finish(self, error: Optional[BaseException] = None):
+        if not self._finished:
+            self._finished = True
+            self._error = error
+            self._readable.set()
+
+    def abort(self, reason: str):
+        """中止转发：取消上游读取，客户端取完已缓冲的帧后结束"""
+        if self._task is not None and not self._task.done() and not self._aborted:
+            self._aborted = True
+            stream_aborts_total.inc(reason)
+            log_event(logger, logging.INFO, "stream_aborted", reason=reason)
+            self._task.cancel()
+
+    async def _produce(self):
+        error = None
+        try:
+            async for frame in self._frames:
+                while self._size >= self._max_size:
+                    self._writable.clear()
+                    try:
+                        await asyncio.wait_for(self._writable.wait(), self._stall_timeout)
+                    except asyncio.TimeoutError:
+                        stream_aborts_total.inc("slow_client")
+                        log_event(logger, logging.WARNING, "stream_aborted", reason="slow_client",
+                                  buffered=self._size)
+                        raise HTTPException(status_code=504, detail="Stream consumer too slow")
+                self._buffer.append(frame)
+                self._size += len(frame)
+                self._readable.set()
+        except asyncio.CancelledError:
+            pass
+        except BaseException as e:
+            error = e
+        finally:
+            # 生成器在这里关闭，其finally中归还上游连接
+            await self._frames.aclose()
+            self._finish(error)
+
+    async def _watch_disconnect(self):
+        while True:
+            message = await self._request.receive()
+            if message["type"] == "http.disconnect":
+                self.abort("disconnect")
+                return
+
+    async def iterate(self):
+        """产出写给客户端的数据块"""
+        self._task = asyncio.create_task(self._produce())
+        watcher = None
+        if self._request is not None and _spec_version(self._request) >= (2, 4):
+            watcher = asyncio.create_task(self._watch_disconnect())
+        try:
+            while True:
+                if self._buffer:
+                    if len(self._buffer) == 1:
+                        chunk = self._buffer.popleft()
+                    else:
+                        chunk = "".join(self._buffer)
+                        self._buffer.clear()
+                    self._size = 0
+                    self._writable.set()
+                    yield chunk
+                    continue
+                if self._finished:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                self._readable.clear()
+                await self._readable.wait()
+        except asyncio.CancelledError:
+            # 客户端断开时Starlette取消写出任务
+            self.abort("disconnect")
+            raise
+        finally:
+            # 已中止时读取任务正在清理，不能再次取消
+            if not self._aborted:
+                self._task.cancel()
+            if watcher is not None:
+                watcher.cancel()
+            # 调用方可能处于已取消的作用域中，等待清理完成需要屏蔽取消
+            with anyio.CancelScope(shield=True):
+                await asyncio.gather(self._task, *([watcher] if watcher else []), return_exceptions=True)
+
+
+def relay_stream(frames, request: Optional[Request] = None):
+    """按StreamConfig为SSE帧生成器加上有界缓冲和断开检测，关闭时原样返回"""
+    if not StreamConfig.RELAY_ENABLED:
+        return frames
+    return StreamRelay(frames, request, StreamConfig.BUFFER_SIZE, StreamConfig.SLOW_CLIENT_TIMEOUT).iterate()
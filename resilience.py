@@ -0,0 +1,287 @@
+# resilience.py
+# 上游容错模块：首字节前的有限重试、非流式请求的对冲请求、按模型的熔断器
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+
+import httpx
+from fastapi import HTTPException
+
+from config import ResilienceConfig
+from log_utils import get_logger, log_event
+
+logger = get_logger("resilience")
+
+# 可以重试的上游状态码
+RETRYABLE_STATUS = frozenset({500, 502, 503, 504})
+
+Opener = Callable[[], Awaitable[AsyncIterator]]
+
+
+def is_retryable(error: BaseException) -> bool:
+    """判断打开上游流时的错误是否可以重试
+
+    连接/传输层错误和上游5xx可以重试；调度器的429、上游4xx等不重试。
+    """
+    if isinstance(error, httpx.TransportError):
+        return True
+    if isinstance(error, HTTPException):
+        return error.status_code in RETRYABLE_STATUS
+    return False
+
+
+class CircuitBreaker:
+    """单个模型的熔断器
+
+    连续失败达到阈值后打开，冷却期内直接返回503；
+    冷却期结束后进入半开状态，只放行一个探测请求，成功则关闭，失败则重新打开。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, model: str, failure_threshold: int, cooldown: float):
+        """
+        Args:
+            model: 映射后的模型名称
+            failure_threshold: 打开熔断器的连续失败次数
+            cooldown: 打开后到允许探测的时间（秒）
+        """
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def check(self):
+        """请求发出前调用，熔断器打开时抛出503"""
+        if self.state == self.CLOSED:
+            return
+        remaining = self.opened_at + self.cooldown - time.monotonic()
+        if self.state == self.OPEN and remaining <= 0:
+            self.state = self.HALF_OPEN
+            self._probing = False
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return
+        raise HTTPException(
+            status_code=503,
+            detail=f"Upstream model {self.model} is unavailable",
+            headers={"Retry-After": str(max(1, int(remaining + 0.999)))},
+        )
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            log_event(logger, logging.INFO, "breaker_closed", model=self.model)
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                log_event(logger, logging.WARNING, "breaker_opened", model=self.model, failures=self.failures)
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+    def release_probe(self):
+        """探测请求以非上游原因结束（如被取消）时，允许下一个请求继续探测"""
+        self._probing = False
+
+
+class LatencyWindow:
+    """记录最近若干次首字节耗时，用于计算对冲阈值"""
+
+    def __init__(self, size: int):
+        self._samples: deque = deque(maxlen=size)
+
+    def add(self, value: float):
+        self._samples.append(value)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Resilience:
+    """组合重试、对冲和熔断，包装一个打开上游事件流的协程函数"""
+
+    def __init__(self, config=ResilienceConfig):
+        self.config = config
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._first_byte: Dict[str, LatencyWindow] = {}
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.short_circuited = 0
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        breaker = self._breakers.get(model)
+        if breaker is None:
+            breaker = CircuitBreaker(model, self.config.BREAKER_FAILURES, self.config.BREAKER_COOLDOWN)
+            self._breakers[model] = breaker
+        return breaker
+
+    async def open(self, opener: Opener, model: str) -> AsyncIterator:
+        """打开上游流，可重试的错误按带抖动的指数退避重试
+
+        只覆盖到上游响应头到达为止，此时尚未向客户端发送任何字节，重试是安全的。
+
+        Args:
+            opener: 打开上游流的协程函数
+            model: 映射后的模型名称
+
+        Returns:
+            opener返回的事件批次迭代器
+        """
+        attempt = 0
+        while True:
+            breaker = self.breaker(model) if self.config.BREAKER_ENABLED else None
+            if breaker is not None:
+                try:
+                    breaker.check()
+                except HTTPException:
+                    self.short_circuited += 1
+                    raise
+
+            try:
+                batches = await opener()
+            except BaseException as e:
+                if breaker is not None:
+                    if is_retryable(e):
+                        breaker.record_failure()
+                    else:
+                        breaker.release_probe()
+                if not is_retryable(e) or attempt >= self.config.RETRY_ATTEMPTS:
+                    raise
+                attempt += 1
+                self.retries += 1
+                delay = self._backoff(attempt)
+                log_event(logger, logging.WARNING, "upstream_retry", model=model, attempt=attempt,
+                          error=type(e).__name__, delay=round(delay, 3))
+                await asyncio.sleep(delay)
+                continue
+
+            if breaker is not None:
+                breaker.record_success()
+            return batches
+
+    async def open_hedged(self, opener: Opener, model: str) -> AsyncIterator:
+        """打开上游流并等待第一批事件，超过阈值仍未到达时再发一个相同的请求
+
+        只用于非流式请求：两路请求谁先产出第一批事件就用谁，另一路立即取消。
+
+        Args:
+            opener: 打开上游流的协程函数
+            model: 映射后的模型名称
+
+        Returns:
+            从第一批事件开始的事件批次迭代器
+        """
+        start = time.monotonic()
+        primary = asyncio.create_task(self._first_batch(opener, model))
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=self._hedge_delay(model))
+            if not done:
+                self.hedges += 1
+                log_event(logger, logging.INFO, "upstream_hedge", model=model)
+                pending.add(asyncio.create_task(self._first_batch(opener, model)))
+
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in done if not task.exception()), None)
+                if winner is not None or not pending:
+                    break
+            if winner is None:
+                # 所有请求都失败，抛出第一个请求的错误（即使它比对冲请求先失败）
+                raise primary.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+            for task in pending:
+                await _discard(task)
+
+        # 其他已完成的请求也要关闭
+        for task in done:
+            if task is not winner and not task.exception():
+                await task.result()[1].aclose()
+
+        if winner is not primary:
+            self.hedge_wins += 1
+        self._first_byte.setdefault(model, LatencyWindow(self.config.HEDGE_WINDOW)).add(time.monotonic() - start)
+        first, batches = winner.result()
+        return _prepend(first, batches)
+
+    async def _first_batch(self, opener: Opener, model: str):
+        """打开上游流并读取第一批事件，返回(第一批事件或None, 迭代器)"""
+        batches = await self.open(opener, model)
+        try:
+            return await batches.__anext__(), batches
+        except StopAsyncIteration:
+            return None, batches
+        except BaseException:
+            await batches.aclose()
+            raise
+
+    def _hedge_delay(self, model: str) -> float:
+        """对冲阈值：样本足够时取首字节耗时的p95，否则使用下限"""
+        window = self._first_byte.get(model)
+        if window is None or len(window) < self.config.HEDGE_MIN_SAMPLES:
+            return self.config.HEDGE_MIN_DELAY
+        return max(self.config.HEDGE_MIN_DELAY, window.quantile(self.config.HEDGE_QUANTILE))
+
+    def _backoff(self, attempt: int) -> float:
+        """指数退避加全抖动"""
+        ceiling = min(self.config.RETRY_BACKOFF_MAX, self.config.RETRY_BACKOFF_BASE * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+    def stats(self) -> dict:
+        return {
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "short_circuited": self.short_circuited,
+            "breakers": {
+                model: {"state": breaker.state, "failures": breaker.failures}
+                for model, breaker in self._breakers.items()
+            },
+        }
+
+
+async def _prepend(first, batches):
+    """先产出已读取的第一批事件，再继续产出剩余批次"""
+    try:
+        if first is not None:
+            yield first
+        async for events in batches:
+            yield events
+    finally:
+        await batches.aclose()
+
+
+async def _discard(task: asyncio.Task):
+    """等待被取消的对冲请求结束，并关闭其已经打开的上游流"""
+    try:
+        _, batches = await task
+    except BaseException:
+        return
+    await batches.aclose()
+
+
+# 全局容错实例
+resilience = Resilience()
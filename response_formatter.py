@@ -4,37 +4,50 @@
 import time
 import uuid
 
+from fast_json import dumps as _dumps
 
-def format_openai_response(content, model="deepseek70b"):
+# 流式响应的结束标记
+STREAM_DONE = "data: [DONE]\n\n"
+
+
+def new_response_id():
+    """生成OpenAI风格的响应ID"""
+    return f"chatcmpl-{uuid.uuid4().hex[:10]}"
+
+
+def format_openai_response(content, model="deepseek70b", usage=None):
     """将内容格式化为OpenAI兼容的响应格式
     
     Args:
-        content: 响应内容
+        content: 响应内容，传入列表时每项为一个选项（请求中n>1）
         model: 使用的模型名称
+        usage: 用量字典（prompt_tokens/completion_tokens/total_tokens），默认全为0
         
     Returns:
         OpenAI格式的响应对象
     """
     # 生成唯一的响应ID
-    response_id = f"chatcmpl-{uuid.uuid4().hex[:10]}"
+    response_id = new_response_id()
     
     # 获取当前时间戳
     created_timestamp = int(time.time())
     
+    contents = content if isinstance(content, list) else [content]
+    
     return {
         "id": response_id,
         "object": "chat.completion",
         "created": created_timestamp,
         "model": model,  # 添加模型信息
         "choices": [{
-            "index": 0,
+            "index": index,
             "message": {
                 "role": "assistant",
-                "content": content
+                "content": text
             },
             "finish_reason": "stop"
-        }],
-        "usage": {
+        } for index, text in enumerate(contents)],
+        "usage": usage or {
             "prompt_tokens": 0,
             "completion_tokens": 0,
             "total_tokens": 0
@@ -42,7 +55,8 @@ def format_openai_response(content, model="deepseek70b"):
     }
 
 
-def format_openai_stream_chunk(content, model="deepseek70b", is_first_chunk=False, is_last_chunk=False):
+def format_openai_stream_chunk(content, model="deepseek70b", is_first_chunk=False, is_last_chunk=False,
+                               response_id=None, created=None):
     """格式化流式响应的单个数据块为OpenAI兼容格式
     
     Args:
@@ -50,16 +64,17 @@ def format_openai_stream_chunk(content, model="deepseek70b", is_first_chunk=Fals
         model: 使用的模型名称
         is_first_chunk: 是否为第一个数据块
         is_last_chunk: 是否为最后一个数据块
+        response_id: 响应ID，同一流式响应的所有数据块应传入同一个值
+        created: 创建时间戳，同一流式响应应保持一致
         
     Returns:
         OpenAI格式的流式响应数据块
     """
-    # 生成唯一的响应ID（对于同一流式响应，ID应保持一致）
-    # 在实际应用中，应该在外部生成并传入
-    response_id = f"chatcmpl-{uuid.uuid4().hex[:10]}"
+    # 同一流式响应的ID和时间戳应保持一致，未传入时才重新生成
+    if response_id is None:
+        response_id = new_response_id()
     
-    # 获取当前时间戳
-    created_timestamp = int(time.time())
+    created_timestamp = int(time.time()) if created is None else created
     
     response = {
         "id": response_id,
@@ -87,4 +102,89 @@ def format_openai_stream_chunk(content, model="deepseek70b", is_first_chunk=Fals
     else:
         response["choices"][0]["delta"] = {"content": content}
     
-    return response
\ No newline at end of file
+    return response
+
+
+class StreamChunkFramer:
+    """把增量内容编码为 chat.completion.chunk 的SSE帧
+    
+    一个实例对应一个流式响应：id和created只生成一次，
+    帧的公共前缀/后缀预先序列化好，每个token只需对delta做一次小的JSON编码。
+    输出与 format_openai_stream_chunk 的结构一致。
+    """
+    
+    def __init__(self, model="deepseek70b", response_id=None, created=None, index=0):
+        """
+        Args:
+            model: 使用的模型名称
+            response_id: 响应ID，默认自动生成
+            created: 创建时间戳，默认当前时间
+            index: 选项序号
+        """
+        self.model = model
+        self.response_id = response_id or new_response_id()
+        self.created = int(time.time()) if created is None else created
+        self.index = index
+        
+        head = _dumps({
+            "id": self.response_id,
+            "object": "chat.completion.chunk",
+            "created": self.created,
+            "model": model,
+        })
+        self._head = f"data: {head}"
+        self._prefix = f'data: {head[:-1]},"choices":[{{"index":{index},"delta":'
+        self._suffix = ',"finish_reason":null}]}\n\n'
+    
+    def role(self):
+        """第一个数据块：声明assistant角色"""
+        return f'{self._prefix}{{"role":"assistant","content":""}}{self._suffix}'
+    
+    def delta(self, content=None, reasoning_content=None):
+        """中间数据块：只包含增量内容
+        
+        Args:
+            content: 增量正文
+            reasoning_content: 增量推理内容（上游提供时透传）
+        """
+        if reasoning_content is None:
+            return f'{self._prefix}{{"content":{_dumps(content or "")}}}{self._suffix}'
+        body = {"reasoning_content": reasoning_content}
+        if content:
+            body["content"] = content
+        return f"{self._prefix}{_dumps(body)}{self._suffix}"
+    
+    def finish(self, finish_reason="stop"):
+        """最后一个数据块：空delta并带上完成原因"""
+        return f'{self._prefix}{{}},"finish_reason":{_dumps(finish_reason)}}}]}}\n\n'
+    
+    def usage(self, usage):
+        """用量数据块（stream_options.include_usage）：choices为空，只携带usage
+        
+        Args:
+            usage: 用量字典
+        """
+        return f'{self._head[:-1]},"choices":[],"usage":{_dumps(usage)}}}\n\n'
+
+
+async def iter_openai_stream(content, model="deepseek70b", piece_size=256, usage=None):
+    """把一段完整内容重放为OpenAI格式的SSE流（用于缓存命中的流式请求）
+    
+    Args:
+        content: 完整回答内容
+        model: 使用的模型名称
+        piece_size: 每个增量数据块包含的字符数
+        usage: 不为None时（已累计补全token的usage.Usage）在[DONE]之前发送用量数据块
+        
+    Yields:
+        SSE帧文本
+    """
+    framer = StreamChunkFramer(model=model)
+    yield framer.role()
+    for i in range(0, len(content), piece_size):
+        yield framer.delta(content[i:i + piece_size])
+    yield framer.finish("stop")
+    if usage is not None:
+        yield framer.usage(usage.as_dict())
+    yield STREAM_DONE
+
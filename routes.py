@@ -1,53 +1,218 @@
 # routes.py
 # 路由模块，处理所有API路由
 
-from fastapi import APIRouter, Request, HTTPException
-from fastapi.responses import JSONResponse, StreamingResponse
-from auth import require_auth
+from typing import Optional
 
-from models import get_model_list, map_model_name
-from api_client import call_api
-from response_formatter import format_openai_response
+from fastapi import APIRouter, Depends, Request, HTTPException
+from fastapi.responses import StreamingResponse, PlainTextResponse, Response
+from auth import ApiKey, authenticate, require_admin
+from quota import quotas
+
+from models import model_registry
+from api_client import call_api, call_api_choices, sse_response
+from completions import prepare_chat, complete_chat, replay_cached
+from cache import response_cache
+from scheduler import scheduler, set_client_key
+from resilience import resilience
+from upstreams import upstream_pool
+from metrics import error_class, render_metrics
+from batch import parse_batch, batch_id_for, run_batch
+from relay import relay_stream
+from fast_json import FastJSONResponse, loads as json_loads, JSONDecodeError
+from config import BatchConfig, TraceConfig
+from tracing import span, trace_recorder
+from capture import start_capture
 
 # 创建路由器
 router = APIRouter()
 
 
 @router.get("/v1/models")
-async def list_models():
-    """获取可用模型列表，兼容OpenAI格式"""
-    return JSONResponse(content=get_model_list())
+async def list_models(request: Request):
+    """获取可用模型列表，兼容OpenAI格式
+    
+    响应体在加载模型注册表时预先序列化，客户端带 If-None-Match 轮询时未变化则返回304。
+    """
+    model_registry.maybe_reload()
+    headers = {"ETag": model_registry.etag, "Cache-Control": "public, max-age=60"}
+    if request.headers.get("if-none-match") == model_registry.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=model_registry.models_body, media_type="application/json", headers=headers)
 
 
 @router.post("/v1/chat/completions")
-@require_auth
-async def chat_completions(request: Request):
+async def chat_completions(request: Request, api_key: ApiKey = Depends(authenticate)):
     """处理聊天完成请求，兼容OpenAI格式"""
+    chat = None
+    capture = None
     try:
+        # 按API密钥区分客户端，供调度器在密钥之间公平排队
+        set_client_key(api_key.name)
+        
         # 获取请求体
-        body = await request.json()
+        try:
+            with span("parse_body"):
+                raw_body = await request.body()
+                body = json_loads(raw_body)
+        except JSONDecodeError:
+            raise HTTPException(status_code=400, detail="Invalid JSON body")
         
-        # 获取并映射模型名称
-        model_name = body.get("model")
-        mapped_model = map_model_name(model_name)
+        # 解析模型、压缩上下文、检查配额并查询缓存，客户端可通过 Cache-Control: no-cache 跳过缓存
+        is_stream = bool(body.get("stream", False))
+        use_cache = "no-cache" not in request.headers.get("cache-control", "")
+        chat = await prepare_chat(body, api_key, stream=is_stream, use_cache=use_cache, request=request)
         
-        # 构造转发请求体
-        payload = {
-            "messages": body.get("messages", []),
-            "model": mapped_model
-        }
+        if is_stream and chat.cached is not None:
+            # 缓存命中的流式请求以SSE形式重放
+            await chat.charge([chat.cached])
+            response = sse_response(replay_cached(chat), request)
+            chat.set_headers(response)
+            return response
         
-        # 检查是否是流式请求
-        is_stream = body.get("stream", False)
+        # 录制发往上游的请求（CAPTURE_ENABLED），缓存命中和n>1的请求不录制
+        if chat.cached is None and chat.n == 1:
+            capture = start_capture(api_key.name, body, len(raw_body), chat.model, is_stream)
         
         # 调用API
         if is_stream:
-            # 流式响应直接返回
-            return await call_api(payload, is_stream=True)
+            # 流式响应直接返回，正常结束后写入缓存
+            async def finish_stream():
+                if quotas.tracks_tokens(api_key):
+                    await quotas.charge(api_key, chat.usage.completion_tokens)
+                if capture is not None:
+                    capture.finish(200)
+            
+            needs_finish = quotas.tracks_tokens(api_key) or capture is not None
+            if chat.n > 1:
+                response = await call_api_choices(chat.payload, chat.n, is_stream=True, tracker=chat.tracker,
+                                                  usage=chat.usage, send_usage=chat.include_usage,
+                                                  on_finish=finish_stream if needs_finish else None,
+                                                  request=request)
+            else:
+                response = await call_api(chat.payload, is_stream=True,
+                                          on_complete=chat.store if chat.cache_key else None,
+                                          tracker=chat.tracker, usage=chat.usage, send_usage=chat.include_usage,
+                                          on_finish=finish_stream if needs_finish else None,
+                                          request=request)
         else:
-            # 非流式响应需要格式化
-            content = await call_api(payload, is_stream=False)
-            return format_openai_response(content, model=mapped_model)
+            # 非流式响应与批量请求共用同一流程，n>1时有n个choices
+            response = FastJSONResponse(content=await complete_chat(chat))
+            if capture is not None:
+                capture.finish(200)
+        
+        chat.set_headers(response)
+        return response
             
+    except HTTPException as e:
+        if chat is not None:
+            chat.tracker.finish(error_class(e))
+        if capture is not None:
+            capture.finish(e.status_code)
+        # 保留上游状态码以及429的Retry-After等响应头
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        if chat is not None:
+            chat.tracker.finish(error_class(e))
+        if capture is not None:
+            capture.finish(500)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/v1/batch/chat/completions")
+async def batch_chat_completions(request: Request, api_key: ApiKey = Depends(authenticate),
+                                 batch_id: Optional[str] = None, concurrency: Optional[int] = None):
+    """批量聊天请求：请求体为JSONL（或以file字段上传的JSONL文件），每行一条聊天请求
+    
+    所有条目先整体校验，之后以有限并发执行，结果按完成顺序以JSONL流式返回。
+    同一批次（相同batch_id，默认按内容生成）重新提交时跳过已成功的条目。
+    """
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        upload = (await request.form()).get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="Missing 'file' upload")
+        data = await upload.read(BatchConfig.MAX_BYTES + 1)
+    else:
+        data = await request.body()
+    if len(data) > BatchConfig.MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {BatchConfig.MAX_BYTES} bytes")
+    
+    items = parse_batch(data)
+    batch_id = batch_id_for(data, batch_id)
+    window = min(concurrency or BatchConfig.CONCURRENCY, BatchConfig.CONCURRENCY)
+    if window < 1:
+        raise HTTPException(status_code=400, detail="concurrency must be positive")
+    
+    return StreamingResponse(
+        relay_stream(run_batch(items, api_key, batch_id, window), request),
+        media_type="application/x-ndjson",
+        headers={"X-Batch-Id": batch_id, "X-Batch-Items": str(len(items))},
+    )
+
+
+@router.get("/v1/cache/stats", dependencies=[Depends(authenticate)])
+async def cache_stats(request: Request):
+    """获取响应缓存的命中率等统计信息"""
+    return FastJSONResponse(content=await response_cache.stats())
+
+
+@router.get("/v1/scheduler/stats", dependencies=[Depends(authenticate)])
+async def scheduler_stats(request: Request):
+    """获取上游并发调度器的运行状态"""
+    return FastJSONResponse(content=scheduler.stats())
+
+
+@router.get("/v1/resilience/stats", dependencies=[Depends(authenticate)])
+async def resilience_stats(request: Request):
+    """获取上游重试、对冲请求和熔断器的状态"""
+    return FastJSONResponse(content=resilience.stats())
+
+
+@router.get("/v1/upstreams/stats", dependencies=[Depends(authenticate)])
+async def upstream_stats(request: Request):
+    """获取上游池中各上游的健康状态、在途请求数和延迟"""
+    return FastJSONResponse(content=upstream_pool.stats())
+
+
+@router.get("/v1/quota")
+async def quota_usage(api_key: ApiKey = Depends(authenticate)):
+    """获取当前密钥在配额窗口内的请求数和token数用量"""
+    return FastJSONResponse(content=await quotas.usage(api_key))
+
+
+@router.get("/v1/traces", dependencies=[Depends(require_admin)])
+async def recent_traces(limit: int = 50):
+    """最近完成的请求及其各阶段耗时（本进程，包含所有密钥的请求，需要管理密钥）"""
+    return FastJSONResponse(content={"data": trace_recorder.recent(max(1, min(limit, TraceConfig.BUFFER_SIZE)))})
+
+
+@router.get("/v1/traces/{request_id}", dependencies=[Depends(require_admin)])
+async def get_trace(request_id: str):
+    """按请求ID导出一个请求的Trace（OTLP JSON格式，需要管理密钥）"""
+    trace = trace_recorder.get(request_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return FastJSONResponse(content=trace.to_otlp())
+
+
+@router.get("/v1/admin/profile", dependencies=[Depends(require_admin)])
+async def profile(seconds: float = 10, interval_ms: float = TraceConfig.PROFILE_INTERVAL_MS):
+    """对本进程的事件循环做采样剖析，返回折叠栈格式（flamegraph.pl / speedscope可直接使用）"""
+    if not 0 < seconds <= TraceConfig.PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be in (0, {TraceConfig.PROFILE_MAX_SECONDS:g}]")
+    # 剖析器只在这里用到，按需导入
+    from profiler import profile_event_loop
+
+    try:
+        profiler = await profile_event_loop(seconds, max(interval_ms, 1) / 1000)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(profiler.folded(), headers={
+        "X-Profile-Samples": str(profiler.samples),
+        "X-Profile-Duration": f"{profiler.duration:.3f}",
+    })
+
+
+@router.get("/metrics")
+async def metrics():
+    """以Prometheus文本格式导出请求指标"""
+    return PlainTextResponse(await render_metrics(), media_type="text/plain; version=0.0.4")
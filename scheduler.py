@@ -0,0 +1,264 @@
+# scheduler.py
+# 上游并发调度模块，按全局/模型限制并发，在API密钥之间公平排队
+
+import asyncio
+import contextvars
+import logging
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+
+from config import SchedulerConfig, ServerConfig
+from log_utils import get_logger, log_event
+
+logger = get_logger("scheduler")
+
+# 当前请求所属的客户端（API密钥名称），由路由层设置，用于公平调度
+client_key_var: contextvars.ContextVar = contextvars.ContextVar("client_key", default="anonymous")
+
+
+def set_client_key(key_name: Optional[str]):
+    """设置当前请求的客户端标识，同一密钥名称的请求共用一条等待队列
+
+    Args:
+        key_name: 认证得到的密钥名称（ApiKey.name）
+    """
+    if key_name:
+        client_key_var.set(key_name)
+
+
+class Lease:
+    """一个上游并发名额，release可重复调用"""
+
+    __slots__ = ("_scheduler", "model", "started", "_released")
+
+    def __init__(self, scheduler: Optional["Scheduler"], model: str):
+        self._scheduler = scheduler
+        self.model = model
+        self.started = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            if self._scheduler is not None:
+                self._scheduler._release(self)
+
+
+class _Waiter:
+    __slots__ = ("model", "future", "enqueued")
+
+    def __init__(self, model: str, future: asyncio.Future):
+        self.model = model
+        self.future = future
+        self.enqueued = time.monotonic()
+
+
+class Scheduler:
+    """上游并发调度器
+
+    - 全局与按模型的并发上限
+    - 有界等待队列，队列满或预计等待超过期限时立即返回429并附带Retry-After
+    - 每个客户端一条队列，空出名额时在客户端之间轮询，避免单个密钥占满上游
+    """
+
+    def __init__(self, global_limit: int, model_limit: int, model_limits: Dict[str, int],
+                 queue_size: int, max_wait: float):
+        """
+        Args:
+            global_limit: 全局并发上限
+            model_limit: 每个模型的默认并发上限
+            model_limits: 指定模型的并发上限
+            queue_size: 等待队列长度上限
+            max_wait: 最长排队时间（秒）
+        """
+        self.global_limit = global_limit
+        self.model_limit = model_limit
+        self.model_limits = model_limits
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+
+        self._active = 0
+        self._active_by_model: Dict[str, int] = {}
+        # 客户端 -> 等待者队列；OrderedDict的顺序即轮询顺序
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._waiting = 0
+        self._waiting_by_model: Dict[str, int] = {}
+        # 每个模型单个请求占用名额时间的指数滑动平均（秒）
+        self._service_time: Dict[str, float] = {}
+
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def limit_for(self, model: str) -> int:
+        return self.model_limits.get(model, self.model_limit)
+
+    async def acquire(self, model: str, client_key: Optional[str] = None) -> Lease:
+        """获取一个上游并发名额
+
+        Args:
+            model: 映射后的模型名称
+            client_key: 客户端标识，默认取当前请求上下文
+
+        Returns:
+            Lease对象，用完后必须release
+
+        Raises:
+            HTTPException: 429，队列已满、预计等待超过期限或排队超时
+        """
+        if client_key is None:
+            client_key = client_key_var.get()
+
+        if self._can_run(model) and not self._waiting_by_model.get(model):
+            return self._grant(model)
+
+        if self._waiting >= self.queue_size:
+            self._reject("Upstream queue is full", model)
+
+        # 预计等待时间超过期限的请求不必排队
+        estimate = self._estimate_wait(model)
+        if estimate > self.max_wait:
+            self._reject("Upstream is saturated", model, estimate)
+
+        waiter = _Waiter(model, asyncio.get_running_loop().create_future())
+        self._queues.setdefault(client_key, deque()).append(waiter)
+        self._waiting += 1
+        self._waiting_by_model[model] = self._waiting_by_model.get(model, 0) + 1
+
+        try:
+            await asyncio.wait_for(waiter.future, timeout=self.max_wait)
+        except BaseException as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 已分到名额但调用方超时或被取消，归还名额
+                waiter.future.result().release()
+            else:
+                self._remove_waiter(client_key, waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+                self._reject("Timed out waiting for upstream capacity", model)
+            raise
+        return waiter.future.result()
+
+    def stats(self) -> dict:
+        return {
+            "active": self._active,
+            "waiting": self._waiting,
+            "active_by_model": dict(self._active_by_model),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+    def _can_run(self, model: str) -> bool:
+        return (self._active < self.global_limit
+                and self._active_by_model.get(model, 0) < self.limit_for(model))
+
+    def _grant(self, model: str) -> Lease:
+        self._active += 1
+        self._active_by_model[model] = self._active_by_model.get(model, 0) + 1
+        self.admitted += 1
+        return Lease(self, model)
+
+    def _release(self, lease: Lease):
+        model = lease.model
+        self._active -= 1
+        self._active_by_model[model] -= 1
+
+        elapsed = time.monotonic() - lease.started
+        previous = self._service_time.get(model)
+        self._service_time[model] = elapsed if previous is None else previous * 0.8 + elapsed * 0.2
+
+        self._dispatch()
+
+    def _dispatch(self):
+        """在客户端之间轮询，把空出的名额分给可运行的等待者"""
+        while self._waiting and self._active < self.global_limit:
+            granted = False
+            for client_key in list(self._queues):
+                queue = self._queues[client_key]
+                for waiter in list(queue):
+                    if waiter.future.done():
+                        # 已超时或被取消、尚未自行出队的等待者
+                        queue.remove(waiter)
+                        self._dequeued(waiter)
+                        continue
+                    if self._can_run(waiter.model):
+                        queue.remove(waiter)
+                        self._dequeued(waiter)
+                        waiter.future.set_result(self._grant(waiter.model))
+                        granted = True
+                        break
+                if not queue:
+                    del self._queues[client_key]
+                elif granted:
+                    # 本轮分到名额的客户端排到队尾
+                    self._queues.move_to_end(client_key)
+                if granted:
+                    break
+            if not granted:
+                break
+
+    def _remove_waiter(self, client_key: str, waiter: _Waiter):
+        queue = self._queues.get(client_key)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self._dequeued(waiter)
+            if not queue:
+                del self._queues[client_key]
+
+    def _dequeued(self, waiter: _Waiter):
+        self._waiting -= 1
+        self._waiting_by_model[waiter.model] -= 1
+
+    def _estimate_wait(self, model: str) -> float:
+        """按排在前面的请求数和平均占用时间估算等待时间（秒）"""
+        service_time = self._service_time.get(model)
+        if service_time is None:
+            return 0.0
+        ahead = self._waiting_by_model.get(model, 0) + 1
+        return ahead * service_time / max(self.limit_for(model), 1)
+
+    def _reject(self, detail: str, model: str, estimate: Optional[float] = None):
+        self.rejected += 1
+        retry_after = estimate if estimate is not None else self._estimate_wait(model)
+        raise HTTPException(
+            status_code=429,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+
+class _NoopScheduler:
+    """关闭调度时使用，不做任何限制"""
+
+    async def acquire(self, model: str, client_key: Optional[str] = None) -> Lease:
+        return Lease(None, model)
+
+    def stats(self) -> dict:
+        return {}
+
+
+def _worker_share(limit: int) -> int:
+    """多个工作进程共享上限时，每个进程分到的份额"""
+    return max(1, limit // ServerConfig.shared_workers())
+
+
+# 全局调度器实例；多进程部署时并发上限和队列长度在工作进程之间平分
+if SchedulerConfig.ENABLED:
+    if ServerConfig.shared_workers() > SchedulerConfig.max_workers():
+        # serve.py会拒绝这种配置；以其他方式启动多进程时至少留下记录
+        log_event(logger, logging.ERROR, "scheduler_limits_exceeded",
+                  workers=ServerConfig.shared_workers(), max_workers=SchedulerConfig.max_workers())
+    scheduler = Scheduler(
+        global_limit=_worker_share(SchedulerConfig.GLOBAL_CONCURRENCY),
+        model_limit=_worker_share(SchedulerConfig.MODEL_CONCURRENCY),
+        model_limits={model: _worker_share(limit) for model, limit in SchedulerConfig.get_model_limits().items()},
+        queue_size=_worker_share(SchedulerConfig.QUEUE_SIZE),
+        max_wait=SchedulerConfig.MAX_WAIT,
+    )
+else:
+    scheduler = _NoopScheduler()
@@ -0,0 +1,66 @@
+# serve.py
+# 生产环境入口：以多个工作进程运行应用，工作进程之间通过状态服务共享缓存和指标
+#
+# 用法: python serve.py [--workers N] [--host 0.0.0.0] [--port 8080]
+# 向主进程发送 SIGHUP 可逐个平滑重启工作进程（uvicorn提供），SIGTERM/SIGINT 平滑退出。
+
+import argparse
+import multiprocessing
+import os
+
+import uvicorn
+
+from config import SchedulerConfig, ServerConfig
+
+
+def start_state_server(path: str) -> multiprocessing.Process:
+    """启动状态服务进程，等待其开始监听"""
+    from state import run_state_server
+
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=run_state_server, args=(path, ready), name="rkui2api-state", daemon=True)
+    process.start()
+    if not ready.wait(timeout=10):
+        process.terminate()
+        raise RuntimeError("State server did not start")
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run rkui2api with multiple worker processes")
+    parser.add_argument("--host", default=ServerConfig.HOST)
+    parser.add_argument("--port", type=int, default=ServerConfig.PORT)
+    parser.add_argument("--workers", type=int, default=ServerConfig.WORKERS, help="工作进程数，默认CPU核数（不超过调度并发上限）")
+    args = parser.parse_args()
+
+    workers = max(args.workers, 1)
+    max_workers = SchedulerConfig.max_workers()
+    if workers > 1 and max_workers and workers > max_workers:
+        # 每个进程至少分到1个名额，进程数更多时合计的并发会超过配置的上限
+        parser.error(f"--workers {workers} exceeds the smallest scheduler limit ({max_workers}); "
+                     "lower --workers or raise SCHED_GLOBAL_CONCURRENCY/SCHED_MODEL_CONCURRENCY/"
+                     "SCHED_MODEL_LIMITS/SCHED_QUEUE_SIZE")
+    state_server = None
+    if workers > 1:
+        # 工作进程由uvicorn重新导入main:app，通过环境变量继承共享状态配置
+        os.environ["WORKERS"] = str(workers)
+        os.environ["STATE_BACKEND"] = "socket"
+        os.environ.setdefault("STATE_SOCKET", ServerConfig.STATE_SOCKET)
+        state_server = start_state_server(os.environ["STATE_SOCKET"])
+
+    try:
+        uvicorn.run(
+            "main:app",
+            host=args.host,
+            port=args.port,
+            workers=workers,
+            timeout_graceful_shutdown=ServerConfig.GRACEFUL_TIMEOUT,
+        )
+    finally:
+        if state_server is not None:
+            state_server.terminate()
+            state_server.join(timeout=5)
+
+
+if __name__ == "__main__":
+    main()
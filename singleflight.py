@@ -0,0 +1,203 @@
+# singleflight.py
+# 在途请求合并模块，相同负载的并发请求共享同一个上游SSE流
+
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+
+from config import SingleFlightConfig
+from log_utils import get_logger, log_event
+
+logger = get_logger("singleflight")
+
+
+class SlowConsumerError(Exception):
+    """订阅者缓冲区已满，被从共享流中摘除"""
+
+
+class Subscriber:
+    """共享上游流的一个订阅者
+
+    每个订阅者有自己的有界缓冲区，生产者只做非阻塞追加：
+    缓冲区满时摘除该订阅者，而不会拖慢其他订阅者。
+    实现了异步迭代器协议，逐个产出事件批次。
+    """
+
+    def __init__(self, flight: "Flight", max_size: int):
+        self._flight = flight
+        self._buffer: deque = deque()
+        self._max_size = max_size
+        self._wakeup = asyncio.Event()
+        self._finished = False
+        self._error: Optional[BaseException] = None
+
+    def push(self, batch) -> bool:
+        """由生产者调用，缓冲区已满时返回False"""
+        if len(self._buffer) >= self._max_size:
+            return False
+        self._buffer.append(batch)
+        self._wakeup.set()
+        return True
+
+    def finish(self, error: Optional[BaseException] = None):
+        """由生产者调用，标记流结束或出错"""
+        if not self._finished:
+            self._finished = True
+            self._error = error
+            self._wakeup.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            if self._buffer:
+                return self._buffer.popleft()
+            if self._finished:
+                if self._error is not None:
+                    raise self._error
+                raise StopAsyncIteration
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+    async def aclose(self):
+        """取消订阅；最后一个订阅者离开时会取消上游请求"""
+        self._buffer.clear()
+        self.finish()
+        self._flight.unsubscribe(self)
+
+
+class Flight:
+    """一个正在进行的上游请求及其所有订阅者"""
+
+    def __init__(self, group: "SingleFlight", key: str, opener: Callable[[], Awaitable]):
+        self.key = key
+        self._group = group
+        self._opener = opener
+        self._subscribers: List[Subscriber] = []
+        # 已产出的批次，供后加入的订阅者补齐；超过缓冲上限后不再接受新订阅者
+        self._history: Optional[list] = []
+        self._opened = asyncio.get_running_loop().create_future()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def joinable(self) -> bool:
+        return self._history is not None and not self._task.done()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def subscribe(self, max_size: int) -> Subscriber:
+        subscriber = Subscriber(self, max_size)
+        for batch in self._history:
+            subscriber.push(batch)
+        self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        if subscriber in self._subscribers:
+            self._subscribers.remove(subscriber)
+        if not self._subscribers and self._task is not None and not self._task.done():
+            # 没有订阅者了，取消上游读取并释放连接
+            self._task.cancel()
+
+    async def wait_opened(self):
+        """等待上游响应头到达，上游出错时抛出同样的异常"""
+        await asyncio.shield(self._opened)
+
+    async def _run(self):
+        batches = None
+        error: Optional[BaseException] = None
+        try:
+            batches = await self._opener()
+            self._opened.set_result(None)
+
+            async for batch in batches:
+                if self._history is not None:
+                    if len(self._history) < SingleFlightConfig.QUEUE_SIZE:
+                        self._history.append(batch)
+                    else:
+                        self._history = None
+                        self._group.release(self)
+
+                for subscriber in list(self._subscribers):
+                    if not subscriber.push(batch):
+                        self._subscribers.remove(subscriber)
+                        subscriber.finish(HTTPException(status_code=504, detail="Stream consumer too slow"))
+                        log_event(logger, logging.WARNING, "slow_consumer_dropped", key=self.key[:12])
+        except asyncio.CancelledError:
+            error = HTTPException(status_code=499, detail="Upstream request cancelled")
+        except BaseException as e:
+            error = e
+        finally:
+            if batches is not None:
+                await batches.aclose()
+            if not self._opened.done():
+                self._opened.set_exception(error or HTTPException(status_code=502, detail="Upstream closed"))
+                # 避免无人等待时出现未取回异常的警告
+                self._opened.exception()
+            self._history = None
+            self._group.release(self)
+            for subscriber in self._subscribers:
+                subscriber.finish(error)
+            self._subscribers.clear()
+
+
+class SingleFlight:
+    """按请求键合并在途上游请求"""
+
+    def __init__(self, queue_size: int):
+        """
+        Args:
+            queue_size: 每个订阅者缓冲的最大事件批次数
+        """
+        self.queue_size = queue_size
+        self._flights: Dict[str, Flight] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def subscribe(self, key: str, opener: Callable[[], Awaitable]) -> Subscriber:
+        """订阅与key对应的上游流，不存在可加入的在途请求时由opener发起新请求
+
+        Args:
+            key: 请求键（规范化负载的哈希）
+            opener: 发起上游请求的协程函数，返回事件批次的异步迭代器
+
+        Returns:
+            Subscriber对象，在上游响应头到达后返回
+        """
+        flight = self._flights.get(key)
+        if flight is not None and flight.joinable:
+            self.followers += 1
+        else:
+            flight = Flight(self, key, opener)
+            self._flights[key] = flight
+            flight.start()
+            self.leaders += 1
+
+        subscriber = flight.subscribe(self.queue_size)
+        try:
+            await flight.wait_opened()
+        except BaseException:
+            flight.unsubscribe(subscriber)
+            raise
+        return subscriber
+
+    def release(self, flight: Flight):
+        """流不再接受新订阅者时从索引中移除"""
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "followers": self.followers,
+        }
+
+
+# 全局single-flight实例
+single_flight = SingleFlight(queue_size=SingleFlightConfig.QUEUE_SIZE)
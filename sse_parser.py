@@ -0,0 +1,264 @@
+# sse_parser.py
+# SSE增量解码模块，按字节流解析 text/event-stream
+
+from typing import List, Optional
+
+# 完整行前缀小于该字节数时直接复制解码
+_SMALL_PREFIX = 4096
+
+
+class SSEEvent:
+    """一条完整的SSE事件"""
+
+    __slots__ = ("data", "event", "id", "retry")
+
+    def __init__(self, data: str, event: Optional[str] = None, id: Optional[str] = None, retry: Optional[int] = None):
+        self.data = data
+        self.event = event
+        self.id = id
+        self.retry = retry
+
+    def __repr__(self) -> str:
+        return f"SSEEvent(data={self.data!r}, event={self.event!r}, id={self.id!r})"
+
+
+class SSEDecoder:
+    """增量SSE解码器
+
+    数据块以bytes形式追加到内部bytearray，每次feed只解码并切分最后一个换行之前的部分，
+    再一次性删除已消费的前缀，因此单个数据块内的行数再多也是线性开销。
+    支持 \\n、\\r\\n 与 \\r 换行、多行 data 字段、event/id/retry 字段、注释行，
+    以及流结束时未以换行结尾的最后一行（见flush）。
+
+    用法:
+        decoder = SSEDecoder()
+        async for chunk in response.aiter_bytes():
+            for event in decoder.feed(chunk):
+                ...
+        for event in decoder.flush():
+            ...
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._data: List[str] = []
+        self._event: Optional[str] = None
+        self._retry: Optional[int] = None
+        # 上一个数据块以 \r 结尾，下一个数据块开头的 \n 属于同一个换行
+        self._pending_cr = False
+        # 有跨数据块未结束的事件字段（或待跳过的 \n），此时不能走快速路径
+        self._pending = False
+        # id 字段按规范在事件之间保持
+        self.last_event_id: Optional[str] = None
+
+    def feed(self, chunk) -> List[SSEEvent]:
+        """追加一个数据块并返回其中已完整的事件
+
+        Args:
+            chunk: bytes / bytearray / memoryview
+
+        Returns:
+            本次解析出的事件列表
+        """
+        buffer = self._buffer
+        if not buffer and not self._pending and type(chunk) is bytes and (
+                chunk[-2:] == b"\n\n" or chunk[-4:] == b"\r\n\r\n"):
+            # 快速路径：没有残留的半行且数据块以事件结尾（上游逐token推送时的常见情况），
+            # 直接解码整个数据块，不经过缓冲区的追加、查找和删除
+            text = str(chunk, "utf-8", "replace")
+            if "\r" in text:
+                text = text.replace("\r\n", "\n")
+            if "\r" not in text:
+                first = text.find("\n")
+                if first == len(text) - 2 and text[:5] == "data:":
+                    # 恰好一个单行data事件
+                    return [SSEEvent(text[6:first] if text[5:6] == " " else text[5:first], None, self.last_event_id)]
+                events = self._simple_events(text[:-2])
+                if events is not None:
+                    return events
+                lines = text.split("\n")
+                lines.pop()
+                return self._parse_lines(lines)
+
+        if self._pending_cr:
+            self._pending_cr = False
+            if chunk[:1] == b"\n":
+                chunk = chunk[1:]
+
+        buffer += chunk
+        last = buffer.rfind(b"\n")
+        if b"\r" in buffer:
+            return self._feed_cr(last)
+        if last < 0:
+            return []
+
+        # 只对完整行所在的前缀做一次解码和切分（均在C层完成），
+        # 末尾未结束的半行留在缓冲区，多字节字符不会被截断
+        if last < _SMALL_PREFIX:
+            # 前缀较小时直接复制，比创建memoryview更快
+            text = buffer[:last].decode("utf-8", "replace")
+            del buffer[:last + 1]
+        else:
+            text = self._take(last, last)
+        if text[-1:] == "\n" and not self._pending:
+            # 完整行前缀恰好以事件结尾
+            first = text.find("\n")
+            if first == len(text) - 1 and text[:5] == "data:":
+                return [SSEEvent(text[6:first] if text[5:6] == " " else text[5:first], None, self.last_event_id)]
+            events = self._simple_events(text[:-1])
+            if events is not None:
+                return events
+        return self._parse_lines(text.split("\n"))
+
+    def _feed_cr(self, last: int) -> List[SSEEvent]:
+        """缓冲区中含有 \\r 时的慢速路径：统一 \\r\\n 和 \\r 换行后逐行解析"""
+        buffer = self._buffer
+        end = last
+        if last > 0 and buffer[last - 1] == 13:
+            end = last - 1
+        cr = buffer.rfind(b"\r")
+        if cr > last:
+            # 只有 \r 的换行；位于末尾时下一个数据块开头的 \n 属于同一个换行
+            last = end = cr
+            self._pending_cr = cr == len(buffer) - 1
+        if last < 0:
+            return []
+        text = self._take(end, last)
+        return self._parse_lines(text.replace("\r\n", "\n").replace("\r", "\n").split("\n"))
+
+    def _take(self, end: int, last: int) -> str:
+        """解码缓冲区中end之前的部分，并删除到last（含）为止的字节"""
+        buffer = self._buffer
+        if end < _SMALL_PREFIX:
+            # 前缀较小时直接复制，比创建memoryview更快
+            text = buffer[:end].decode("utf-8", "replace")
+        else:
+            with memoryview(buffer) as view:
+                text = str(view[:end], "utf-8", "replace")
+        del buffer[:last + 1]
+        return text
+
+    def _simple_events(self, text: str) -> Optional[List[SSEEvent]]:
+        """text（去掉最后一个事件结尾的空行）由若干个单行data事件组成时直接切分，
+        否则返回None交给逐行解析"""
+        blocks = text.split("\n\n")
+        if text.count("\n") != 2 * (len(blocks) - 1):
+            return None
+        last_event_id = self.last_event_id
+        events = []
+        for block in blocks:
+            if block[:6] == "data: ":
+                events.append(SSEEvent(block[6:], None, last_event_id))
+            elif block[:5] == "data:":
+                events.append(SSEEvent(block[5:], None, last_event_id))
+            else:
+                return None
+        return events
+
+    def _parse_lines(self, lines: List[str]) -> List[SSEEvent]:
+        """处理一组完整的行（已去掉换行符），返回其中结束的事件"""
+        events: List[SSEEvent] = []
+        data = self._data
+        for line in lines:
+            # 最常见的两种行（data 行和空行）直接在循环内处理
+            if line.startswith("data:"):
+                data.append(line[6:] if line.startswith(" ", 5) else line[5:])
+            elif not line:
+                if data:
+                    if len(data) == 1 and self._event is None and self._retry is None:
+                        # 单行 data 事件的快速路径
+                        events.append(SSEEvent(data[0], None, self.last_event_id))
+                        data.clear()
+                    else:
+                        self._dispatch(events)
+                        data = self._data
+            else:
+                self._process_line(line, events)
+        self._pending = bool(self._data) or self._event is not None or self._retry is not None or self._pending_cr
+        return events
+
+    def flush(self) -> List[SSEEvent]:
+        """流结束时处理缓冲区中剩余的未结束行并派发最后一个事件
+
+        Returns:
+            剩余的事件列表
+        """
+        events: List[SSEEvent] = []
+        if self._buffer:
+            line = self._buffer.decode("utf-8", "replace").rstrip("\r")
+            self._buffer.clear()
+            self._process_line(line, events)
+        self._dispatch(events)
+        return events
+
+    @property
+    def pending_bytes(self) -> int:
+        """缓冲区中尚未构成完整行的字节数"""
+        return len(self._buffer)
+
+    def _process_line(self, line: str, events: List[SSEEvent]):
+        """处理一行SSE文本"""
+        if line.startswith("data:"):
+            value = line[5:]
+            self._data.append(value[1:] if value.startswith(" ") else value)
+            return
+
+        if not line:
+            self._dispatch(events)
+            return
+
+        if line.startswith(":"):
+            # 注释行
+            return
+
+        field, sep, value = line.partition(":")
+        if sep and value.startswith(" "):
+            value = value[1:]
+
+        if field == "event":
+            self._event = value
+        elif field == "id":
+            if "\0" not in value:
+                self.last_event_id = value
+        elif field == "retry":
+            if value.isdigit():
+                self._retry = int(value)
+        elif field == "data":
+            # 不带冒号的 "data" 行表示空数据
+            self._data.append(value)
+
+    def _dispatch(self, events: List[SSEEvent]):
+        """空行到来时把已累积的字段组装成事件"""
+        data = self._data
+        if data:
+            events.append(SSEEvent(
+                data[0] if len(data) == 1 else "\n".join(data),
+                event=self._event,
+                id=self.last_event_id,
+                retry=self._retry,
+            ))
+        self._data = []
+        self._event = None
+        self._retry = None
+        self._pending = self._pending_cr
+
+
+def encode_event(data: str, event: Optional[str] = None, id: Optional[str] = None) -> str:
+    """把事件重新编码为SSE文本
+
+    Args:
+        data: 事件数据，多行会拆成多个 data 行
+        event: 事件类型
+        id: 事件ID
+
+    Returns:
+        以空行结尾的SSE文本
+    """
+    head = ""
+    if id is not None:
+        head += f"id: {id}\n"
+    if event is not None:
+        head += f"event: {event}\n"
+    if "\n" in data:
+        return head + "".join(f"data: {line}\n" for line in data.split("\n")) + "\n"
+    return f"{head}data: {data}\n\n"
@@ -0,0 +1,253 @@
+# state.py
+# 共享状态模块：单进程时使用进程内存储，多进程时通过本地Unix套接字访问同一个状态服务
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from config import CacheConfig, ServerConfig
+from log_utils import get_logger, log_event
+
+logger = get_logger("state")
+
+# 单条请求/响应的最大长度（字节），需要容纳缓存的完整回答和指标快照
+MAX_LINE = 16 * 1024 * 1024
+
+
+class StateStore:
+    """状态数据本体：带TTL的键值/计数器，以及共享的响应缓存
+
+    单进程时由LocalStateBackend直接调用，多进程时运行在状态服务进程中。
+    """
+
+    def __init__(self, max_keys: int):
+        """
+        Args:
+            max_keys: 键值存储的最大键数，超过后淘汰最早写入的键
+        """
+        # 延迟导入，cache模块本身依赖state_backend
+        from cache import ResponseCache
+
+        self.max_keys = max_keys
+        # key -> (过期时间或None, 值)
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self.cache = ResponseCache(
+            max_entries=CacheConfig.MAX_ENTRIES,
+            max_bytes=CacheConfig.MAX_BYTES,
+            ttl=CacheConfig.TTL,
+        )
+
+    def get(self, key: str) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self._data.pop(key, None)
+        self._data[key] = (time.monotonic() + ttl if ttl else None, value)
+        while len(self._data) > self.max_keys:
+            self._data.popitem(last=False)
+
+    def incr(self, key: str, amount: float = 1, ttl: Optional[float] = None) -> float:
+        """原子地增加计数器并返回新值；键不存在时从0开始，ttl只在创建时生效"""
+        entry = self._data.get(key)
+        if entry is None or (entry[0] is not None and entry[0] <= time.monotonic()):
+            expires_at, value = (time.monotonic() + ttl if ttl else None), 0
+        else:
+            expires_at, value = entry
+        value += amount
+        self._data[key] = (expires_at, value)
+        return value
+
+    def window_add(self, key: str, window: float, amount: float, limit: float) -> list:
+        """滑动窗口计数：按上一个固定窗口的剩余比例加权估算窗口内的总量
+
+        估算值加上amount不超过limit（limit<=0表示不限制）时计入并放行，否则不计入。
+
+        Returns:
+            [是否放行, 计入后的估算值, 建议的重试等待秒数]
+        """
+        now = time.time()
+        index, elapsed = divmod(now, window)
+        previous = self.get(f"{key}:{int(index) - 1}") or 0
+        current = self.get(f"{key}:{int(index)}") or 0
+        weight = 1 - elapsed / window
+        estimate = previous * weight + current
+        if limit > 0 and estimate + amount > limit:
+            return [False, estimate, _window_retry_after(previous, current, amount, limit, window, elapsed)]
+        if amount:
+            self.incr(f"{key}:{int(index)}", amount, window * 2)
+        return [True, estimate + amount, 0]
+
+    def delete(self, key: str):
+        self._data.pop(key, None)
+
+    def get_prefix(self, prefix: str) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            key: value for key, (expires_at, value) in list(self._data.items())
+            if key.startswith(prefix) and (expires_at is None or expires_at > now)
+        }
+
+    def cache_get(self, key: str) -> Optional[str]:
+        return self.cache.get(key)
+
+    def cache_set(self, key: str, content: str):
+        self.cache.set(key, content)
+
+    def cache_stats(self) -> dict:
+        return self.cache.stats()
+
+
+def _window_retry_after(previous, current, amount, limit, window, elapsed) -> float:
+    """估算滑动窗口内的总量降到可以再计入amount所需的时间（秒）"""
+    room = limit - current - amount
+    if room >= 0 and previous > 0:
+        # 在当前窗口内等上一个窗口的权重衰减
+        return max(0.0, (1 - room / previous) * window - elapsed)
+    if amount > limit:
+        return window
+    # 进入下一个窗口后，当前窗口的计数按比例衰减
+    return window - elapsed + max(0.0, 1 - (limit - amount) / current) * window if current else window - elapsed
+
+
+# 状态服务允许调用的操作
+OPERATIONS = frozenset({"get", "set", "incr", "window_add", "delete", "get_prefix", "cache_get", "cache_set", "cache_stats"})
+
+
+class LocalStateBackend:
+    """进程内状态后端"""
+
+    shared = False
+
+    def __init__(self, store: Optional[StateStore] = None):
+        self._store = store
+        self._max_keys = ServerConfig.STATE_MAX_KEYS
+
+    @property
+    def store(self) -> StateStore:
+        if self._store is None:
+            self._store = StateStore(self._max_keys)
+        return self._store
+
+    async def call(self, op: str, *args):
+        return getattr(self.store, op)(*args)
+
+
+class SocketStateBackend:
+    """通过Unix套接字访问状态服务的后端
+
+    每个工作进程保持一条连接，按行传输JSON；请求在连接上串行执行，
+    连接断开时在下一次调用时重连一次。
+    """
+
+    shared = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def call(self, op: str, *args):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        request = json.dumps({"op": op, "args": args}, ensure_ascii=False).encode("utf-8") + b"\n"
+        async with self._lock:
+            for attempt in (0, 1):
+                try:
+                    if self._writer is None:
+                        self._reader, self._writer = await asyncio.open_unix_connection(self.path, limit=MAX_LINE)
+                    self._writer.write(request)
+                    await self._writer.drain()
+                    line = await self._reader.readline()
+                    if not line:
+                        raise ConnectionResetError("State server closed the connection")
+                    break
+                except (OSError, ConnectionError):
+                    await self._close()
+                    if attempt:
+                        raise
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(f"State server error: {response['error']}")
+        return response.get("result")
+
+    async def _close(self):
+        if self._writer is not None:
+            writer, self._writer, self._reader = self._writer, None, None
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+
+async def serve_state(path: str, ready=None):
+    """运行状态服务，直到被取消
+
+    Args:
+        path: Unix套接字路径
+        ready: 可选的multiprocessing.Event，开始监听后set
+    """
+    store = StateStore(ServerConfig.STATE_MAX_KEYS)
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    op = request["op"]
+                    if op not in OPERATIONS:
+                        raise ValueError(f"Unknown operation: {op}")
+                    response = {"result": getattr(store, op)(*request.get("args", ()))}
+                except Exception as e:
+                    response = {"error": f"{type(e).__name__}: {e}"}
+                writer.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(handle, path=path, limit=MAX_LINE)
+    log_event(logger, logging.INFO, "state_server_started", path=path)
+    if ready is not None:
+        ready.set()
+    async with server:
+        await server.serve_forever()
+
+
+def run_state_server(path: str, ready=None):
+    """在独立进程中运行状态服务（multiprocessing.Process的入口）"""
+    from log_utils import setup_logging
+    setup_logging()
+    try:
+        asyncio.run(serve_state(path, ready))
+    except KeyboardInterrupt:
+        pass
+
+
+def create_backend():
+    """根据STATE_BACKEND创建状态后端"""
+    if ServerConfig.STATE_BACKEND == "socket":
+        return SocketStateBackend(ServerConfig.STATE_SOCKET)
+    return LocalStateBackend()
+
+
+# 全局状态后端实例
+state_backend = create_backend()
@@ -0,0 +1,26 @@
+# test_auth.py
+# 管理权限：未配置多密钥时API_TOKEN不是管理密钥，需显式列在 AUTH_ADMIN_KEYS 中
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import auth  # noqa: E402
+from config import AuthConfig  # noqa: E402
+
+
+def test_fallback_key_is_not_admin():
+    store = auth.KeyStore("", "", 0)
+    key = store.lookup("Bearer " + AuthConfig.API_TOKEN)
+    assert key is not None and key.name == "default"
+    assert not key.admin
+
+
+def test_admin_keys_grant_admin(monkeypatch):
+    monkeypatch.setattr(auth, "_ADMIN_NAMES", frozenset({"default", "ops"}))
+    store = auth.KeyStore("", "", 0)
+    assert store.lookup(AuthConfig.API_TOKEN).admin
+    store = auth.KeyStore("", "ops=sk-ops,user=sk-user", 0)
+    assert store.lookup("Bearer sk-ops").admin
+    assert not store.lookup("Bearer sk-user").admin
@@ -0,0 +1,84 @@
+# test_choices.py
+# n>1的流式请求：各选项的数据块以index区分，每个选项有自己的角色块和结束块，上游流全部关闭
+
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_client  # noqa: E402
+from config import ChoicesConfig  # noqa: E402
+from sse_parser import SSEEvent  # noqa: E402
+
+
+class FakeBatches:
+    """一个上游分支：逐批产出增量事件，最后是[DONE]"""
+
+    def __init__(self, branch, pieces, closed):
+        self._events = [[SSEEvent(json.dumps({"choices": [{"delta": {"content": f"{branch}:{piece}"}}]}))]
+                        for piece in range(pieces)]
+        self._events.append([SSEEvent("[DONE]")])
+        self._branch = branch
+        self._closed = closed
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._events:
+            raise StopAsyncIteration
+        await asyncio.sleep(0.001 * (self._branch + 1))
+        return self._events.pop(0)
+
+    async def aclose(self):
+        self._closed.append(self._branch)
+
+
+def parse_frames(body: str):
+    chunks = []
+    for frame in body.split("\n\n"):
+        if frame.startswith("data: ") and frame != "data: [DONE]":
+            chunks.append(json.loads(frame[len("data: "):]))
+    return chunks
+
+
+def test_stream_chunks_are_indexed_per_choice(monkeypatch):
+    n, pieces = 3, 4
+    opened, closed = [], []
+
+    async def fake_open_batches(payload, is_stream=False, shared=True):
+        branch = len(opened)
+        opened.append(branch)
+        return FakeBatches(branch, pieces, closed)
+
+    monkeypatch.setattr(api_client, "_open_batches", fake_open_batches)
+    # 同时在途的分支少于n，第三个分支在有空位后才打开
+    monkeypatch.setattr(ChoicesConfig, "CONCURRENCY", 2)
+
+    async def run():
+        response = await api_client.call_api_choices({"model": "m", "messages": []}, n, is_stream=True)
+        return "".join([chunk async for chunk in response.body_iterator])
+
+    body = asyncio.run(run())
+    assert body.endswith("data: [DONE]\n\n")
+    chunks = parse_frames(body)
+    assert len({chunk["id"] for chunk in chunks}) == 1
+
+    by_index = {}
+    for chunk in chunks:
+        for choice in chunk["choices"]:
+            by_index.setdefault(choice["index"], []).append(choice)
+    assert sorted(by_index) == list(range(n))
+    branches = set()
+    for index, choices in by_index.items():
+        assert choices[0]["delta"].get("role") == "assistant"
+        contents = [choice["delta"].get("content") for choice in choices[1:-1]]
+        # 各选项的内容来自同一个分支且保持顺序
+        branch = contents[0].split(":")[0]
+        branches.add(branch)
+        assert contents == [f"{branch}:{piece}" for piece in range(pieces)]
+        assert choices[-1]["finish_reason"] == "stop"
+    assert branches == {str(branch) for branch in range(n)}
+    assert sorted(closed) == list(range(n))
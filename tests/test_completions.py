@@ -0,0 +1,56 @@
+# test_completions.py
+# 缓存命中的流式请求：重放结束或客户端断开时才记录请求结束
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from completions import ChatRequest, replay_cached  # noqa: E402
+
+
+class Tracker:
+    def __init__(self):
+        self.finished = []
+
+    def finish(self, error=None):
+        self.finished.append(error)
+
+
+def cached_chat(content):
+    chat = ChatRequest()
+    chat.payload = {"model": "m"}
+    chat.cached = content
+    chat.include_usage = False
+    chat.usage = None
+    chat.tracker = Tracker()
+    return chat
+
+
+def test_replay_finishes_after_last_frame():
+    chat = cached_chat("x" * 1000)
+
+    async def run():
+        frames = []
+        async for frame in replay_cached(chat):
+            assert chat.tracker.finished == []
+            frames.append(frame)
+        return frames
+
+    frames = asyncio.run(run())
+    assert frames[-1] == "data: [DONE]\n\n"
+    assert chat.tracker.finished == [None]
+
+
+def test_replay_finishes_when_client_disconnects():
+    chat = cached_chat("x" * 1000)
+
+    async def run():
+        frames = replay_cached(chat)
+        await frames.__anext__()
+        assert chat.tracker.finished == []
+        await frames.aclose()
+
+    asyncio.run(run())
+    assert chat.tracker.finished == [None]
@@ -0,0 +1,63 @@
+# test_relay.py
+# 流式转发：慢客户端超时后断开并关闭上游，客户端断开时取消上游读取
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+
+from relay import StreamRelay  # noqa: E402
+
+
+def upstream(closed):
+    """源源不断产出帧的上游，关闭时记录"""
+
+    async def frames():
+        try:
+            while True:
+                await asyncio.sleep(0)
+                yield "data: x\n\n"
+        finally:
+            closed.append(1)
+
+    return frames()
+
+
+def test_slow_client_is_aborted_and_upstream_closed():
+    closed = []
+
+    async def run():
+        chunks = StreamRelay(upstream(closed), max_size=100, stall_timeout=0.05).iterate()
+        await chunks.__anext__()
+        # 客户端停止读取，缓冲区满载超过stall_timeout
+        await asyncio.sleep(0.2)
+        assert closed == [1]
+        received = []
+        with pytest.raises(HTTPException) as info:
+            async for chunk in chunks:
+                received.append(chunk)
+        return received, info.value
+
+    received, error = asyncio.run(run())
+    assert error.status_code == 504
+    # 断开前已缓冲的帧仍会写出，且不超过缓冲上限加一帧
+    assert 0 < len("".join(received)) <= 100 + len("data: x\n\n")
+
+
+def test_abort_cancels_upstream_and_ends_stream():
+    closed = []
+
+    async def run():
+        relay = StreamRelay(upstream(closed), max_size=100)
+        chunks = relay.iterate()
+        await chunks.__anext__()
+        relay.abort("disconnect")
+        async for _ in chunks:
+            pass
+
+    asyncio.run(run())
+    assert closed == [1]
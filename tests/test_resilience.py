@@ -0,0 +1,50 @@
+# test_resilience.py
+# 对冲请求：两路都失败时抛出第一个请求的错误
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+
+from config import ResilienceConfig  # noqa: E402
+from resilience import Resilience  # noqa: E402
+
+
+class HedgeConfig(ResilienceConfig):
+    HEDGE_MIN_DELAY = 0.01
+    RETRY_ATTEMPTS = 0
+    BREAKER_ENABLED = False
+
+
+def failing_opener(delays_and_errors):
+    """第i次调用等待delays_and_errors[i][0]秒后抛出对应的HTTPException"""
+    calls = []
+
+    async def opener():
+        attempt = len(calls)
+        delay, status = delays_and_errors[attempt]
+        calls.append(status)
+        await asyncio.sleep(delay)
+        raise HTTPException(status_code=status, detail=f"attempt {attempt + 1}")
+
+    return opener
+
+
+@pytest.mark.parametrize("attempts", [
+    [(0.05, 502), (0.2, 400)],  # 主请求先失败
+    [(0.2, 502), (0.05, 400)],  # 对冲请求先失败
+])
+def test_hedged_raises_primary_error_when_both_fail(attempts):
+    resilience = Resilience(HedgeConfig)
+
+    async def run():
+        with pytest.raises(HTTPException) as info:
+            await resilience.open_hedged(failing_opener(attempts), "m")
+        return info.value
+
+    error = asyncio.run(run())
+    assert (error.status_code, error.detail) == (502, "attempt 1")
@@ -0,0 +1,77 @@
+# test_scheduler.py
+# 调度器：队列满时返回429并附带Retry-After，空出的名额在客户端之间轮询分配
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+
+from scheduler import Scheduler  # noqa: E402
+
+
+def make_scheduler(**overrides):
+    options = dict(global_limit=1, model_limit=1, model_limits={}, queue_size=1, max_wait=5)
+    options.update(overrides)
+    return Scheduler(**options)
+
+
+def test_full_queue_rejects_with_retry_after():
+    scheduler = make_scheduler()
+
+    async def run():
+        lease = await scheduler.acquire("m", "a")
+        waiter = asyncio.create_task(scheduler.acquire("m", "b"))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as info:
+            await scheduler.acquire("m", "c")
+        lease.release()
+        (await waiter).release()
+        return info.value
+
+    error = asyncio.run(run())
+    assert error.status_code == 429
+    assert int(error.headers["Retry-After"]) >= 1
+    assert scheduler.stats()["rejected"] == 1
+    assert scheduler.stats()["active"] == 0
+
+
+def test_wait_timeout_rejects_and_frees_queue_slot():
+    scheduler = make_scheduler(max_wait=0.05)
+
+    async def run():
+        lease = await scheduler.acquire("m", "a")
+        with pytest.raises(HTTPException) as info:
+            await scheduler.acquire("m", "b")
+        lease.release()
+        return info.value
+
+    error = asyncio.run(run())
+    assert error.status_code == 429 and "Retry-After" in error.headers
+    assert scheduler.stats()["waiting"] == 0
+    assert scheduler.stats()["timed_out"] == 1
+
+
+def test_released_slots_rotate_between_clients():
+    scheduler = make_scheduler(queue_size=10)
+    order = []
+
+    async def worker(client):
+        lease = await scheduler.acquire("m", client)
+        order.append(client)
+        await asyncio.sleep(0)
+        lease.release()
+
+    async def run():
+        lease = await scheduler.acquire("m", "busy")
+        # 客户端a先排了三个请求，b随后排了一个
+        tasks = [asyncio.create_task(worker(client)) for client in ("a", "a", "a", "b")]
+        await asyncio.sleep(0)
+        lease.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert order[:2] == ["a", "b"]
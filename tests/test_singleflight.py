@@ -0,0 +1,79 @@
+# test_singleflight.py
+# 请求合并：相同请求共享一个上游流，读取过慢的订阅者被摘除而不影响其他订阅者
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+
+from singleflight import SingleFlight  # noqa: E402
+
+
+def counting_opener(batches, opened):
+    """返回一个opener，每次调用计数并产出batches，批次之间让出事件循环"""
+
+    async def stream():
+        for batch in batches:
+            await asyncio.sleep(0.001)
+            yield batch
+
+    async def opener():
+        opened.append(1)
+        return stream()
+
+    return opener
+
+
+def test_slow_subscriber_is_dropped_without_stalling_others():
+    group = SingleFlight(queue_size=2)
+    batches = [[i] for i in range(10)]
+    opened = []
+
+    async def run():
+        opener = counting_opener(batches, opened)
+        fast = await group.subscribe("k", opener)
+        slow = await group.subscribe("k", opener)
+        received = [batch async for batch in fast]
+        # 慢订阅者先拿到缓冲区中的批次，随后收到504
+        slow_received = []
+        with pytest.raises(HTTPException) as info:
+            async for batch in slow:
+                slow_received.append(batch)
+        return received, slow_received, info.value
+
+    received, slow_received, error = asyncio.run(run())
+    assert opened == [1]
+    assert received == batches
+    assert error.status_code == 504
+    assert slow_received == batches[:2]
+    assert group.stats() == {"in_flight": 0, "leaders": 1, "followers": 1}
+
+
+def test_last_subscriber_leaving_cancels_upstream():
+    group = SingleFlight(queue_size=100)
+    closed = []
+
+    async def stream():
+        try:
+            while True:
+                await asyncio.sleep(0.001)
+                yield [0]
+        finally:
+            closed.append(1)
+
+    async def opener():
+        return stream()
+
+    async def run():
+        subscriber = await group.subscribe("k", opener)
+        await subscriber.__anext__()
+        await subscriber.aclose()
+        await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+    assert closed == [1]
+    assert group.stats()["in_flight"] == 0
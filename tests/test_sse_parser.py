@@ -0,0 +1,108 @@
+# test_sse_parser.py
+# SSEDecoder单元测试：换行方式、跨数据块的多字节字符、多行data、注释行、flush，
+# 以及快速路径与逐字节输入的结果一致
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sse_parser import SSEDecoder, encode_event  # noqa: E402
+
+
+def decode(chunks):
+    """依次feed所有数据块并flush，返回 (data, event, id) 列表"""
+    decoder = SSEDecoder()
+    events = []
+    for chunk in chunks:
+        events += decoder.feed(chunk)
+    events += decoder.flush()
+    return [(event.data, event.event, event.id) for event in events]
+
+
+def split_every(stream: bytes, size: int):
+    return [stream[i:i + size] for i in range(0, len(stream), size)]
+
+
+def test_single_event_per_chunk():
+    chunks = [b'data: {"a": 1}\n\n', b"data: [DONE]\n\n"]
+    assert decode(chunks) == [('{"a": 1}', None, None), ("[DONE]", None, None)]
+
+
+def test_data_without_space_after_colon():
+    assert decode([b"data:x\n\ndata:  y\n\n"]) == [("x", None, None), (" y", None, None)]
+
+
+def test_crlf_line_endings():
+    stream = b"data: a\r\n\r\ndata: b\r\n\r\n"
+    expected = [("a", None, None), ("b", None, None)]
+    assert decode([stream]) == expected
+    assert decode(split_every(stream, 1)) == expected
+    # \r 和 \n 分在两个数据块中
+    assert decode([b"data: a\r", b"\n\r", b"\ndata: b\r\n\r\n"]) == expected
+
+
+def test_cr_line_endings():
+    stream = b"data: a\r\rdata: b\rdata: c\r\r"
+    expected = [("a", None, None), ("b\nc", None, None)]
+    assert decode([stream]) == expected
+    assert decode(split_every(stream, 1)) == expected
+
+
+def test_multibyte_utf8_split_across_chunks():
+    stream = encode_event("你好，世界").encode("utf-8")
+    for cut in range(1, len(stream)):
+        assert decode([stream[:cut], stream[cut:]]) == [("你好，世界", None, None)]
+
+
+def test_multiline_data():
+    stream = b"data: line1\ndata: line2\ndata:\ndata: line4\n\n"
+    assert decode([stream]) == [("line1\nline2\n\nline4", None, None)]
+    assert decode(split_every(stream, 3)) == [("line1\nline2\n\nline4", None, None)]
+
+
+def test_comment_lines_are_ignored():
+    stream = b": keep-alive\n\ndata: a\n: inside\ndata: b\n\n:\n\n"
+    assert decode([stream]) == [("a\nb", None, None)]
+
+
+def test_event_and_id_fields():
+    stream = b"event: delta\nid: 7\ndata: a\n\ndata: b\n\n"
+    assert decode([stream]) == [("a", "delta", "7"), ("b", None, "7")]
+    # event字段与data分在两个数据块中时不能走快速路径丢掉event
+    assert decode([b"event: delta\n", b"data: a\n\n"]) == [("a", "delta", None)]
+
+
+def test_flush_dispatches_trailing_event():
+    # 最后一行没有换行
+    assert decode([b"data: a\n\ndata: tail"]) == [("a", None, None), ("tail", None, None)]
+    # 有完整的data行但缺少结尾的空行
+    assert decode([b"data: a\ndata: b\n"]) == [("a\nb", None, None)]
+    assert decode([b"data: tail\r"]) == [("tail", None, None)]
+
+
+def test_chunking_does_not_change_events():
+    stream = (
+        b"data: one\n\n"
+        b": comment\r\n"
+        b"event: e\r\ndata: two\r\ndata: \xe4\xb8\x89\r\n\r\n"
+        b"id: 9\rdata: four\r\r"
+        b"data: five\n\n"
+        b"data: six"
+    )
+    expected = decode([stream])
+    assert [data for data, _, _ in expected] == ["one", "two\n三", "four", "five", "six"]
+    rng = random.Random(0)
+    for size in (1, 2, 3, 7, 16, 64):
+        assert decode(split_every(stream, size)) == expected
+    for _ in range(200):
+        cuts = sorted(rng.sample(range(1, len(stream)), rng.randint(1, 10)))
+        chunks = [stream[a:b] for a, b in zip([0] + cuts, cuts + [len(stream)])]
+        assert decode(chunks) == expected
+
+
+def test_memoryview_and_bytearray_chunks():
+    stream = b"data: a\n\ndata: b\n\n"
+    assert decode([memoryview(stream)]) == [("a", None, None), ("b", None, None)]
+    assert decode([bytearray(stream)]) == [("a", None, None), ("b", None, None)]
@@ -0,0 +1,49 @@
+# test_state.py
+# 共享状态后端：进程内后端与Unix套接字状态服务的行为一致
+
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import state  # noqa: E402
+from state import LocalStateBackend, SocketStateBackend, serve_state  # noqa: E402
+
+
+async def window_calls(backend, now):
+    """在固定的时间点上依次计入，返回每次window_add的结果"""
+    results = []
+    for offset, amount in [(0, 3), (1, 5), (2, 4), (30, 1), (61, 2), (90, 9), (95, 0), (200, 1)]:
+        now[0] = 1000.0 + offset
+        results.append(await backend.call("window_add", "quota:a", 60, amount, 10))
+    results.append(await backend.call("incr", "counter", 2))
+    results.append(await backend.call("get", "counter"))
+    return results
+
+
+def test_window_add_matches_between_local_and_socket(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(state.time, "time", lambda: now[0])
+
+    async def run(path):
+        local = await window_calls(LocalStateBackend(), now)
+        server = asyncio.create_task(serve_state(path))
+        while not os.path.exists(path):
+            await asyncio.sleep(0.01)
+        backend = SocketStateBackend(path)
+        try:
+            shared = await window_calls(backend, now)
+        finally:
+            await backend._close()
+            server.cancel()
+            await asyncio.gather(server, return_exceptions=True)
+        return local, shared
+
+    with tempfile.TemporaryDirectory() as directory:
+        local, shared = asyncio.run(run(os.path.join(directory, "state.sock")))
+    assert shared == local
+    allowed = [result[0] for result in local[:8]]
+    assert allowed == [True, True, False, True, True, False, True, True]
+    assert local[-1] == 2
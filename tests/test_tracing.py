@@ -0,0 +1,48 @@
+# test_tracing.py
+# 请求ID：客户端重复使用其他请求的ID时不能覆盖已有的Trace
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+import tracing  # noqa: E402
+from tracing import TraceMiddleware, TraceRecorder  # noqa: E402
+
+
+def make_client(monkeypatch):
+    monkeypatch.setattr(tracing, "trace_recorder", TraceRecorder(100))
+    app = FastAPI()
+
+    @app.get("/a")
+    async def a():
+        return {}
+
+    @app.get("/b")
+    async def b():
+        return {}
+
+    app.add_middleware(TraceMiddleware)
+    return TestClient(app)
+
+
+def test_client_request_id_cannot_replace_trace(monkeypatch):
+    client = make_client(monkeypatch)
+    first = client.get("/a", headers={"X-Request-ID": "req-1"})
+    assert first.headers["x-request-id"] == "req-1"
+
+    second = client.get("/b", headers={"X-Request-ID": "req-1"})
+    assert second.headers["x-request-id"] != "req-1"
+    assert tracing.trace_recorder.get("req-1").root.name == "GET /a"
+    assert tracing.trace_recorder.get(second.headers["x-request-id"]).root.name == "GET /b"
+
+
+def test_claimed_request_id_is_unique_while_in_flight():
+    recorder = TraceRecorder(100)
+    assert recorder.claim("req-1")
+    assert not recorder.claim("req-1")
+    recorder.record(tracing.Trace("GET /a", "req-1"))
+    assert not recorder.claim("req-1")
@@ -0,0 +1,256 @@
+# tracing.py
+# 请求阶段追踪：每个请求一个Trace，记录认证、解析、排队、上游连接、首字和转发等阶段的耗时，
+# 通过 X-Request-ID / traceparent 响应头关联，可导出为OpenTelemetry（OTLP JSON）格式
+
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from config import TraceConfig
+from log_utils import get_logger, log_event, request_id_var
+
+logger = get_logger("tracing")
+
+# W3C Trace Context: version-traceid-parentid-flags
+_TRACEPARENT_RE = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+# 当前请求的Trace，由TraceMiddleware设置
+current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+
+
+def _new_id(nbytes: int) -> str:
+    return os.urandom(nbytes).hex()
+
+
+class Span:
+    """一个阶段"""
+
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "attributes")
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: Optional[dict] = None):
+        self.name = name
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes or {}
+
+    def end(self, **attributes):
+        """结束该阶段，重复调用只记录第一次的结束时间"""
+        if attributes:
+            self.attributes.update(attributes)
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return round((end - self.start_ns) / 1e6, 2)
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Trace:
+    """一个请求的所有阶段，根阶段覆盖从收到请求到响应最后一个字节"""
+
+    __slots__ = ("trace_id", "request_id", "spans", "root", "finished")
+
+    def __init__(self, name: str, request_id: Optional[str] = None, traceparent: Optional[str] = None):
+        match = _TRACEPARENT_RE.match(traceparent or "")
+        self.trace_id = match.group(1) if match else _new_id(16)
+        # 不从trace_id派生，traceparent由客户端提供
+        self.request_id = request_id or _new_id(8)
+        self.root = Span(name, match.group(2) if match else None)
+        self.spans = [self.root]
+        self.finished = False
+
+    def start_span(self, name: str, **attributes) -> Span:
+        span = Span(name, self.root.span_id, attributes)
+        self.spans.append(span)
+        return span
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.root.span_id}-01"
+
+    def phases(self) -> Dict[str, float]:
+        """各阶段耗时（毫秒），同名阶段（例如多次上游连接尝试）累加"""
+        phases: Dict[str, float] = {}
+        for span in self.spans[1:]:
+            phases[span.name] = round(phases.get(span.name, 0) + span.duration_ms, 2)
+        return phases
+
+    def summary(self) -> dict:
+        return {
+            "request_id": self.request_id,
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "status": self.root.attributes.get("http.status_code"),
+            "duration_ms": self.root.duration_ms,
+            "phases": self.phases(),
+        }
+
+    def to_otlp(self) -> dict:
+        """导出为OTLP JSON（ExportTraceServiceRequest）"""
+        spans = []
+        for span in self.spans:
+            entry = {
+                "traceId": self.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": 2 if span is self.root else 1,
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns if span.end_ns is not None else time.time_ns()),
+                "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+            }
+            if span.parent_id:
+                entry["parentSpanId"] = span.parent_id
+            spans.append(entry)
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "rkui2api"}}]},
+            "scopeSpans": [{"scope": {"name": "rkui2api.tracing"}, "spans": spans}],
+        }]}
+
+
+class TraceRecorder:
+    """保存最近完成的Trace（进程内），按请求ID查询
+
+    客户端提供的请求ID需先通过claim占用，已被进行中或已保存的请求使用时不能再用，
+    避免其他请求覆盖同一ID下的Trace。
+    """
+
+    def __init__(self, max_traces: int):
+        self.max_traces = max_traces
+        self._traces: "OrderedDict[str, Trace]" = OrderedDict()
+        # 进行中的请求使用的客户端请求ID
+        self._claimed: set = set()
+
+    def claim(self, request_id: str) -> bool:
+        """占用一个客户端提供的请求ID，已被占用或已有同ID的Trace时返回False"""
+        if request_id in self._claimed or request_id in self._traces:
+            return False
+        self._claimed.add(request_id)
+        return True
+
+    def record(self, trace: Trace):
+        self._claimed.discard(trace.request_id)
+        self._traces[trace.request_id] = trace
+        self._traces.move_to_end(trace.request_id)
+        while len(self._traces) > self.max_traces:
+            self._traces.popitem(last=False)
+
+    def get(self, request_id: str) -> Optional[Trace]:
+        return self._traces.get(request_id)
+
+    def recent(self, limit: int) -> list:
+        traces = list(self._traces.values())[-limit:]
+        return [trace.summary() for trace in reversed(traces)]
+
+
+# 全局Trace记录器
+trace_recorder = TraceRecorder(TraceConfig.BUFFER_SIZE)
+
+
+def start_span(name: str, **attributes) -> Optional[Span]:
+    """在当前请求的Trace中开始一个阶段，不在请求中或追踪关闭时返回None
+
+    用于跨越yield的阶段（例如流式转发），需由调用方调用end()。
+    """
+    trace = current_trace.get()
+    return trace.start_span(name, **attributes) if trace is not None else None
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """记录一段同步代码或一次await的耗时
+
+    用法:
+        with span("parse_body"):
+            body = json_loads(await request.body())
+    """
+    trace = current_trace.get()
+    if trace is None:
+        yield None
+        return
+    current = trace.start_span(name, **attributes)
+    try:
+        yield current
+    except BaseException as e:
+        current.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        current.end()
+
+
+def finish_trace(trace: Trace):
+    """结束Trace：记录到内存缓冲，超过TRACE_SLOW_MS时记录一条带各阶段耗时的日志"""
+    if trace.finished:
+        return
+    trace.finished = True
+    trace.root.end()
+    trace_recorder.record(trace)
+    if TraceConfig.SLOW_MS and trace.root.duration_ms >= TraceConfig.SLOW_MS:
+        log_event(logger, logging.WARNING, "slow_request", **trace.summary())
+
+
+class TraceMiddleware:
+    """ASGI中间件：为每个HTTP请求创建Trace，并在响应头中返回 X-Request-ID 和 traceparent
+
+    以响应的最后一个数据块为结束时间，因此流式响应的转发阶段也包含在内。
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.exclude = TraceConfig.get_exclude_paths()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not TraceConfig.ENABLED or scope["path"] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+
+        request_id = traceparent = None
+        for key, value in scope["headers"]:
+            if key == b"x-request-id":
+                candidate = value.decode("latin-1")
+                request_id = candidate if _REQUEST_ID_RE.match(candidate) else None
+            elif key == b"traceparent":
+                traceparent = value.decode("latin-1")
+
+        if request_id is not None and not trace_recorder.claim(request_id):
+            # 该ID已被其他请求使用，改用服务端生成的ID
+            request_id = None
+        trace = Trace(f"{scope['method']} {scope['path']}", request_id, traceparent)
+        trace_token = current_trace.set(trace)
+        request_token = request_id_var.set(trace.request_id)
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                trace.root.attributes["http.status_code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-request-id", trace.request_id.encode("latin-1")),
+                    (b"traceparent", trace.traceparent.encode("latin-1")),
+                ]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finish_trace(trace)
+
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            finish_trace(trace)
+            request_id_var.reset(request_token)
+            current_trace.reset(trace_token)
@@ -0,0 +1,176 @@
+# upstreams.py
+# 上游池模块：多个上游地址/镜像的负载均衡、被动健康检查和故障转移
+
+import json
+import logging
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from config import UpstreamConfig
+from log_utils import get_logger, log_event
+from models import model_registry
+
+logger = get_logger("upstreams")
+
+# 负载均衡策略
+LEAST_OUTSTANDING = "least_outstanding"
+EWMA = "ewma"
+
+
+def resolve_model(name: str) -> str:
+    """把上游配置中的模型名称（对外ID、别名或映射后名称）统一为映射后名称
+
+    Raises:
+        ValueError: 不在模型注册表中的名称
+    """
+    spec = model_registry.find(name)
+    if spec is None:
+        raise ValueError(f"Unknown model in upstream config: {name}")
+    return spec.name
+
+
+class Upstream:
+    """一个上游地址及其请求头、可用模型和运行状态"""
+
+    def __init__(self, url: str, name: Optional[str] = None, headers: Optional[Dict[str, str]] = None,
+                 models: Optional[List[str]] = None, weight: float = 1.0):
+        """
+        Args:
+            url: 聊天接口地址
+            name: 显示名称，默认取主机名
+            headers: 覆盖默认浏览器请求头的字段
+            models: 该上游可用的模型，None表示全部
+            weight: 权重，越大分到的请求越多
+        """
+        parts = urlsplit(url)
+        self.url = url
+        self.name = name or parts.netloc
+        self.origin = f"{parts.scheme}://{parts.netloc}"
+        self.header_overrides = headers or {}
+        self.models = frozenset(resolve_model(m) for m in models) if models else None
+        self.weight = max(float(weight), 0.01)
+
+        self.outstanding = 0
+        # 响应头到达耗时的指数滑动平均（秒）
+        self.latency_ewma: Optional[float] = None
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    def serves(self, model: str) -> bool:
+        return self.models is None or model in self.models
+
+    def healthy(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def score(self, strategy: str) -> float:
+        """分数越低越优先"""
+        load = (self.outstanding + 1) / self.weight
+        if strategy == EWMA and self.latency_ewma is not None:
+            return self.latency_ewma * load
+        return load
+
+
+class UpstreamPool:
+    """上游池
+
+    按策略为每次请求排序候选上游：least_outstanding 选在途请求最少的，
+    ewma 选 响应耗时EWMA × 在途请求数 最小的。连续失败的上游被暂时摘除（被动健康检查），
+    冷却期过后重新参与选择；所有上游都被摘除时仍按分数尝试，避免整体不可用。
+    """
+
+    def __init__(self, upstreams: List[Upstream], strategy: str, eject_failures: int, eject_cooldown: float):
+        """
+        Args:
+            upstreams: 上游列表
+            strategy: 负载均衡策略，least_outstanding 或 ewma
+            eject_failures: 连续失败多少次后摘除
+            eject_cooldown: 摘除时长（秒）
+        """
+        if not upstreams:
+            raise ValueError("Upstream pool is empty")
+        self.upstreams = upstreams
+        self.strategy = strategy
+        self.eject_failures = eject_failures
+        self.eject_cooldown = eject_cooldown
+
+    def candidates(self, model: str) -> List[Upstream]:
+        """返回可用于该模型的上游，按优先级排序，被摘除的排在最后"""
+        now = time.monotonic()
+        serving = [u for u in self.upstreams if u.serves(model)] or self.upstreams
+        return sorted(serving, key=lambda u: (not u.healthy(now), u.score(self.strategy)))
+
+    def begin(self, upstream: Upstream):
+        upstream.outstanding += 1
+        upstream.requests += 1
+
+    def end(self, upstream: Upstream):
+        upstream.outstanding -= 1
+
+    def record_latency(self, upstream: Upstream, seconds: float):
+        previous = upstream.latency_ewma
+        upstream.latency_ewma = seconds if previous is None else previous * 0.8 + seconds * 0.2
+
+    def record_success(self, upstream: Upstream):
+        upstream.failures = 0
+
+    def record_failure(self, upstream: Upstream):
+        upstream.errors += 1
+        upstream.failures += 1
+        if upstream.failures >= self.eject_failures:
+            upstream.ejected_until = time.monotonic() + self.eject_cooldown
+            upstream.failures = 0
+            log_event(logger, logging.WARNING, "upstream_ejected", upstream=upstream.name,
+                      cooldown=self.eject_cooldown)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "strategy": self.strategy,
+            "upstreams": [
+                {
+                    "name": u.name,
+                    "url": u.url,
+                    "healthy": u.healthy(now),
+                    "outstanding": u.outstanding,
+                    "latency_ewma": round(u.latency_ewma, 4) if u.latency_ewma is not None else None,
+                    "requests": u.requests,
+                    "errors": u.errors,
+                }
+                for u in self.upstreams
+            ],
+        }
+
+
+def load_upstreams() -> List[Upstream]:
+    """从UPSTREAMS读取上游列表，未配置时只使用UPSTREAM_URL
+
+    UPSTREAMS 是JSON数组，每项为上游地址字符串或对象：
+    {"url": ..., "name": ..., "headers": {...}, "models": [...], "weight": 1}
+    """
+    if not UpstreamConfig.UPSTREAMS.strip():
+        return [Upstream(UpstreamConfig.URL)]
+
+    upstreams = []
+    for item in json.loads(UpstreamConfig.UPSTREAMS):
+        if isinstance(item, str):
+            item = {"url": item}
+        upstreams.append(Upstream(
+            url=item["url"],
+            name=item.get("name"),
+            headers=item.get("headers"),
+            models=item.get("models"),
+            weight=item.get("weight", 1.0),
+        ))
+    return upstreams
+
+
+# 全局上游池实例
+upstream_pool = UpstreamPool(
+    load_upstreams(),
+    strategy=UpstreamConfig.BALANCE,
+    eject_failures=UpstreamConfig.EJECT_FAILURES,
+    eject_cooldown=UpstreamConfig.EJECT_COOLDOWN,
+)
@@ -0,0 +1,135 @@
+# usage.py
+# 用量统计模块：可替换的分词器、按消息内容哈希缓存的提示词token数、增量累计的补全token数
+
+import hashlib
+import logging
+import re
+from collections import OrderedDict
+from typing import Optional
+
+from config import UsageConfig
+from log_utils import get_logger, log_event
+
+logger = get_logger("usage")
+
+# 每条消息的格式开销与回复引导开销（与OpenAI的计数方式一致）
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+# 近似分词：每个CJK字符一个token，连续字母按4个一组，数字按3个一组，其他符号各一个
+_APPROX_TOKEN_RE = re.compile(
+    r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]"
+    r"|[A-Za-z]{1,4}|\d{1,3}|[^\sA-Za-z\d]"
+)
+
+
+class ApproxTokenizer:
+    """不依赖第三方库的近似分词器"""
+
+    name = "approx"
+
+    def count(self, text: str) -> int:
+        return len(_APPROX_TOKEN_RE.findall(text))
+
+
+class TiktokenTokenizer:
+    """基于tiktoken的分词器"""
+
+    def __init__(self, encoding: str):
+        import tiktoken
+        self.name = f"tiktoken:{encoding}"
+        self._encoding = tiktoken.get_encoding(encoding)
+
+    def count(self, text: str) -> int:
+        return len(self._encoding.encode_ordinary(text))
+
+
+def create_tokenizer(spec: str):
+    """根据USAGE_TOKENIZER创建分词器，tiktoken不可用时回退到近似分词
+
+    Args:
+        spec: approx 或 tiktoken[:编码名]
+    """
+    kind, _, encoding = spec.partition(":")
+    if kind == "tiktoken":
+        try:
+            return TiktokenTokenizer(encoding or "cl100k_base")
+        except Exception as e:
+            log_event(logger, logging.WARNING, "tokenizer_unavailable", tokenizer=spec, error=str(e))
+    return ApproxTokenizer()
+
+
+tokenizer = create_tokenizer(UsageConfig.TOKENIZER)
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """统计一段文本的token数"""
+    return tokenizer.count(text) if text else 0
+
+
+def _message_text(message) -> str:
+    """取出消息中参与计数的文本，兼容content为分段列表的格式"""
+    if not isinstance(message, dict):
+        return str(message)
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return f"{message.get('role', '')}\n{content}"
+
+
+class PromptCounter:
+    """提示词token计数，按消息内容哈希做LRU缓存
+
+    多轮对话中前面的消息每次都会重复发送，缓存后每条消息只分词一次。
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._memo: "OrderedDict[bytes, int]" = OrderedDict()
+
+    def count(self, messages) -> int:
+        """整个消息列表的提示词token数"""
+        return TOKENS_PER_REPLY + sum(self.count_message(message) for message in messages or ())
+
+    def count_message(self, message) -> int:
+        """单条消息的token数（含格式开销）"""
+        text = _message_text(message)
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        tokens = self._memo.get(key)
+        if tokens is None:
+            tokens = count_tokens(text)
+            self._memo[key] = tokens
+            if len(self._memo) > self.max_entries:
+                self._memo.popitem(last=False)
+        else:
+            self._memo.move_to_end(key)
+        return tokens + TOKENS_PER_MESSAGE
+
+
+prompt_counter = PromptCounter(UsageConfig.MEMO_SIZE)
+
+
+class Usage:
+    """一次请求的用量，补全token随内容增量累计"""
+
+    __slots__ = ("prompt_tokens", "completion_tokens")
+
+    def __init__(self, prompt_tokens: int = 0):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = 0
+
+    @classmethod
+    def for_messages(cls, messages) -> "Usage":
+        return cls(prompt_counter.count(messages))
+
+    def add(self, text: Optional[str]):
+        """累计一段补全内容（正文或推理内容）"""
+        if text:
+            self.completion_tokens += tokenizer.count(text)
+
+    def as_dict(self) -> dict:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.prompt_tokens + self.completion_tokens,
+        }
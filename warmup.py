@@ -0,0 +1,130 @@
+# warmup.py
+# 启动预热：启动后预先解析上游域名并建立连接（含TLS握手）放入共享连接池，
+# 第一个请求不再承担DNS、TCP和TLS的耗时；预热完成前 /ready 返回503
+
+import asyncio
+import logging
+import socket
+import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+from api_client import get_client, build_upstream_headers
+from config import WarmupConfig
+from log_utils import get_logger, log_event, elapsed_ms
+from state import state_backend
+from upstreams import upstream_pool, Upstream
+
+logger = get_logger("warmup")
+
+
+class Readiness:
+    """本进程的就绪状态
+
+    至少一个上游的连接预热成功后就绪；全部失败时按 WARMUP_RETRY_INTERVAL 重试，期间保持未就绪，
+    负载均衡或编排系统据此不把流量分给还没有可用连接的进程。
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.started_at = time.perf_counter()
+        self.ready_after_ms: Optional[float] = None
+        self.attempts = 0
+        self.upstreams: Dict[str, dict] = {}
+
+    def mark_ready(self):
+        if not self.ready:
+            self.ready = True
+            self.ready_after_ms = elapsed_ms(self.started_at)
+            log_event(logger, logging.INFO, "ready", after_ms=self.ready_after_ms, attempts=self.attempts)
+
+    def status(self) -> dict:
+        return {
+            "status": "ready" if self.ready else "warming",
+            "ready_after_ms": self.ready_after_ms,
+            "attempts": self.attempts,
+            "upstreams": self.upstreams,
+        }
+
+
+# 全局就绪状态
+readiness = Readiness()
+
+
+async def _resolve(upstream: Upstream):
+    """解析上游域名，单独计时以便区分DNS和连接的问题"""
+    parts = urlsplit(upstream.url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    await asyncio.get_running_loop().getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM)
+
+
+async def _open_connection(upstream: Upstream):
+    """发送一个HEAD请求，建立的连接在响应后留在连接池中；任何HTTP状态码都说明连接可用"""
+    await get_client().head(upstream.url, headers=build_upstream_headers(upstream))
+
+
+async def warm_upstream(upstream: Upstream, connections: int) -> dict:
+    """预热一个上游：解析域名，再并发建立connections条连接
+
+    Returns:
+        各阶段耗时与结果，ok表示至少建立了一条连接
+    """
+    result = {"ok": False, "dns_ms": None, "connect_ms": None, "connections": 0, "error": None}
+    started = time.perf_counter()
+    try:
+        await _resolve(upstream)
+        result["dns_ms"] = elapsed_ms(started)
+        started = time.perf_counter()
+        outcomes = await asyncio.gather(*(_open_connection(upstream) for _ in range(max(connections, 1))),
+                                        return_exceptions=True)
+        result["connect_ms"] = elapsed_ms(started)
+        errors = [outcome for outcome in outcomes if isinstance(outcome, Exception)]
+        result["connections"] = len(outcomes) - len(errors)
+        result["ok"] = result["connections"] > 0
+        if errors:
+            result["error"] = f"{type(errors[0]).__name__}: {errors[0]}"
+    except (OSError, UnicodeError) as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+async def _warm_state_backend():
+    """多进程部署时预先建立到状态服务的连接"""
+    if state_backend.shared:
+        await state_backend.call("get", "warmup")
+
+
+async def warm_up() -> bool:
+    """预热一轮所有上游，返回是否至少有一个上游可用"""
+    readiness.attempts += 1
+    started = time.perf_counter()
+    try:
+        results = await asyncio.wait_for(
+            asyncio.gather(*(warm_upstream(u, WarmupConfig.CONNECTIONS) for u in upstream_pool.upstreams)),
+            timeout=WarmupConfig.TIMEOUT,
+        )
+    except asyncio.TimeoutError:
+        results = [{"ok": False, "error": f"timed out after {WarmupConfig.TIMEOUT}s"} for _ in upstream_pool.upstreams]
+    for upstream, result in zip(upstream_pool.upstreams, results):
+        readiness.upstreams[upstream.name] = result
+    ok = any(result["ok"] for result in results)
+    log_event(logger, logging.INFO if ok else logging.WARNING, "warmup", attempt=readiness.attempts, ok=ok,
+              duration_ms=elapsed_ms(started), upstreams=readiness.upstreams)
+    return ok
+
+
+async def warm_up_forever():
+    """启动后在后台运行：预热直到成功后标记就绪，按需定期重新预热保持连接池里有空闲连接"""
+    if not WarmupConfig.ENABLED:
+        readiness.mark_ready()
+        return
+    try:
+        await _warm_state_backend()
+    except (OSError, RuntimeError) as e:
+        log_event(logger, logging.WARNING, "warmup_state_failed", error=str(e))
+    while not await warm_up():
+        await asyncio.sleep(WarmupConfig.RETRY_INTERVAL)
+    readiness.mark_ready()
+    while WarmupConfig.REFRESH_INTERVAL > 0:
+        await asyncio.sleep(WarmupConfig.REFRESH_INTERVAL)
+        await warm_up()